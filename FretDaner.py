@@ -1,21 +1,32 @@
-import itertools
+import argparse
+import copy
+import hashlib
 import json
-from typing import List
+import os
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stderr, redirect_stdout
+from typing import Any, Callable, Dict, List, Tuple
 from tqdm import tqdm
 
-from src.HandPoseRecorder import HandPoseRecordPool, HandPoseRecorder, RightHandRecorder
-from src.animate.animate import leftHand2Animation, rightHand2Animation, ElectronicRightHand2Animation, addPitchwheel, animated_guitar_string
+from src.HandPoseRecorder import HandPoseNode, HandPoseRecordPool, HandPoseRecorder, OnlineDecoder, RightHandRecorder, flattenRecorders, unflattenRecorders
+from src.animate.animate import leftHand2Animation, rightHand2Animation, ElectronicRightHand2Animation, insertPitchwheel, animated_guitar_string, updateAnimation
 from src.guitar.Guitar import Guitar
 from src.guitar.GuitarString import createGuitarStrings
 from src.guitar.MusicNote import MusicNote
 from src.hand.LeftFinger import LeftFinger
-from src.hand.LeftHand import LeftHand
-from src.hand.RightHand import RightHand, generatePossibleRightHands
-from src.midi.midiToNote import calculate_frame, get_tempo_changes, midiToGuitarNotes, processedNotes
-from src.utils.utils import convertChordTofingerPositions, convertNotesToChord
+from src.hand.LeftHand import LeftHand, caculateDiffMatrix
+from src.hand.RightHand import RightHand, caculateRightHandDiffMatrix, fingerMask, generatePossibleRightHands
+from src.midi.midiToNote import TempoMap, get_tempo_changes, midiToGuitarNotes, processedNotes
+from src.utils.utils import convertNotesToChord, convertNotesToFingerPositions
+from src.utils.fingering_cache import FingeringCache, getFingeringCachePath
+from src.utils.right_hand_table import RightHandFingeringTable, getRightHandTablePath
+from src.utils.columnar import COLUMNAR_EXTENSION, loadRecords, saveRecords
+from src.utils.checkpoint import SearchCheckpoint, SearchSnapshots, fingerprintOf, getCheckpointPath
 
 
-def generateLeftHandRecoder(guitarNote, guitar: Guitar, handPoseRecordPool: HandPoseRecordPool, current_recoreder_num: int, previous_recoreder_num: int):
+def generateLeftHandRecoder(guitarNote, guitar: Guitar, handPoseRecordPool: HandPoseRecordPool, current_recoreder_num: int, previous_recoreder_num: int, fingeringCache: FingeringCache | None = None):
     notes = guitarNote.get("notes", False)
     if notes == False:
         return current_recoreder_num, previous_recoreder_num
@@ -24,51 +35,118 @@ def generateLeftHandRecoder(guitarNote, guitar: Guitar, handPoseRecordPool: Hand
     max_note = guitar.guitarStrings[0].getBaseNote() + 22
     notes = processedNotes(notes, min_note, max_note)
 
-    # calculate all possible chords, including the position information of notes on the guitar. 计算所有可能的和弦,包含音符在吉它上的位置信息。
-    chords = convertNotesToChord(notes, guitar)
-
     # init current record list. 记录池先更新初始化当前记录列表。
     handPoseRecordPool.readyForRecord()
-    fingerPositionsList = []
-    handPoseRecordCount = 0
 
-    # calculate all possible fingerings, including the position information of fingers on the guitar. 计算所有可能的按法，包含手指在吉它上的位置信息。
-    for chord in chords:
-        possibleFingerPositions = convertChordTofingerPositions(chord)
-        if len(possibleFingerPositions) == 0:
-            continue
-        fingerPositionsList += possibleFingerPositions
+    # calculate all possible fingerings of all possible chords, including the position information of fingers on the guitar. 计算所有可能和弦的所有可能按法，包含手指在吉它上的位置信息。
+    # 同样的音符组在曲子里会反复出现，有缓存时直接从缓存里读取
+    if fingeringCache is not None:
+        fingerPositionsList = fingeringCache.getFingerPositions(notes, guitar)
+    else:
+        fingerPositionsList = convertNotesToFingerPositions(notes, guitar)
 
     if len(fingerPositionsList) == 0:
+        chords = convertNotesToChord(notes, guitar)
         print(
             f"当前时间是{real_tick}，当前notes是{notes},没有找到合适的按法。这是所有的chords：{chords}。")
 
-    for handPoseRecord, fingerPositions in itertools.product(handPoseRecordPool.preHandPoseRecordPool, fingerPositionsList):
-        oldhand = handPoseRecord.currentHandPose()
-
-        # Iterate through the list of fingerings, generate a new LeftHand object based on the fingering. 遍历按法列表，根据按法生成新的LeftHand对象。
-        all_fingers, entropy, use_barre = oldhand.generateNextHands(
-            guitar, fingerPositions)
-
-        if all_fingers is not None:
-            new_entropy = handPoseRecord.currentEntropy + entropy
-            insert_index = handPoseRecordPool.check_insert_index(new_entropy)
-            # 当新手型符合插入记录器条件时
-            if insert_index != -1:
-                newHandPoseRecord = HandPoseRecorder()
-                new_hand = LeftHand(all_fingers, use_barre)
-
-                newHandPoseRecord.handPoseList = handPoseRecord.handPoseList + \
-                    [new_hand]
-                newHandPoseRecord.currentEntropy = handPoseRecord.currentEntropy + entropy
-                newHandPoseRecord.entropys = handPoseRecord.entropys + \
-                    [new_entropy]
-                newHandPoseRecord.real_ticks = handPoseRecord.real_ticks + \
-                    [real_tick]
-
-                handPoseRecordPool.insert_new_hand_pose_recorder(
-                    newHandPoseRecord, insert_index)
-                handPoseRecordCount += 1
+    prevHandPoseRecords = handPoseRecordPool.preHandPoseRecordPool
+    prevHands = [handPoseRecord.currentHandPose()
+                 for handPoseRecord in prevHandPoseRecords]
+    prevEntropys = np.array(
+        [handPoseRecord.currentEntropy for handPoseRecord in prevHandPoseRecords], dtype=float)
+    # 每一对(旧记录器, 按法)的熵和总熵，不合法的组合总熵为inf
+    pairEntropys = np.zeros((len(prevHands), len(fingerPositionsList)))
+    pairTotalEntropys = np.full(
+        (len(prevHands), len(fingerPositionsList)), np.inf)
+    # 每一对组合生成的新手指和是否横按
+    pairHands = {}
+    # 与旧手型无关的候选手型，同一个按法在换把时生成的手型只和旧手型是否在低把位有关
+    sharedFingers = []
+    sharedPositions = []
+    sharedTargets = []
+
+    # Iterate through the list of fingerings, generate a new LeftHand object based on the fingering. 遍历按法列表，根据按法生成新的LeftHand对象。
+    for fingerIndex, fingerPositions in enumerate(fingerPositionsList):
+        newHandPosition = LeftHand.calculateNextHandPosition(fingerPositions)
+        groups = {}
+        for prevIndex, oldhand in enumerate(prevHands):
+            # 不换把时新手型会保留旧手型的手指，只能逐个生成
+            if newHandPosition is None or oldhand.handPosition == newHandPosition:
+                all_fingers, entropy, use_barre = oldhand.generateNextHands(
+                    guitar, fingerPositions)
+                if all_fingers is not None:
+                    pairEntropys[prevIndex, fingerIndex] = entropy
+                    pairTotalEntropys[prevIndex, fingerIndex] = prevEntropys[prevIndex] + entropy
+                    pairHands[prevIndex, fingerIndex] = (
+                        all_fingers, use_barre)
+            else:
+                groups.setdefault(oldhand.handPosition < 10,
+                                  []).append(prevIndex)
+
+        for prevIndexes in groups.values():
+            all_fingers, _, use_barre = prevHands[prevIndexes[0]].generateNextHands(
+                guitar, fingerPositions)
+            if all_fingers is not None:
+                sharedFingers.append(all_fingers)
+                sharedPositions.append(newHandPosition)
+                sharedTargets.append((fingerIndex, prevIndexes, use_barre))
+
+    # 换把的候选手型用一次矩阵运算算出所有的熵
+    if sharedFingers:
+        diffMatrix = caculateDiffMatrix(
+            prevHands, sharedFingers, sharedPositions, guitar)
+        for sharedIndex, (fingerIndex, prevIndexes, use_barre) in enumerate(sharedTargets):
+            entropys = diffMatrix[prevIndexes, sharedIndex]
+            pairEntropys[prevIndexes, fingerIndex] = entropys
+            pairTotalEntropys[prevIndexes, fingerIndex] = prevEntropys[prevIndexes] + entropys
+            for prevIndex in prevIndexes:
+                pairHands[prevIndex, fingerIndex] = (
+                    sharedFingers[sharedIndex], use_barre)
+
+    # 按(旧记录器, 按法)的原顺序稳定排序，与逐个插入记录池的结果一致
+    flatTotalEntropys = pairTotalEntropys.ravel()
+    handPoseRecordCount = int(np.isfinite(flatTotalEntropys).sum())
+    order = np.argsort(flatTotalEntropys, kind="stable")
+    if handPoseRecordPool.merge_states:
+        # 同一状态只有排在最前面的候选会被记录池留下，先把其它候选去掉，省掉复制手指和生成手型
+        order = order[:handPoseRecordCount]
+        states = {}
+        candidateStates = {}
+        stateIds = []
+        for flatIndex in order.tolist():
+            all_fingers, use_barre = pairHands[divmod(
+                flatIndex, len(fingerPositionsList))]
+            candidate = (id(all_fingers), use_barre)
+            stateId = candidateStates.get(candidate)
+            if stateId is None:
+                stateId = states.setdefault(LeftHand.candidateStateKey(
+                    all_fingers, use_barre), len(states))
+                candidateStates[candidate] = stateId
+            stateIds.append(stateId)
+        _, firstIndexes = np.unique(
+            np.array(stateIds, dtype=np.intp), return_index=True)
+        order = order[np.sort(firstIndexes)]
+    for flatIndex in order:
+        new_entropy = flatTotalEntropys[flatIndex]
+        if not np.isfinite(new_entropy):
+            break
+        insert_index = handPoseRecordPool.check_insert_index(new_entropy)
+        # 当新手型符合插入记录器条件时
+        if insert_index == -1:
+            break
+        prevIndex, fingerIndex = divmod(
+            int(flatIndex), len(fingerPositionsList))
+        all_fingers, use_barre = pairHands[prevIndex, fingerIndex]
+        # 共享的候选手指会被LeftHand修改，每个新手型都用自己的一份
+        new_hand = LeftHand([copy.copy(finger)
+                            for finger in all_fingers], use_barre)
+        # 新记录器与旧记录器共享之前的路径，不再复制整个列表
+        newHandPoseRecord = prevHandPoseRecords[prevIndex].extend(
+            new_hand, float(pairEntropys[prevIndex, fingerIndex]), real_tick)
+
+        handPoseRecordPool.insert_new_hand_pose_recorder(
+            newHandPoseRecord, insert_index)
 
     previous_recoreder_num = current_recoreder_num
     current_recoreder_num = len(handPoseRecordPool.curHandPoseRecordPool)
@@ -94,28 +172,197 @@ def generateLeftHandRecoder(guitarNote, guitar: Guitar, handPoseRecordPool: Hand
         ]
         defalut_hand = LeftHand(defalut_fingers)
         for handrecoder in handPoseRecordPool.preHandPoseRecordPool:
-            new_handrecoder = HandPoseRecorder()
-            new_handrecoder.handPoseList = handrecoder.handPoseList + \
-                [defalut_hand]
-            new_handrecoder.currentEntropy = handrecoder.currentEntropy
-            new_handrecoder.entropys = handrecoder.entropys + [0]
-            new_handrecoder.real_ticks = handrecoder.real_ticks + [real_tick]
+            new_handrecoder = handrecoder.extend(defalut_hand, 0, real_tick)
             handPoseRecordPool.insert_new_hand_pose_recorder(
                 new_handrecoder, 0)
 
     return current_recoreder_num, previous_recoreder_num
 
 
-def update_recorder_pool(total_steps: int, guitar: Guitar, handPoseRecordPool: HandPoseRecordPool, notes_map, current_recoreder_num, previous_recoreder_num):
-    with tqdm(total=total_steps, desc="Processing", ncols=100, unit="step") as progress:
-        for i in range(0, total_steps):
+def update_recorder_pool(total_steps: int, guitar: Guitar, handPoseRecordPool: HandPoseRecordPool, notes_map, current_recoreder_num, previous_recoreder_num, fingeringCache: FingeringCache | None = None, decoder: OnlineDecoder | None = None, checkpoint: SearchCheckpoint | None = None, start_step: int = 0):
+    """
+    :param decoder: commits the finished part of the path after every event. 每个事件之后提交已经确定的路径
+    :param checkpoint: saves the pool periodically. 定期保存记录池
+    :param start_step: number of events already processed, used when resuming from a checkpoint. 已经处理过的事件数，从检查点恢复时使用
+    """
+    with tqdm(total=total_steps, initial=start_step, desc="Processing", ncols=100, unit="step") as progress:
+        for i in range(start_step, total_steps):
             guitarNote = notes_map[i]
             current_recoreder_num, previous_recoreder_num = generateLeftHandRecoder(
-                guitarNote, guitar, handPoseRecordPool, current_recoreder_num, previous_recoreder_num)
+                guitarNote, guitar, handPoseRecordPool, current_recoreder_num, previous_recoreder_num, fingeringCache)
+            if decoder is not None:
+                decoder.update(handPoseRecordPool)
+            if checkpoint is not None:
+                checkpoint.update(handPoseRecordPool, i + 1, total_steps)
             progress.update(1)
 
 
-def generateRightHandRecoder(item, rightHandRecordPool, current_recoreder_num, previous_recoreder_num, max_string_index):
+def solve_left_hand_exact(guitar: Guitar, notes_map, fingeringCache: FingeringCache | None = None, max_states: int = 20000, decoder: OnlineDecoder | None = None) -> Tuple[HandPoseRecordPool, Dict[str, Any]]:
+    """
+    find the left hand sequence with the lowest entropy by dynamic programming over (event, hand state). 在(事件, 手型状态)组成的分层图上用动态规划求熵最小的左手序列
+    转移的熵只和相邻两个手型有关，所以每一层的每种手型状态只需要保留熵最小的路径，其它路径之后的转移完全相同，不可能更优
+    :param max_states: memory bound of states in a layer, the best ones are kept when it is exceeded and the result is no longer guaranteed optimal. 每一层最多保留的状态数，超过时只保留最好的那些，结果不再保证是最优解
+    :param decoder: commits the finished part of the path after every event. 每个事件之后提交已经确定的路径
+    :return: the recorder pool and {"exact": whether the result is optimal, "max_layer_states": largest layer}. 记录池，以及{"exact": 结果是否是最优解, "max_layer_states": 最大的一层的状态数}
+    """
+    handPoseRecordPool = createInitLeftHandPool(guitar, max_states, True)
+    current_recoreder_num = 0
+    previous_recoreder_num = 0
+    max_layer_states = 0
+    with tqdm(total=len(notes_map), desc="Exact", ncols=100, unit="step") as progress:
+        for guitarNote in notes_map:
+            current_recoreder_num, previous_recoreder_num = generateLeftHandRecoder(
+                guitarNote, guitar, handPoseRecordPool, current_recoreder_num, previous_recoreder_num, fingeringCache)
+            max_layer_states = max(max_layer_states, len(
+                handPoseRecordPool.curHandPoseRecordPool))
+            if decoder is not None:
+                decoder.update(handPoseRecordPool)
+            progress.update(1)
+
+    return handPoseRecordPool, {
+        "exact": not handPoseRecordPool.truncated,
+        "max_layer_states": max_layer_states,
+    }
+
+
+def createInitLeftHandPool(guitar: Guitar, size: int = 100, merge_states: bool = False) -> HandPoseRecordPool:
+    """
+    create a recorder pool with the initial left hand. 生成一个只包含初始左手的记录池
+    :param merge_states: see HandPoseRecordPool. 见HandPoseRecordPool
+    """
+    guitar_string_list = guitar.guitarStrings
+    # 设定各手指状态
+    leftFingers = [
+        LeftFinger(1, guitar_string_list[2], 1),
+        LeftFinger(2, guitar_string_list[2], 2),
+        LeftFinger(3, guitar_string_list[2], 3),
+        LeftFinger(4, guitar_string_list[2], 4)
+    ]
+    # 初始化左手
+    initLeftHand = LeftHand(leftFingers)
+    # 初始化第一个记录器
+    handPoseRecord = HandPoseRecorder()
+    handPoseRecord.addHandPose(initLeftHand, 0, 0)
+    # 初始化记录池
+    handPoseRecordPool = HandPoseRecordPool(size, merge_states)
+    handPoseRecordPool.insert_new_hand_pose_recorder(handPoseRecord, 0)
+    return handPoseRecordPool
+
+
+def findSegmentBreaks(notes_map, guitar: Guitar, min_rest_ticks: float, segment_count: int, min_segment_length: int = 64) -> List[int]:
+    """
+    find where to split the song for segmented search, only long rests and open-string-only events are used. 找到分段搜索时曲子的切分点，只在长休止和纯空弦音处切分
+    :param min_rest_ticks: the minimum gap between two events to be a long rest. 两个事件之间的间隔至少有多长才算长休止
+    :param segment_count: expected number of segments. 期望的分段数
+    :param min_segment_length: minimum number of events in a segment. 每段最少的事件数
+    :return: index of the first event of every segment except the first one. 除第一段以外每一段第一个事件的索引
+    """
+    open_notes = set(guitarString.getBaseNote()
+                     for guitarString in guitar.guitarStrings)
+    candidates = []
+    for i in range(1, len(notes_map)):
+        notes = notes_map[i].get("notes", False)
+        is_long_rest = notes_map[i]["real_tick"] - \
+            notes_map[i-1]["real_tick"] >= min_rest_ticks
+        is_open_only = bool(notes) and all(
+            note in open_notes for note in notes)
+        if is_long_rest or is_open_only:
+            candidates.append(i)
+
+    breaks = []
+    for k in range(1, segment_count):
+        target = k * len(notes_map) // segment_count
+        previous_break = breaks[-1] if breaks else 0
+        usable = [i for i in candidates if i - previous_break >=
+                  min_segment_length and len(notes_map) - i >= min_segment_length]
+        if not usable:
+            break
+        breaks.append(min(usable, key=lambda i: abs(i - target)))
+
+    return breaks
+
+
+def solveLeftHandSegment(guitar: Guitar, initNodes: List[tuple], initTails: List[int], notes_map_segment, size: int, merge_states: bool = False, join_every: int = 8):
+    """
+    run the beam search on a segment in a worker process, the pools after every join_every events are flattened for transfer. 在工作进程里对一个分段做束搜索，每隔join_every个事件的记录池展开后传回
+    """
+    handPoseRecordPool = HandPoseRecordPool(size, merge_states)
+    handPoseRecordPool.setRecorders(unflattenRecorders(
+        initNodes, initTails, HandPoseRecorder))
+    snapshots = SearchSnapshots(HandPoseRecorder, "", join_every)
+    fingeringCache = FingeringCache()
+    current_recoreder_num = 0
+    previous_recoreder_num = 0
+    for i, guitarNote in enumerate(notes_map_segment):
+        current_recoreder_num, previous_recoreder_num = generateLeftHandRecoder(
+            guitarNote, guitar, handPoseRecordPool, current_recoreder_num, previous_recoreder_num, fingeringCache)
+        snapshots.record(handPoseRecordPool, i + 1, len(notes_map_segment))
+    return snapshots.flatten()
+
+
+def update_recorder_pool_segmented(guitar: Guitar, handPoseRecordPool: HandPoseRecordPool, notes_map, min_rest_ticks: float, max_workers: int | None = None, join_every: int = 8, fingeringCache: FingeringCache | None = None) -> Dict[str, Any]:
+    """
+    split the song at long rests or open-string-only events, solve the segments in parallel, and stitch them with a boundary re-search. 在长休止或纯空弦音处切分曲子，并行求解各段，再在边界处重新搜索把它们接起来
+    从前一段的记录池出发重新搜索下一段的开头，一旦记录池与这一段自己的记录池在同一个事件处等价(见poolEntropyOffset)，之后的搜索就完全相同，直接接上这一段的结果
+    一直没有等价时这一段就按顺序搜索完，所以结果与顺序搜索相同，只有熵相等的候选因为浮点舍入的顺序不同而排序不同时才可能有差别
+    :param handPoseRecordPool: pool with the initial recorders, the result is left in it like update_recorder_pool. 包含初始记录器的记录池，与update_recorder_pool一样结果保存在其中
+    :param join_every: compare the pools after every this many events of a segment. 每隔这么多个事件比较一次记录池
+    :return: statistics of the segments, "joined" is the number of segments whose result is reused. 分段的统计信息，"joined"是直接接上了结果的段数
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    breaks = findSegmentBreaks(notes_map, guitar, min_rest_ticks, max_workers)
+    bounds = [0] + breaks + [len(notes_map)]
+    segments = [notes_map[bounds[k]:bounds[k+1]]
+                for k in range(len(bounds) - 1)]
+    print(f"曲子被切分为{len(segments)}段，切分点为{breaks}")
+
+    initNodes, initTails = flattenRecorders(
+        handPoseRecordPool.curHandPoseRecordPool)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(solveLeftHandSegment, guitar, initNodes, initTails, segment, handPoseRecordPool.size, handPoseRecordPool.merge_states, join_every)
+                   for segment in segments]
+        segmentSnapshots = []
+        for future in tqdm(futures, desc="Segments", ncols=100, unit="seg"):
+            snapshots = SearchSnapshots(HandPoseRecorder, "", join_every)
+            snapshots.unflatten(*future.result())
+            segmentSnapshots.append(snapshots)
+
+    handPoseRecordPool.setRecorders(
+        segmentSnapshots[0].pools[len(segments[0])])
+    research_events = 0
+    joined = 0
+    for segment, snapshots in zip(segments[1:], segmentSnapshots[1:]):
+        current_recoreder_num = len(handPoseRecordPool.curHandPoseRecordPool)
+        previous_recoreder_num = current_recoreder_num
+        for i, guitarNote in enumerate(segment[:-1]):
+            current_recoreder_num, previous_recoreder_num = generateLeftHandRecoder(
+                guitarNote, guitar, handPoseRecordPool, current_recoreder_num, previous_recoreder_num, fingeringCache)
+            research_events += 1
+            segmentRecorders = snapshots.pools.get(i + 1)
+            if segmentRecorders is None or poolEntropyOffset(handPoseRecordPool.curHandPoseRecordPool, segmentRecorders) is None:
+                continue
+            nodeMap = {id(segmentRecorder.lastNode): (recorder.lastNode, recorder.currentEntropy - segmentRecorder.currentEntropy)
+                       for recorder, segmentRecorder in zip(handPoseRecordPool.curHandPoseRecordPool, segmentRecorders)}
+            handPoseRecordPool.setRecorders(rebaseRecorders(
+                snapshots.pools[len(segment)], nodeMap, HandPoseRecorder))
+            joined += 1
+            break
+        else:
+            # 没有等价的记录池，这一段按顺序搜索完
+            current_recoreder_num, previous_recoreder_num = generateLeftHandRecoder(
+                segment[-1], guitar, handPoseRecordPool, current_recoreder_num, previous_recoreder_num, fingeringCache)
+            research_events += 1
+            print("边界重新搜索没有与分段结果汇合，这一段按顺序搜索")
+
+    return {
+        "segments": len(segments),
+        "breaks": breaks,
+        "research_events": research_events,
+        "joined": joined,
+    }
+
+
+def generateRightHandRecoder(item, rightHandRecordPool, current_recoreder_num, previous_recoreder_num, max_string_index, fingeringTable: RightHandFingeringTable | None = None):
     real_tick = item["real_tick"]
     leftHand = item["leftHand"]
     touchedStrings = []
@@ -139,37 +386,59 @@ def generateRightHandRecoder(item, rightHandRecordPool, current_recoreder_num, p
 
     # 这个重复p的写法是确保p指可能弹两根弦，但如果是四弦bass或者只有一个单音的情况下，就不允许用p指弹两根弦
     allow_double_p = max_string_index > 3 and len(lower_strings) > 1
-    allFingers = ["p", "p", "i", "m",
-                  "a"] if allow_double_p else ["p", "i", "m", "a"]
-    allstrings = list(range(max_string_index + 1))
-
-    possibleCombinations = generatePossibleRightHands(
-        touchedStrings, allFingers, allstrings)
+    if fingeringTable is not None:
+        possibleCombinations = fingeringTable.getCombinations(
+            touchedStrings, allow_double_p, max_string_index)
+    else:
+        allFingers = ["p", "p", "i", "m",
+                      "a"] if allow_double_p else ["p", "i", "m", "a"]
+        allstrings = list(range(max_string_index + 1))
+        possibleCombinations = generatePossibleRightHands(
+            touchedStrings, allFingers, allstrings)
 
     if len(possibleCombinations) == 0:
         print(f"当前要拨动的弦是{touchedStrings}，没有找到合适的右手拨法。")
 
-    for combination, handRecorder in itertools.product(possibleCombinations, rightHandRecordPool.preHandPoseRecordPool):
-        lastHand = handRecorder.currentHandPose()
-        usedFingers = combination['usedFingers']
-        rightFingerPositions = combination['rightFingerPositions']
+    prevHandPoseRecords = rightHandRecordPool.preHandPoseRecordPool
+    prevHands = [handRecorder.currentHandPose()
+                 for handRecorder in prevHandPoseRecords]
+    prevEntropys = np.array(
+        [handRecorder.currentEntropy for handRecorder in prevHandPoseRecords], dtype=float)
+    # 每一对(拨法, 旧记录器)的熵用一次矩阵运算算出来
+    diffMatrix = caculateRightHandDiffMatrix(prevHands, [combination['usedFingers'] for combination in possibleCombinations],
+                                             [combination['rightFingerPositions'] for combination in possibleCombinations]).T
+    totalEntropys = prevEntropys[None, :] + diffMatrix
+
+    # 按(拨法, 旧记录器)的原顺序稳定排序，与逐个插入记录池的结果一致
+    flatTotalEntropys = totalEntropys.ravel()
+    order = np.argsort(flatTotalEntropys, kind="stable")
+    if rightHandRecordPool.merge_states:
+        # 新手型的状态由拨法和旧手型的usedFingers决定，同一状态只有排在最前面的候选会被记录池留下，先把其它候选去掉
+        combinationStates = {}
+        combinationStateIds = np.array([combinationStates.setdefault((tuple(combination['rightFingerPositions'][:4]), fingerMask(combination['usedFingers'])), len(combinationStates))
+                                        for combination in possibleCombinations], dtype=np.intp)
+        prevUsed = np.array([fingerMask(hand.usedFingers)
+                            for hand in prevHands], dtype=np.intp)
+        stateIds = (combinationStateIds[:, None] * 16 +
+                    prevUsed[None, :]).ravel()
+        _, firstIndexes = np.unique(stateIds[order], return_index=True)
+        order = order[np.sort(firstIndexes)]
+    for flatIndex in order:
+        insert_index = rightHandRecordPool.check_insert_index(
+            flatTotalEntropys[flatIndex])
+        if insert_index == -1:
+            break
+        combinationIndex, prevIndex = divmod(int(flatIndex), len(prevHands))
+        lastHand = prevHands[prevIndex]
+        usedFingers = possibleCombinations[combinationIndex]['usedFingers']
+        rightFingerPositions = possibleCombinations[combinationIndex]['rightFingerPositions']
         rightHand = RightHand(
             usedFingers, rightFingerPositions, lastHand.usedFingers, usedFingers == [])
+        newRecorder = prevHandPoseRecords[prevIndex].extend(
+            rightHand, float(diffMatrix[combinationIndex, prevIndex]), real_tick)
 
-        entropy = lastHand.caculateDiff(rightHand)
-        new_entropy = handRecorder.currentEntropy + entropy
-        insert_index = rightHandRecordPool.check_insert_index(
-            new_entropy)
-        if insert_index != -1:
-            newRecorder = RightHandRecorder()
-            newRecorder.handPoseList = handRecorder.handPoseList + \
-                [rightHand]
-            newRecorder.currentEntropy = handRecorder.currentEntropy + entropy
-            newRecorder.entropys = handRecorder.entropys + [new_entropy]
-            newRecorder.real_ticks = handRecorder.real_ticks + [real_tick]
-
-            rightHandRecordPool.insert_new_hand_pose_recorder(
-                newRecorder, insert_index)
+        rightHandRecordPool.insert_new_hand_pose_recorder(
+            newRecorder, insert_index)
 
     previous_recoreder_num = current_recoreder_num
     current_recoreder_num = len(
@@ -180,72 +449,275 @@ def generateRightHandRecoder(item, rightHandRecordPool, current_recoreder_num, p
             f"当前record数量是{current_recoreder_num}，上一次record数量是{previous_recoreder_num}")
 
 
-def update_right_hand_recorder_pool(left_hand_recorder_file, rightHandRecordPool, current_recoreder_num, previous_recoreder_num, max_string_index):
-    with open(left_hand_recorder_file, "r") as f:
-        data = json.load(f)
-        total_steps = len(data)
-        current_recoreder_num = 0
-        previous_recoreder_num = current_recoreder_num
+def update_right_hand_recorder_pool(left_hand_recorder_file, rightHandRecordPool, current_recoreder_num, previous_recoreder_num, max_string_index, fingeringTable: RightHandFingeringTable | None = None, decoder: OnlineDecoder | None = None, checkpoint: SearchCheckpoint | None = None, start_step: int = 0):
+    data = loadRecords(left_hand_recorder_file)
+    total_steps = len(data)
+    current_recoreder_num = 0
+    previous_recoreder_num = current_recoreder_num
 
-        with tqdm(total=total_steps, desc="Processing", ncols=100, unit="step") as progress:
-            for i in range(total_steps):
-                item = data[i]
-                generateRightHandRecoder(
-                    item, rightHandRecordPool, current_recoreder_num, previous_recoreder_num, max_string_index)
-                progress.update(1)
+    with tqdm(total=total_steps, initial=start_step, desc="Processing", ncols=100, unit="step") as progress:
+        for i in range(start_step, total_steps):
+            item = data[i]
+            generateRightHandRecoder(
+                item, rightHandRecordPool, current_recoreder_num, previous_recoreder_num, max_string_index, fingeringTable)
+            if decoder is not None:
+                decoder.update(rightHandRecordPool)
+            if checkpoint is not None:
+                checkpoint.update(rightHandRecordPool, i + 1, total_steps)
+            progress.update(1)
 
 
-def leftHand2ElectronicRightHand(left_hand_recorder_file, right_hand_recorder_file):
+def poolEntropyOffset(recorders: List[Any], oldRecorders: List[Any]) -> float | None:
+    """
+    if two pools have the same hand states in the same order and their entropies differ by a constant, return the constant, otherwise None. 如果两个记录池的手型状态及其顺序完全相同，熵只差一个常数，返回这个常数，否则返回None
+    之后的转移只和手型状态有关，所以这样的两个记录池在相同的事件上的搜索过程完全相同
+    """
+    if len(recorders) != len(oldRecorders) or not recorders:
+        return None
+    offset = recorders[0].currentEntropy - oldRecorders[0].currentEntropy
+    for recorder, oldRecorder in zip(recorders, oldRecorders):
+        if recorder.currentHandPose().stateKey() != oldRecorder.currentHandPose().stateKey():
+            return None
+        if abs(recorder.currentEntropy - oldRecorder.currentEntropy - offset) > 1e-9 * max(1.0, abs(recorder.currentEntropy)):
+            return None
+    return offset
+
+
+def rebaseRecorders(oldRecorders: List[Any], nodeMap: Dict[int, Tuple[HandPoseNode, float]], recorderClass) -> List[Any]:
+    """
+    move the paths of old recorders onto new paths. 把旧记录器的路径移到新的路径上
+    :param nodeMap: id of an old node -> (new node, entropy offset), the nodes after it are copied with the entropy shifted, copied nodes are added to it so shared suffixes stay shared. 旧节点的id -> (新节点, 熵的差值)，它之后的节点复制时平移熵，复制出的节点也会加入其中，这样共享的后缀依然共享
+    """
+    result = []
+    for oldRecorder in oldRecorders:
+        suffixNodes = []
+        node = oldRecorder.lastNode
+        while id(node) not in nodeMap:
+            suffixNodes.append(node)
+            node = node.parent
+        newNode, offset = nodeMap[id(node)]
+        for node in reversed(suffixNodes):
+            newNode = HandPoseNode(
+                node.handPose, node.entropy + offset, node.real_tick, newNode)
+            nodeMap[id(node)] = (newNode, offset)
+        recorder = recorderClass()
+        recorder.lastNode = newNode
+        recorder.currentEntropy = newNode.entropy
+        result.append(recorder)
+    return result
+
+
+def update_pool_incrementally(events: List[Any], handPoseRecordPool: HandPoseRecordPool, step: Callable[[Any], Any], snapshots: SearchSnapshots, previous: SearchSnapshots | None = None) -> Dict[str, Any]:
+    """
+    search the events like update_recorder_pool, reusing the previous run of the same song. 与update_recorder_pool一样搜索所有事件，但是复用同一首曲子上一次运行的结果
+    从上一次运行在第一个改动的事件之前最近的快照开始搜索，过了改动的部分以后，一旦记录池与上一次运行在对应事件处的快照等价，就直接接上上一次的结果
+    :param step: runs the search on one event. 对一个事件运行搜索
+    :param snapshots: filled with the snapshots of this run. 保存本次运行的快照
+    :param previous: snapshots of the previous run, None means searching from the beginning. 上一次运行的快照，None表示从头搜索
+    :return: {"start": first searched event, "rejoin": number of events searched when the previous result is rejoined, None if it is not}. {"start": 开始搜索的事件, "rejoin": 接上上一次结果时已经搜索的事件数，没有接上时为None}
+    """
+    total_steps = len(events)
+    snapshots.eventHashes = [fingerprintOf(event) for event in events]
+    start = 0
+    shift = 0
+    suffixStart = total_steps
+    if previous is None:
+        snapshots.record(handPoseRecordPool, 0, total_steps)
+    else:
+        oldHashes = previous.eventHashes
+        limit = min(len(oldHashes), total_steps)
+        prefix = 0
+        while prefix < limit and oldHashes[prefix] == snapshots.eventHashes[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and oldHashes[-1 - suffix] == snapshots.eventHashes[-1 - suffix]:
+            suffix += 1
+        # 改动之前的快照仍然有效，从最后一个开始搜索
+        start = max(event_index for event_index in previous.pools if event_index <= prefix)
+        for event_index, recorders in previous.pools.items():
+            if event_index <= start:
+                snapshots.pools[event_index] = recorders
+        handPoseRecordPool.setRecorders(previous.pools[start])
+        # 新曲子从suffixStart开始的事件与旧曲子从suffixStart + shift开始的事件相同
+        shift = len(oldHashes) - total_steps
+        suffixStart = total_steps - suffix
+
+    rejoin = None
+    with tqdm(total=total_steps, initial=start, desc="Processing", ncols=100, unit="step") as progress:
+        for i in range(start, total_steps):
+            step(events[i])
+            snapshots.record(handPoseRecordPool, i + 1, total_steps)
+            progress.update(1)
+            if previous is None or i + 1 < suffixStart or i + 1 + shift not in previous.pools:
+                continue
+            oldRecorders = previous.pools[i + 1 + shift]
+            if poolEntropyOffset(handPoseRecordPool.curHandPoseRecordPool, oldRecorders) is None:
+                continue
+
+            # 之后的搜索与上一次运行完全相同，把上一次之后的快照接到当前的记录器上
+            nodeMap = {id(oldRecorder.lastNode): (recorder.lastNode, recorder.currentEntropy - oldRecorder.currentEntropy)
+                       for recorder, oldRecorder in zip(handPoseRecordPool.curHandPoseRecordPool, oldRecorders)}
+            for event_index in sorted(previous.pools):
+                if event_index > i + 1 + shift:
+                    snapshots.pools[event_index - shift] = rebaseRecorders(
+                        previous.pools[event_index], nodeMap, previous.recorderClass)
+            handPoseRecordPool.setRecorders(snapshots.pools[total_steps])
+            progress.update(total_steps - i - 1)
+            rejoin = i + 1
+            break
+
+    return {"start": start, "rejoin": rejoin}
+
+
+def leftHand2ElectronicRightHand(left_hand_recorder_file, right_hand_recorder_file=None):
+    """
+    :param left_hand_recorder_file: path of the left hand recorder file, or the records in memory. 左手记录文件的路径，或者内存中的记录
+    :param right_hand_recorder_file: output path, None means not writing a file. 输出路径，None表示不写文件
+    :return: right hand records. 右手记录
+    """
     result = []
-    with open(left_hand_recorder_file, "r") as f:
-        data = json.load(f)
-        total_steps = len(data)
-
-        with tqdm(total=total_steps, desc="Processing", ncols=100, unit="step") as progress:
-            for i in range(total_steps):
-                item = data[i]
-                pitchwheel = item.get("pitchwheel", 0)
-                if pitchwheel != 0:
-                    continue
-                leftHand = item["leftHand"]
-                frame = item["frame"]
-                strings = []
-                for finger in leftHand:
-                    if finger["fingerIndex"] == -1 or 0 < finger["fingerInfo"]["press"] < 5:
-                        strings.append(finger["fingerInfo"]['stringIndex'])
-
-                if len(strings) > len(set(strings)):
-                    strings = list(set(strings))
-
-                result.append({
-                    'frame': frame,
-                    'strings': strings,
-                })
+    data = loadRecords(left_hand_recorder_file)
+    total_steps = len(data)
+
+    with tqdm(total=total_steps, desc="Processing", ncols=100, unit="step") as progress:
+        for i in range(total_steps):
+            item = data[i]
+            pitchwheel = item.get("pitchwheel", 0)
+            if pitchwheel != 0:
+                continue
+            leftHand = item["leftHand"]
+            frame = item["frame"]
+            strings = []
+            for finger in leftHand:
+                if finger["fingerIndex"] == -1 or 0 < finger["fingerInfo"]["press"] < 5:
+                    strings.append(finger["fingerInfo"]['stringIndex'])
+
+            if len(strings) > len(set(strings)):
+                strings = list(set(strings))
+
+            result.append({
+                'frame': frame,
+                'strings': strings,
+            })
+
+            progress.update(1)
+
+    if right_hand_recorder_file is not None:
+        saveRecords(right_hand_recorder_file, result, indent=4)
+    return result
 
-                progress.update(1)
 
-    with open(right_hand_recorder_file, "w") as f:
-        json.dump(result, f, indent=4)
+OUTPUT_FORMATS = {
+    "json": ".json",
+    "columnar": COLUMNAR_EXTENSION,
+}
 
 
-def main(avatar: str, midiFilePath: str, track_number: List[int], channel_number: int, FPS: int, guitar_string_notes: List[str], octave_down_checkbox: bool, capo_number: int) -> str:
+def getOutputFiles(avatar: str, midiFilePath: str, track_number: List[int], output_format: str = "json", output_tag: str = "") -> Dict[str, str]:
+    """
+    all files written by main for a song. main为一首曲子输出的所有文件
+    :param output_format: json or columnar, see src/utils/columnar.py. json或者columnar，见src/utils/columnar.py
+    :param output_tag: appended to every file name, runs of the same song with different settings need different tags. 加在每个文件名后面，同一首曲子用不同设置运行时需要不同的标签
+    :return: a dict from file kind to file path. 文件类型到文件路径的字典
+    """
     filename = midiFilePath.split("/")[-1].split(".")[0]
     track_number_string = "_".join([str(i) for i in track_number])
-    notes_map_file = f"output/midi_info/{filename}_{track_number_string}_notes_map.json"
-    messages_file = f"output/midi_info/{filename}_{track_number_string}_messages.json"
-    left_hand_recorder_file = f"output/hand_recorder/{filename}_{track_number_string}_lefthand_recorder.json"
-    left_hand_animation_file = f"output/hand_animation/{avatar}_{filename}_{track_number_string}_lefthand_animation.json"
-    right_hand_recorder_file = f"output/hand_recorder/{filename}_{track_number_string}_righthand_recorder.json"
-    right_hand_animation_file = f"output/hand_animation/{avatar}_{filename}_{track_number_string}_righthand_animation.json"
-    guitar_string_recorder_file = f"output/string_recorder/{filename}_{track_number_string}_guitar_string_recorder.json"
+    if output_tag:
+        track_number_string += f"_{output_tag}"
+    ext = OUTPUT_FORMATS[output_format]
+    return {
+        "notes_map": f"output/midi_info/{filename}_{track_number_string}_notes_map{ext}",
+        "messages": f"output/midi_info/{filename}_{track_number_string}_messages{ext}",
+        "left_hand_recorder": f"output/hand_recorder/{filename}_{track_number_string}_lefthand_recorder{ext}",
+        "left_hand_animation": f"output/hand_animation/{avatar}_{filename}_{track_number_string}_lefthand_animation{ext}",
+        "right_hand_recorder": f"output/hand_recorder/{filename}_{track_number_string}_righthand_recorder{ext}",
+        "right_hand_animation": f"output/hand_animation/{avatar}_{filename}_{track_number_string}_righthand_animation{ext}",
+        "guitar_string_recorder": f"output/string_recorder/{filename}_{track_number_string}_guitar_string_recorder{ext}",
+    }
+
+
+def getAnimationIndexPath(avatar: str, midiFilePath: str, track_number: List[int], output_tag: str = "") -> str:
+    """
+    the record offsets of every animation file of a run, used to regenerate only the changed part in the next run. 一次运行中每个动画文件的记录偏移，下一次运行时用来只重新生成改动的部分
+    :param output_tag: the same as in getOutputFiles. 与getOutputFiles中的相同
+    """
+    filename = os.path.splitext(os.path.basename(midiFilePath))[0]
+    track_number_string = "_".join([str(i) for i in track_number])
+    if output_tag:
+        track_number_string += f"_{output_tag}"
+    return f"output/hand_animation/{avatar}_{filename}_{track_number_string}_animation_index.json"
+
+
+def generateAnimation(kind: str, records_kind: str, animate: Callable[[List[dict], List[int]], List[dict]], records: List[dict], output_files: Dict[str, str], previousIndex: Dict[str, Any], animationIndex: Dict[str, Any], stateful: bool = False) -> List[dict]:
+    """
+    generate the animation of records, if the previous run left the animation of the same records file, only the part around the changed records is regenerated. 生成记录的动画，如果上一次运行留下了对应的动画，只重新生成改动的记录附近的部分
+    :param kind: kind of the animation in output_files. 动画在output_files中的种类
+    :param records_kind: kind of the records the animation is made from. 动画所依据的记录在output_files中的种类
+    :param animate: animate(records, record_offsets). 生成动画的函数
+    :param previousIndex: animation index of the previous run. 上一次运行的动画索引
+    :param animationIndex: the fingerprint of records and the record offsets of this run are stored in it. 保存本次运行的记录指纹和记录偏移
+    :param stateful: the same as in updateAnimation. 与updateAnimation中的相同
+    """
+    offsets: List[int] = []
+    animation = None
+    previous = previousIndex.get(kind)
+    # 上一次的输出文件必须还在，而且记录文件与生成动画时的记录相同
+    if previous is not None and os.path.exists(output_files[kind]) and os.path.exists(output_files[records_kind]):
+        oldRecords = loadRecords(output_files[records_kind])
+        oldAnimation = loadRecords(output_files[kind])
+        if fingerprintOf(oldRecords) == previous["records"] and len(oldAnimation) == previous["offsets"][-1]:
+            animation, start, end = updateAnimation(
+                animate, oldRecords, records, oldAnimation, previous["offsets"], offsets, stateful)
+            if start < end:
+                print(
+                    f"{kind}重新生成了第{start}到{end}个记录的动画，共{len(records)}个记录")
+    if animation is None:
+        animation = animate(records, offsets)
+    animationIndex[kind] = {
+        "records": fingerprintOf(records), "offsets": offsets}
+    return animation
+
+
+def main(avatar: str, midiFilePath: str, track_number: List[int], channel_number: int, FPS: int, guitar_string_notes: List[str], octave_down_checkbox: bool, capo_number: int, segment_workers: int = 0, compare_sequential: bool = False, output_format: str = "json", preview: bool = False, merge_states: bool = False, solver: str = "beam", online: bool = False, max_lag: int | None = None, checkpoint_every: int = 0, resume: bool = False, checkpoint_dir: str = "output/checkpoint", incremental: bool = False, seed: int | None = None, output_tag: str = "") -> str:
+    """
+    各个阶段之间直接在内存中传递记录，不再先写文件再读回来，所有输出文件在最后统一写出
+    :param segment_workers: split the left hand search into segments solved by this many processes, 0 means sequential search. 把左手搜索分段并用这么多个进程求解，0表示顺序搜索
+    :param compare_sequential: also run the sequential search and report the entropy difference. 同时运行顺序搜索并报告熵的差值
+    :param output_format: format of all output files, json or columnar. 所有输出文件的格式，json或者columnar
+    :param preview: do not write any file, including caches, snapshots and checkpoints, only report the result. 预览运行，不写出任何文件，包括缓存、快照和检查点，只报告结果
+    :param merge_states: keep only the best recorder for each hand state in the left hand and right hand pools. 左右手的记录池里每种手型状态只保留最好的记录器
+    :param solver: beam or exact, exact solves the left hand by dynamic programming and ignores segment_workers. beam或者exact，exact用动态规划求左手的最优解，此时segment_workers不起作用
+    :param online: commit the hand poses as soon as all recorders agree on them, so that finished parts of the path do not stay in memory. 一旦所有记录器对某段手型达成一致就立刻提交，搜索完的路径不再留在内存里
+    :param max_lag: with online, force a commit of the best path when the uncommitted part is longer than this many events, None means never. 在线模式下，未提交的部分超过这么多个事件时强制提交最优路径，None表示从不强制提交
+    :param checkpoint_every: save the left hand and right hand beam search pools after every this many events, 0 means no checkpoints. 左右手的束搜索每处理这么多个事件保存一次检查点，0表示不保存
+    :param resume: continue the beam searches from the checkpoints in checkpoint_dir, the result is the same as an uninterrupted run. 从checkpoint_dir里的检查点接着运行束搜索，结果与不中断的运行相同
+    :param checkpoint_dir: directory of checkpoints, copy it to fork the checkpoints and try other settings. 检查点所在的目录，复制这个目录就可以从检查点出发尝试别的设置
+    :param incremental: reuse the previous run of the same song, the beam searches only run from the first changed event until they rejoin the previous result, and only the animation around the changed records is regenerated. 复用同一首曲子上一次运行的结果，束搜索只从第一个改动的事件开始运行到与上一次的结果汇合为止，动画也只重新生成改动的记录附近的部分，左手使用exact或者分段搜索时总是从头搜索
+    :param seed: seed of the random jitter of the right hand palm, None means np.random. 右手手掌随机移动的随机种子，None表示使用np.random
+    :param output_tag: appended to every output file name, see getOutputFiles. 加在每个输出文件名后面，见getOutputFiles
+    """
+    if online and (checkpoint_every > 0 or resume or incremental):
+        raise ValueError(
+            "online cannot be used with checkpoints or incremental runs, the committed path is dropped from the pool")
+    if incremental and (checkpoint_every > 0 or resume):
+        raise ValueError("incremental runs cannot be used with checkpoints")
+    if preview and checkpoint_every > 0:
+        raise ValueError("preview runs do not write checkpoints")
+    output_files = getOutputFiles(
+        avatar, midiFilePath, track_number, output_format, output_tag)
+    left_hand_recorder_file = output_files["left_hand_recorder"]
+    left_hand_animation_file = output_files["left_hand_animation"]
+    right_hand_recorder_file = output_files["right_hand_recorder"]
+    right_hand_animation_file = output_files["right_hand_animation"]
+    guitar_string_recorder_file = output_files["guitar_string_recorder"]
+    # 每个输出文件的记录和json缩进，全部阶段完成后再统一写出
+    stage_outputs: Dict[str, Tuple[Any, int | None]] = {}
 
     tempo_changes, ticks_per_beat = get_tempo_changes(midiFilePath)
     notes_map, pitch_wheel_map, messages = midiToGuitarNotes(
         midiFilePath, useTracks=track_number, useChannel=channel_number, octave_down_checkbox=octave_down_checkbox, capo_number=capo_number)
-    with open(notes_map_file, "w") as f:
-        json.dump(notes_map, f, indent=4)
-    with open(messages_file, "w") as f:
-        json.dump(messages, f, indent=4)
+    stage_outputs["notes_map"] = (notes_map, 4)
+    stage_outputs["messages"] = (messages, 4)
 
     print(f'全曲的速度变化是:')
     for track, tempo, tick in tempo_changes:
@@ -254,8 +726,8 @@ def main(avatar: str, midiFilePath: str, track_number: List[int], channel_number
     print(f'\n全曲的每拍tick数是:{ticks_per_beat}\n')
 
     total_tick = notes_map[-1]['real_tick']
-    total_frame = calculate_frame(
-        tempo_changes, ticks_per_beat, FPS, total_tick)
+    tempoMap = TempoMap(tempo_changes, ticks_per_beat, FPS)
+    total_frame = tempoMap.tick_to_frame(total_tick)
     total_time = total_frame/FPS
     print(
         f'如果以{FPS}的fps做成动画，一共是{total_tick} ticks, 合计{total_frame}帧, 约{total_time}秒')
@@ -264,21 +736,8 @@ def main(avatar: str, midiFilePath: str, track_number: List[int], channel_number
     max_string_index = len(guitar_string_list) - 1
     # 初始化吉它
     guitar = Guitar(guitar_string_list)
-    # 设定各手指状态
-    leftFingers = [
-        LeftFinger(1, guitar_string_list[2], 1),
-        LeftFinger(2, guitar_string_list[2], 2),
-        LeftFinger(3, guitar_string_list[2], 3),
-        LeftFinger(4, guitar_string_list[2], 4)
-    ]
-    # 初始化左手
-    initLeftHand = LeftHand(leftFingers)
-    # 初始化第一个记录器
-    handPoseRecord = HandPoseRecorder()
-    handPoseRecord.addHandPose(initLeftHand, 0, 0)
     # 初始化记录池
-    handPoseRecordPool = HandPoseRecordPool(100)
-    handPoseRecordPool.insert_new_hand_pose_recorder(handPoseRecord, 0)
+    handPoseRecordPool = createInitLeftHandPool(guitar, 100, merge_states)
 
     current_recoreder_num = 0
     previous_recoreder_num = 0
@@ -287,38 +746,111 @@ def main(avatar: str, midiFilePath: str, track_number: List[int], channel_number
     current_recoreder_num = 0
     previous_recoreder_num = current_recoreder_num
 
-    print('开始生成左手按弦数据')
+    # 读取之前运行时保存的指法缓存，相同定弦的曲子可以直接复用
+    fingeringCache = FingeringCache()
+    fingering_cache_file = getFingeringCachePath(guitar)
+    fingeringCache.load(fingering_cache_file, guitar)
 
-    update_recorder_pool(total_steps, guitar, handPoseRecordPool, notes_map, current_recoreder_num,
-                         previous_recoreder_num)
+    print('开始生成左手按弦数据')
+    leftDecoder = OnlineDecoder(
+        HandPoseRecorder, tempoMap, max_lag) if online else None
+
+    if solver == "exact":
+        handPoseRecordPool, exact_info = solve_left_hand_exact(
+            guitar, notes_map, fingeringCache, decoder=leftDecoder)
+        if exact_info["exact"]:
+            print(f"精确求解完毕，最大的一层有{exact_info['max_layer_states']}个手型状态")
+        else:
+            print("某一层的手型状态数超过了上限或者在线模式强制提交丢弃了手型，结果不保证是最优解")
+    elif segment_workers > 0:
+        # 分段并行搜索，以两拍以上的休止作为长休止
+        segment_info = update_recorder_pool_segmented(
+            guitar, handPoseRecordPool, notes_map, 2 * ticks_per_beat, segment_workers, fingeringCache=fingeringCache)
+        print(f"分段搜索共{segment_info['segments']}段，{segment_info['joined']}段接上了分段结果，边界重新搜索了{segment_info['research_events']}个事件")
+        if compare_sequential:
+            sequentialPool = createInitLeftHandPool(
+                guitar, 100, merge_states)
+            update_recorder_pool(total_steps, guitar, sequentialPool, notes_map, 0,
+                                 0, fingeringCache)
+            segmentedEntropy = handPoseRecordPool.curHandPoseRecordPool[0].currentEntropy
+            sequentialEntropy = sequentialPool.curHandPoseRecordPool[0].currentEntropy
+            print(
+                f"分段搜索的熵为{segmentedEntropy}，顺序搜索的熵为{sequentialEntropy}，相差{segmentedEntropy - sequentialEntropy}")
+    elif incremental:
+        # 快照与定弦和记录池的设置有关，与角色无关
+        leftSnapshots = SearchSnapshots(HandPoseRecorder, fingerprintOf(
+            FingeringCache.makeKey([], guitar), handPoseRecordPool.size, merge_states))
+        left_snapshot_file = getCheckpointPath(
+            midiFilePath, track_number, "lefthand_snapshots", checkpoint_dir)
+        incremental_info = update_pool_incrementally(notes_map, handPoseRecordPool, lambda guitarNote: generateLeftHandRecoder(
+            guitarNote, guitar, handPoseRecordPool, 0, 0, fingeringCache), leftSnapshots, SearchSnapshots.load(left_snapshot_file, HandPoseRecorder, leftSnapshots.settings))
+        print(f"左手从第{incremental_info['start']}个事件开始搜索" + (
+            f"，在第{incremental_info['rejoin']}个事件接上了上一次的结果" if incremental_info["rejoin"] is not None else ""))
+        if not preview:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+            leftSnapshots.save(left_snapshot_file)
+    else:
+        leftCheckpoint = None
+        start_step = 0
+        if checkpoint_every > 0 or resume:
+            # 检查点只对顺序的束搜索有效，指纹包含了搜索结果所依赖的音符和定弦
+            leftCheckpoint = SearchCheckpoint(getCheckpointPath(midiFilePath, track_number, "lefthand", checkpoint_dir), fingerprintOf(
+                notes_map, FingeringCache.makeKey([], guitar)), HandPoseRecorder, checkpoint_every)
+        if resume:
+            start_step = leftCheckpoint.load(handPoseRecordPool)
+            print(f"从左手检查点恢复，已经处理了{start_step}个事件")
+        update_recorder_pool(total_steps, guitar, handPoseRecordPool, notes_map, current_recoreder_num,
+                             previous_recoreder_num, fingeringCache, decoder=leftDecoder, checkpoint=None if preview else leftCheckpoint, start_step=start_step)
+    if not preview:
+        fingeringCache.save(fingering_cache_file, guitar)
+    print(fingeringCache.summary())
 
     # after all iterations, read the best solution in the recorder pool. 全部遍历完以后，读取记录池中的最优解。
     bestHandPoseRecord = handPoseRecordPool.curHandPoseRecordPool[0]
     bestEntropy = bestHandPoseRecord.currentEntropy
     print(f"最小消耗熵为：{bestEntropy}")
-    bestHandPoseRecord.save(left_hand_recorder_file,
-                            tempo_changes, ticks_per_beat, FPS)
     print(f"总音符数应该为{total_steps}")
-    print(f"实际输出音符数为{len(bestHandPoseRecord.handPoseList)}")
+    print(f"实际输出音符数为{len(bestHandPoseRecord)}")
+    if leftDecoder is not None:
+        # 分段搜索不经过解码器，此时finish一次提交整条路径
+        left_hand_records = leftDecoder.finish(bestHandPoseRecord)
+        print(
+            f"在线提交时最多有{leftDecoder.maxLag}个事件未提交，强制提交了{leftDecoder.forcedCommits}次")
+    else:
+        left_hand_records = bestHandPoseRecord.toRecords(
+            tempo_changes, ticks_per_beat, FPS)
 
     # 如果有各种推弦动作，添加推弦动作
     if len(pitch_wheel_map) > 0:
         for item in pitch_wheel_map:
-            frame = calculate_frame(
-                tempo_changes, ticks_per_beat, FPS, item['real_tick'])
+            frame = tempoMap.tick_to_frame(item['real_tick'])
             item['frame'] = frame
-        addPitchwheel(left_hand_recorder_file, pitch_wheel_map)
-
-    leftHand2Animation(avatar, left_hand_recorder_file,
-                       left_hand_animation_file, FPS, max_string_index, False)
+        left_hand_records = insertPitchwheel(
+            left_hand_records, pitch_wheel_map)
+    stage_outputs["left_hand_recorder"] = (left_hand_records, 4)
+
+    # 增量运行时读取上一次的动画索引，只重新生成改动的部分
+    animation_index_file = getAnimationIndexPath(
+        avatar, midiFilePath, track_number, output_tag)
+    previousAnimationIndex: Dict[str, Any] = {}
+    if incremental and os.path.exists(animation_index_file):
+        with open(animation_index_file, "r") as f:
+            previousAnimationIndex = json.load(f)
+            # 输出格式不同时旧的输出文件不在同一个路径上，动画索引也不能使用
+            if previousAnimationIndex.pop("format", None) != output_format:
+                previousAnimationIndex = {}
+    animationIndex: Dict[str, Any] = {}
+
+    stage_outputs["left_hand_animation"] = (generateAnimation("left_hand_animation", "left_hand_recorder", lambda records, offsets: leftHand2Animation(
+        avatar, records, None, FPS, max_string_index, False, offsets), left_hand_records, output_files, previousAnimationIndex, animationIndex), None)
 
     # 下面是处理右手的部分，右手要视情况分电吉他与古典吉他两种情况处理。
     print('开始生成右手演奏数据')
     if avatar.endswith("_E"):
-        leftHand2ElectronicRightHand(
-            left_hand_recorder_file, right_hand_recorder_file)
-        ElectronicRightHand2Animation(
-            avatar, right_hand_recorder_file, right_hand_animation_file, FPS)
+        right_hand_records = leftHand2ElectronicRightHand(left_hand_records)
+        stage_outputs["right_hand_recorder"] = (right_hand_records, 4)
+        stage_outputs["right_hand_animation"] = (generateAnimation("right_hand_animation", "right_hand_recorder", lambda records, offsets: ElectronicRightHand2Animation(
+            avatar, records, None, FPS, record_offsets=offsets), right_hand_records, output_files, previousAnimationIndex, animationIndex, stateful=True), 4)
     else:
         initRightHand = RightHand(
             usedFingers=[], rightFingerPositions=[max_string_index, 2, 1, 0], preUsedFingers=[])
@@ -326,34 +858,220 @@ def main(avatar: str, midiFilePath: str, track_number: List[int], channel_number
         initRightHandRecorder = RightHandRecorder()
         initRightHandRecorder.addHandPose(initRightHand, 0, 0)
 
-        rightHandRecordPool = HandPoseRecordPool(100)
+        rightHandRecordPool = HandPoseRecordPool(100, merge_states)
         rightHandRecordPool.insert_new_hand_pose_recorder(
             initRightHandRecorder, 0)
 
-        update_right_hand_recorder_pool(
-            left_hand_recorder_file, rightHandRecordPool, current_recoreder_num, previous_recoreder_num, max_string_index)
+        # 右手拨法表与定弦无关，所有曲子共用一个缓存文件
+        rightHandTable = RightHandFingeringTable()
+        right_hand_table_file = getRightHandTablePath()
+        rightHandTable.load(right_hand_table_file)
+        rightDecoder = OnlineDecoder(
+            RightHandRecorder, tempoMap, max_lag) if online else None
+        if incremental:
+            rightSnapshots = SearchSnapshots(RightHandRecorder, fingerprintOf(
+                max_string_index, rightHandRecordPool.size, merge_states))
+            right_snapshot_file = getCheckpointPath(
+                midiFilePath, track_number, "righthand_snapshots", checkpoint_dir)
+            # 右手的事件就是左手的记录，只有左手改动的部分需要重新搜索
+            incremental_info = update_pool_incrementally(left_hand_records, rightHandRecordPool, lambda item: generateRightHandRecoder(
+                item, rightHandRecordPool, 0, 0, max_string_index, rightHandTable), rightSnapshots, SearchSnapshots.load(right_snapshot_file, RightHandRecorder, rightSnapshots.settings))
+            print(f"右手从第{incremental_info['start']}个事件开始搜索" + (
+                f"，在第{incremental_info['rejoin']}个事件接上了上一次的结果" if incremental_info["rejoin"] is not None else ""))
+            if not preview:
+                os.makedirs(checkpoint_dir, exist_ok=True)
+                rightSnapshots.save(right_snapshot_file)
+        else:
+            rightCheckpoint = None
+            start_step = 0
+            if checkpoint_every > 0 or resume:
+                rightCheckpoint = SearchCheckpoint(getCheckpointPath(midiFilePath, track_number, "righthand", checkpoint_dir), fingerprintOf(
+                    left_hand_records, max_string_index), RightHandRecorder, checkpoint_every)
+            if resume:
+                start_step = rightCheckpoint.load(rightHandRecordPool)
+                print(f"从右手检查点恢复，已经处理了{start_step}个事件")
+            update_right_hand_recorder_pool(
+                left_hand_records, rightHandRecordPool, current_recoreder_num, previous_recoreder_num, max_string_index, rightHandTable, decoder=rightDecoder, checkpoint=None if preview else rightCheckpoint, start_step=start_step)
+        if not preview:
+            rightHandTable.save(right_hand_table_file)
+        print(rightHandTable.summary())
 
         # after all iterations, read the best solution in the record pool. 全部遍历完以后，读取记录池中的最优解。
         bestHandPoseRecord = rightHandRecordPool.curHandPoseRecordPool[0]
         bestEntropy = bestHandPoseRecord.currentEntropy
         print(f"最小消耗熵为：{bestEntropy}")
-        bestHandPoseRecord.save(right_hand_recorder_file,
-                                tempo_changes, ticks_per_beat, FPS)
-
-        rightHand2Animation(avatar, right_hand_recorder_file,
-                            right_hand_animation_file, FPS, max_string_index)
+        if rightDecoder is not None:
+            right_hand_records = rightDecoder.finish(bestHandPoseRecord)
+            print(
+                f"在线提交时最多有{rightDecoder.maxLag}个事件未提交，强制提交了{rightDecoder.forcedCommits}次")
+        else:
+            right_hand_records = bestHandPoseRecord.toRecords(
+                tempo_changes, ticks_per_beat, FPS)
+        stage_outputs["right_hand_recorder"] = (right_hand_records, 4)
+
+        stage_outputs["right_hand_animation"] = (generateAnimation("right_hand_animation", "right_hand_recorder", lambda records, offsets: rightHand2Animation(
+            avatar, records, None, FPS, max_string_index, seed, offsets), right_hand_records, output_files, previousAnimationIndex, animationIndex), None)
 
     print('开始生成吉他弦动画数据')
-    animated_guitar_string(left_hand_recorder_file,
-                           guitar_string_recorder_file, FPS)
+    stage_outputs["guitar_string_recorder"] = (generateAnimation("guitar_string_recorder", "left_hand_recorder", lambda records, offsets: animated_guitar_string(
+        records, None, FPS, offsets), left_hand_records, output_files, previousAnimationIndex, animationIndex), 4)
+
+    if preview:
+        finall_info = f'预览运行完毕，没有写出任何文件:\n左手最小消耗熵为:{handPoseRecordPool.curHandPoseRecordPool[0].currentEntropy}\n{fingeringCache.summary()}'
+        print(finall_info)
+        return finall_info
+
+    for kind, (records, indent) in stage_outputs.items():
+        output_file = output_files[kind]
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+        saveRecords(output_file, records, indent=indent)
+    if incremental:
+        with open(animation_index_file, "w") as f:
+            json.dump({"format": output_format, **animationIndex}, f)
 
-    finall_info = f'全部执行完毕:\nrecorder文件被保存到了:{left_hand_recorder_file} 和 {right_hand_recorder_file}\n动画文件被保存到了:{left_hand_animation_file} 和 {right_hand_animation_file}\n吉它弦动画文件被保存到了:{guitar_string_recorder_file}'
+    finall_info = f'全部执行完毕:\nrecorder文件被保存到了:{left_hand_recorder_file} 和 {right_hand_recorder_file}\n动画文件被保存到了:{left_hand_animation_file} 和 {right_hand_animation_file}\n吉它弦动画文件被保存到了:{guitar_string_recorder_file}\n{fingeringCache.summary()}'
 
     print(finall_info)
 
     return finall_info
 
 
+DEFAULT_GUITAR_STRING_NOTES = ["e", "b", "G", "D", "A", "E1"]
+
+
+def normalizeBatchJob(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    fill the default values of a job in the manifest. 补全任务清单里一个任务的默认值
+    :param job: a dict with midi, tracks, avatar, tuning and fps, channel, octave_down, capo, format and seed are optional. 包含midi, tracks, avatar, tuning和fps的字典，channel, octave_down, capo, format和seed可以省略
+    """
+    return {
+        "midi": job["midi"],
+        "tracks": [int(track) for track in job.get("tracks", [0])],
+        "avatar": job["avatar"],
+        "tuning": list(job.get("tuning", DEFAULT_GUITAR_STRING_NOTES)),
+        "fps": int(job.get("fps", 30)),
+        "channel": int(job.get("channel", 0)),
+        "octave_down": bool(job.get("octave_down", False)),
+        "capo": int(job.get("capo", 0)),
+        "format": job.get("format", "json"),
+        "seed": None if job.get("seed") is None else int(job["seed"]),
+    }
+
+
+def getBatchJobTag(job: Dict[str, Any]) -> str:
+    """
+    a short hash of all parameters of a normalized job, jobs of the same song with different settings get different log files and output files. 规范化后的任务全部参数的短哈希，同一首曲子不同设置的任务使用不同的日志和输出文件
+    """
+    return fingerprintOf(job)[:8]
+
+
+def getBatchJobName(job: Dict[str, Any]) -> str:
+    filename = os.path.splitext(os.path.basename(job["midi"]))[0]
+    track_number_string = "_".join([str(i) for i in job["tracks"]])
+    return f'{job["avatar"]}_{filename}_{track_number_string}_{getBatchJobTag(job)}'
+
+
+def getBatchJobOutputFiles(job: Dict[str, Any]) -> Dict[str, str]:
+    return getOutputFiles(job["avatar"], job["midi"], job["tracks"], job["format"], getBatchJobTag(job))
+
+
+def getFileStamp(path: str) -> List[int]:
+    """
+    modification time in nanoseconds and size of a file, the file is considered unchanged while they stay the same. 文件的修改时间(纳秒)和大小，两者不变时认为文件没有改动
+    """
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def makeBatchJobStamp(job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    the finish stamp of a job, it records the job, the hash of the midi file and the stamps of all outputs. 任务的完成标记，记录了任务本身、midi文件的哈希和所有输出文件的标记
+    """
+    with open(job["midi"], "rb") as f:
+        midi_hash = hashlib.sha1(f.read()).hexdigest()
+    return {
+        "job": job,
+        "midi": midi_hash,
+        "outputs": {output_file: getFileStamp(output_file) for output_file in getBatchJobOutputFiles(job).values()},
+    }
+
+
+def isBatchJobUpToDate(job: Dict[str, Any], stamp_file: str) -> bool:
+    """
+    a job is up to date when it was finished with the same parameters and the same midi file, and no output has been changed or removed since then. 如果任务以相同的参数和相同的midi文件完成过，而且之后没有输出文件被改动或者删除，就认为它是最新的
+    """
+    if not os.path.exists(stamp_file):
+        return False
+    with open(stamp_file, "r") as f:
+        stamp = json.load(f)
+    if not isinstance(stamp, dict) or stamp.get("job") != job:
+        return False
+    try:
+        return makeBatchJobStamp(job) == stamp
+    except FileNotFoundError:
+        return False
+
+
+def runBatchJobs(jobs: List[Dict[str, Any]], log_dir: str) -> List[Tuple[str, str]]:
+    """
+    run jobs one by one in a worker process, the output of each job is written to its own log file. 在一个工作进程里依次执行任务，每个任务的输出写到自己的日志文件里
+    :return: list of (job name, status), status is done or failed. (任务名, 状态)的列表，状态是done或者failed
+    """
+    results = []
+    for job in jobs:
+        name = getBatchJobName(job)
+        with open(f"{log_dir}/{name}.log", "w", encoding="utf-8") as log, redirect_stdout(log), redirect_stderr(log):
+            try:
+                main(job["avatar"], job["midi"], job["tracks"], job["channel"], job["fps"],
+                     job["tuning"], job["octave_down"], job["capo"], output_format=job["format"], seed=job["seed"], output_tag=getBatchJobTag(job))
+            except Exception:
+                traceback.print_exc()
+                results.append((name, "failed"))
+                continue
+
+        with open(f"{log_dir}/{name}.done.json", "w") as f:
+            json.dump(makeBatchJobStamp(job), f, indent=4)
+        results.append((name, "done"))
+
+    return results
+
+
+def runBatch(manifestPath: str, max_workers: int | None = None, force: bool = False, log_dir: str = "output/batch") -> List[Tuple[str, str]]:
+    """
+    run all jobs in a manifest in a process pool. 用进程池执行任务清单里的所有任务
+    :param manifestPath: a json file containing a list of jobs, see normalizeBatchJob. 包含任务列表的json文件，见normalizeBatchJob
+    :param max_workers: number of worker processes, default is the cpu count. 工作进程数，默认是cpu核数
+    :param force: run jobs even if they are up to date. 即使任务已经是最新的也重新执行
+    :param log_dir: directory of logs and finish stamps. 日志和完成标记所在的文件夹
+    :return: list of (job name, status), status is done, failed or skipped. (任务名, 状态)的列表，状态是done, failed或者skipped
+    """
+    with open(manifestPath, "r") as f:
+        jobs = [normalizeBatchJob(job) for job in json.load(f)]
+    os.makedirs(log_dir, exist_ok=True)
+
+    results = []
+    # 不同设置的任务输出到不同的文件，只有清单里重复的任务会写同样的文件，这些任务要放到同一个进程里依次执行，避免互相覆盖
+    job_groups: Dict[str, List[Dict[str, Any]]] = {}
+    for job in jobs:
+        name = getBatchJobName(job)
+        if not force and isBatchJobUpToDate(job, f"{log_dir}/{name}.done.json"):
+            results.append((name, "skipped"))
+            continue
+        job_groups.setdefault(name, []).append(job)
+
+    print(f"共{len(jobs)}个任务，跳过{len(results)}个已是最新的任务，日志保存在{log_dir}")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor, tqdm(total=len(jobs) - len(results), desc="Batch", ncols=100, unit="job") as progress:
+        futures = [executor.submit(runBatchJobs, group, log_dir)
+                   for group in job_groups.values()]
+        for future in as_completed(futures):
+            for name, status in future.result():
+                results.append((name, status))
+                progress.write(f"{name}: {status}")
+                progress.update(1)
+
+    return results
+
+
 if __name__ == "__main__":
     avatar = 'asuka'
     # 设定midi文件路径
@@ -362,3 +1080,63 @@ if __name__ == "__main__":
     FPS = 30
     # 设定各弦音高
     guitar_string_notes = ["d", "b", "G", "D", "A", "D1"]
+
+    parser = argparse.ArgumentParser(
+        description="generate guitar performance animation from midi. 从midi生成吉他演奏动画")
+    parser.add_argument("--manifest", help="json file of batch jobs. 批量任务清单的json文件")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes in batch mode. 批量模式的工作进程数")
+    parser.add_argument("--force", action="store_true",
+                        help="rerun jobs that are up to date. 重新执行已是最新的任务")
+    parser.add_argument("--avatar", default=avatar)
+    parser.add_argument("--midi", default=midiFilePath)
+    parser.add_argument("--tracks", type=int, nargs="+", default=[0])
+    parser.add_argument("--channel", type=int, default=0)
+    parser.add_argument("--fps", type=int, default=FPS)
+    parser.add_argument("--tuning", nargs="+", default=guitar_string_notes)
+    parser.add_argument("--octave-down", action="store_true")
+    parser.add_argument("--capo", type=int, default=0)
+    parser.add_argument("--segments", type=int, default=0,
+                        help="solve the left hand in segments with this many processes. 用这么多个进程分段求解左手")
+    parser.add_argument("--compare-sequential", action="store_true",
+                        help="report the entropy difference against the sequential search. 报告与顺序搜索的熵差值")
+    parser.add_argument("--format", choices=list(OUTPUT_FORMATS.keys()), default="json",
+                        help="format of output files, columnar files can be converted back with python -m src.utils.columnar. 输出文件的格式，列式文件可以用python -m src.utils.columnar转换回json")
+    parser.add_argument("--preview", action="store_true",
+                        help="run the whole pipeline without writing any file, including caches, snapshots and checkpoints. 运行整个流程但不写出任何文件，包括缓存、快照和检查点")
+    parser.add_argument("--merge-states", action="store_true",
+                        help="keep only the best path for each hand state in the search pools. 搜索时每种手型状态只保留最好的路径")
+    parser.add_argument("--solver", choices=["beam", "exact"], default="beam",
+                        help="exact finds the left hand with the lowest entropy by dynamic programming. exact用动态规划求熵最小的左手")
+    parser.add_argument("--online", action="store_true",
+                        help="commit hand poses as soon as all search paths agree on them to keep memory flat. 所有搜索路径一致时立刻提交手型，使内存占用不随曲子增长")
+    parser.add_argument("--max-lag", type=int, default=None,
+                        help="with --online, force a commit when this many events are still uncommitted. 配合--online使用，未提交的事件达到这么多时强制提交")
+    parser.add_argument("--checkpoint-every", type=int, default=0,
+                        help="save a checkpoint of the beam searches after every this many events. 束搜索每处理这么多个事件保存一次检查点")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the beam searches from the last checkpoints. 从最后的检查点接着运行束搜索")
+    parser.add_argument("--checkpoint-dir", default="output/checkpoint",
+                        help="directory of checkpoints, copy it to fork the checkpoints. 检查点所在的目录，复制它就可以分叉出新的检查点")
+    parser.add_argument("--incremental", action="store_true",
+                        help="reuse the previous run of the same song, only the changed part is searched and animated again. 复用同一首曲子上一次运行的结果，只重新搜索和生成改动的部分")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed of the random jitter of the right hand, the same seed gives the same animation. 右手随机移动的随机种子，相同的种子得到相同的动画")
+    args = parser.parse_args()
+    if args.online and (args.checkpoint_every > 0 or args.resume or args.incremental):
+        parser.error(
+            "--online cannot be used with --checkpoint-every, --resume or --incremental")
+    if args.incremental and (args.checkpoint_every > 0 or args.resume):
+        parser.error(
+            "--incremental cannot be used with --checkpoint-every or --resume")
+    if args.preview and args.checkpoint_every > 0:
+        parser.error("--preview cannot be used with --checkpoint-every")
+
+    if args.manifest:
+        results = runBatch(args.manifest, args.workers, args.force)
+        failed = [name for name, status in results if status == "failed"]
+        if failed:
+            print(f"以下任务执行失败，请查看日志：{failed}")
+    else:
+        main(args.avatar, args.midi, args.tracks, args.channel,
+             args.fps, args.tuning, args.octave_down, args.capo, args.segments, args.compare_sequential, args.format, args.preview, args.merge_states, args.solver, args.online, args.max_lag, args.checkpoint_every, args.resume, args.checkpoint_dir, args.incremental, args.seed)
@@ -1,70 +1,195 @@
 from .hand.LeftHand import LeftHand
 from .hand.RightHand import RightHand
-from src.midi.midiToNote import calculate_frame
-from typing import List
-import json
+from src.midi.midiToNote import TempoMap
+from src.utils.columnar import saveRecords
+from typing import Callable, List, Any, Optional, Tuple, Type
+from bisect import bisect_right
 
 
-class HandPoseRecorder():
+class HandPoseNode():
     """
-    a recorder for hand pose. 一个手势记录器，用于记录左手指法
+    a node in the path of hand poses, recorders share their common prefix through parent nodes. 手势路径上的一个节点，记录器之间通过父节点共享相同的前缀
+    :param handPose: hand pose. 手型
+    :param entropy: accumulated entropy up to this node. 到这个节点为止的累计熵
+    :param real_tick: real tick of this hand pose. 这个手型所在的real_tick
+    :param parent: previous node in the path. 路径上的前一个节点
     """
+    __slots__ = ("handPose", "entropy", "real_tick", "parent", "length")
 
-    def __init__(self) -> None:
-        self.handPoseList = []
-        self.currentEntropy = 0.0
-        self.entropys = []
-        self.real_ticks = []
+    def __init__(self, handPose: Any, entropy: float, real_tick: float, parent: Optional["HandPoseNode"] = None) -> None:
+        self.handPose = handPose
+        self.entropy = entropy
+        self.real_tick = real_tick
+        self.parent = parent
+        self.length = parent.length + 1 if parent is not None else 1
+
+
+class PoseRecorder():
+    """
+    base class of recorders, the path is stored as a linked list of HandPoseNode and only rebuilt when needed. 记录器的基类，路径以HandPoseNode链表保存，只有在需要时才重建成列表
+    """
 
-    def addHandPose(self, handPose: LeftHand, entropy: float, real_tick: float) -> None:
-        self.handPoseList.append(handPose)
+    # toRecords是否每个frame只保留第一条记录
+    uniqueFrames = False
+    # 手型的类，保存检查点时用它的toState和fromState转换手型
+    handPoseClass: Any = None
+
+    def __init__(self, currentEntropy: float = 0.0) -> None:
+        self.currentEntropy = currentEntropy
+        self.lastNode: Optional[HandPoseNode] = None
+
+    def addHandPose(self, handPose: Any, entropy: float, real_tick: float) -> None:
         self.currentEntropy += entropy
-        self.entropys.append(self.currentEntropy)
-        self.real_ticks.append(real_tick)
+        self.lastNode = HandPoseNode(
+            handPose, self.currentEntropy, real_tick, self.lastNode)
+
+    def extend(self, handPose: Any, entropy: float, real_tick: float) -> Any:
+        """
+        create a new recorder whose path is the current path plus a new hand pose, the current path is shared instead of copied. 生成一个新的记录器，它的路径是当前路径加上一个新手型，当前路径是共享的而不是复制的
+        """
+        newRecorder = self.__class__()
+        newRecorder.currentEntropy = self.currentEntropy + entropy
+        newRecorder.lastNode = HandPoseNode(
+            handPose, newRecorder.currentEntropy, real_tick, self.lastNode)
+        return newRecorder
+
+    def currentHandPose(self) -> Any:
+        return self.lastNode.handPose  # type: ignore
+
+    def nodes(self) -> List[HandPoseNode]:
+        """
+        rebuild the path from the first node to the last node. 从第一个节点到最后一个节点重建路径
+        """
+        result = []
+        node = self.lastNode
+        while node is not None:
+            result.append(node)
+            node = node.parent
+        result.reverse()
+        return result
+
+    def __len__(self) -> int:
+        return self.lastNode.length if self.lastNode is not None else 0
+
+    @property
+    def handPoseList(self) -> List[Any]:
+        return [node.handPose for node in self.nodes()]
+
+    @property
+    def entropys(self) -> List[float]:
+        return [node.entropy for node in self.nodes()]
+
+    @property
+    def real_ticks(self) -> List[float]:
+        return [node.real_tick for node in self.nodes()]
+
+
+def flattenRecorders(recorders: List[PoseRecorder]) -> Tuple[List[tuple], List[int]]:
+    """
+    flatten the shared path tree of recorders into a list, so it can be sent to other processes without deep recursion. 把记录器共享的路径树展开成列表，这样传给其它进程时不会递归过深
+    :return: nodes as (handPose, entropy, real_tick, parent index), parents always come before children, and the node index of each recorder. (手型, 熵, real_tick, 父节点索引)形式的节点列表，父节点总在子节点之前，以及每个记录器的节点索引
+    """
+    nodeIndexes = {}
+    flatNodes = []
+    tails = []
+    for recorder in recorders:
+        newNodes = []
+        node = recorder.lastNode
+        while node is not None and id(node) not in nodeIndexes:
+            newNodes.append(node)
+            node = node.parent
+        for node in reversed(newNodes):
+            parentIndex = nodeIndexes[id(
+                node.parent)] if node.parent is not None else -1
+            nodeIndexes[id(node)] = len(flatNodes)
+            flatNodes.append(
+                (node.handPose, node.entropy, node.real_tick, parentIndex))
+        tails.append(
+            nodeIndexes[id(recorder.lastNode)] if recorder.lastNode is not None else -1)
+
+    return flatNodes, tails
+
+
+def unflattenRecorders(flatNodes: List[tuple], tails: List[int], recorderClass: Type[PoseRecorder]) -> List[Any]:
+    """
+    rebuild recorders from the result of flattenRecorders. 用flattenRecorders的结果重建记录器
+    """
+    nodes: List[HandPoseNode] = []
+    for handPose, entropy, real_tick, parentIndex in flatNodes:
+        nodes.append(HandPoseNode(handPose, entropy, real_tick,
+                     nodes[parentIndex] if parentIndex != -1 else None))
+
+    recorders = []
+    for tail in tails:
+        recorder = recorderClass()
+        if tail != -1:
+            recorder.lastNode = nodes[tail]
+            recorder.currentEntropy = nodes[tail].entropy
+        recorders.append(recorder)
+    return recorders
+
+
+class HandPoseRecorder(PoseRecorder):
+    """
+    a recorder for hand pose. 一个手势记录器，用于记录左手指法
+    """
+    uniqueFrames = True
+    handPoseClass = LeftHand
 
     def currentHandPose(self) -> LeftHand:
-        return self.handPoseList[-1]
+        return self.lastNode.handPose  # type: ignore
 
     def outputCurrent(self, showOpenFinger: bool = False) -> None:
-        if len(self.handPoseList) > 0:
+        if self.lastNode is not None:
             print("Entropy: ", self.currentEntropy)
-            print("real_tick: ", self.real_ticks[-1])
-            self.handPoseList[-1].output(showOpenFinger)
+            print("real_tick: ", self.lastNode.real_tick)
+            self.lastNode.handPose.output(showOpenFinger)
 
     def output(self, showOpenFinger: bool = False) -> None:
-        for i in range(1, len(self.handPoseList)):
-            print("Entropy: ", self.entropys[i])
-            print("real_tick: ", self.real_ticks[i])
-            self.handPoseList[i].output(showOpenFinger)
-
-    def save(self, jsonFilePath: str, tempo_changes: List[tuple], ticks_per_beat: int, FPS: int):
+        for node in self.nodes()[1:]:
+            print("Entropy: ", node.entropy)
+            print("real_tick: ", node.real_tick)
+            node.handPose.output(showOpenFinger)
+
+    @staticmethod
+    def nodeRecord(node: HandPoseNode, frame: float) -> dict:
+        """
+        the record of one node. 一个节点的记录
+        """
+        handInfo = []
+        leftHand = node.handPose
+        for finger in leftHand.fingers:
+            fingerIndex = finger._fingerIndex
+            fingerInfo = {
+                "stringIndex": finger.stringIndex,
+                "fret": finger.fret,
+                "press": finger.press
+            }
+            handInfo.append({
+                "fingerIndex": fingerIndex,
+                "fingerInfo": fingerInfo
+            })
 
+        return {
+            "real_tick": node.real_tick,
+            "frame": frame,
+            "leftHand": handInfo,
+            "use_barre": leftHand.useBarre,
+            "hand_position": leftHand.handPosition
+        }
+
+    def toRecords(self, tempo_changes: List[tuple], ticks_per_beat: int, FPS: int) -> List[dict]:
+        """
+        the records written by save, sorted by frame and deduplicated. save所写出的记录，按frame排序并去重
+        流水线里的后续阶段可以直接使用这份数据，不必先写文件再读回来
+        """
         handsDict = []
-        for i in range(1, len(self.handPoseList)):
-            handInfo = []
-            real_tick = self.real_ticks[i]
-            frame = calculate_frame(
-                tempo_changes, ticks_per_beat, FPS, real_tick)
-            leftHand = self.handPoseList[i]
-            for finger in leftHand.fingers:
-                fingerIndex = finger._fingerIndex
-                fingerInfo = {
-                    "stringIndex": finger.stringIndex,
-                    "fret": finger.fret,
-                    "press": finger.press
-                }
-                handInfo.append({
-                    "fingerIndex": fingerIndex,
-                    "fingerInfo": fingerInfo
-                })
-
-            handsDict.append({
-                "real_tick": real_tick,
-                "frame": frame,
-                "leftHand": handInfo,
-                "use_barre": leftHand.useBarre,
-                "hand_position": leftHand.handPosition
-            })
+        nodes = self.nodes()[1:]
+        # 一次性把所有real_tick转换为帧数
+        frames = TempoMap(tempo_changes, ticks_per_beat, FPS).ticks_to_frames(
+            [node.real_tick for node in nodes]).tolist()
+        for node, frame in zip(nodes, frames):
+            handsDict.append(self.nodeRecord(node, frame))
 
         # 统计去重前的数量
         original_count = len(handsDict)
@@ -88,91 +213,254 @@ class HandPoseRecorder():
         print(
             f"去重统计: 原始记录 {original_count} 条，去重后 {unique_count} 条，删除重复记录 {duplicates_removed} 条")
 
-        with open(jsonFilePath, 'w') as f:
-            json.dump(unique_hands_dict, f, indent=4)
+        return unique_hands_dict
 
+    def save(self, jsonFilePath: str, tempo_changes: List[tuple], ticks_per_beat: int, FPS: int):
+        saveRecords(jsonFilePath, self.toRecords(
+            tempo_changes, ticks_per_beat, FPS), indent=4)
 
-class RightHandRecorder():
-    def __init__(self) -> None:
-        self.handPoseList = []
-        self.currentEntropy = 0
-        self.entropys = []
-        self.real_ticks = []
 
-    def addHandPose(self, handPose: RightHand, entropy: int, real_tick: float) -> None:
-        self.handPoseList.append(handPose)
-        self.currentEntropy += entropy
-        self.entropys.append(self.currentEntropy)
-        self.real_ticks.append(real_tick)
+class RightHandRecorder(PoseRecorder):
+    handPoseClass = RightHand
 
-    def currentHandPose(self) -> RightHand:
-        return self.handPoseList[-1]
+    def __init__(self) -> None:
+        super().__init__(0)
 
-    def save(self, jsonFilePath: str, tempo_changes: List[tuple], ticks_per_beat: int, FPS: int):
+    def currentHandPose(self) -> RightHand:
+        return self.lastNode.handPose  # type: ignore
+
+    @staticmethod
+    def nodeRecord(node: HandPoseNode, frame: float) -> dict:
+        """
+        the record of one node. 一个节点的记录
+        """
+        rightHand = node.handPose
+        # 复制成列表，与写入文件再读回来得到的数据一致
+        handInfo = {
+            "usedFingers": list(rightHand.usedFingers),
+            "rightFingerPositions": list(rightHand.rightFingerPositions),
+        }
+        return {
+            "real_tick": node.real_tick,
+            "frame": frame,
+            "rightHand": handInfo
+        }
+
+    def toRecords(self, tempo_changes: List[tuple], ticks_per_beat: int, FPS: int) -> List[dict]:
+        """
+        the records written by save. save所写出的记录
+        """
         handsDict = []
-        for i in range(1, len(self.handPoseList)):
-            handInfo = []
-            real_tick = self.real_ticks[i]
-            frame = calculate_frame(
-                tempo_changes, ticks_per_beat, FPS, real_tick)
-            rightHand = self.handPoseList[i]
-            handInfo = {
-                "usedFingers": rightHand.usedFingers,
-                "rightFingerPositions": rightHand.rightFingerPositions,
-            }
+        nodes = self.nodes()[1:]
+        frames = TempoMap(tempo_changes, ticks_per_beat, FPS).ticks_to_frames(
+            [node.real_tick for node in nodes]).tolist()
+        for node, frame in zip(nodes, frames):
+            handsDict.append(self.nodeRecord(node, frame))
 
-            handsDict.append({
-                "real_tick": real_tick,
-                "frame": frame,
-                "rightHand": handInfo
-            })
+        return handsDict
 
-        with open(jsonFilePath, 'w') as f:
-            json.dump(handsDict, f, indent=4)
+    def save(self, jsonFilePath: str, tempo_changes: List[tuple], ticks_per_beat: int, FPS: int):
+        saveRecords(jsonFilePath, self.toRecords(
+            tempo_changes, ticks_per_beat, FPS), indent=4)
 
     def output(self):
         print("Entropy: ", self.currentEntropy)
-        for i in range(1, len(self.handPoseList)):
-            print("Entropy: ", self.entropys[i])
-            print("real_tick: ", self.real_ticks[i])
-            self.handPoseList[i].output()
+        for node in self.nodes()[1:]:
+            print("Entropy: ", node.entropy)
+            print("real_tick: ", node.real_tick)
+            node.handPose.output()
 
 
 class HandPoseRecordPool():
     """
     a pool including hand pose recorders. 包含手势记录器的池子
     :param size: size of the pool. 池子的大小
+    :param merge_states: keep only the recorder with the lowest entropy among those ending in the same hand state. 以相同手型状态结尾的记录器只保留熵最小的一个
+    手型状态相同的记录器之后的转移完全相同，熵大的那个永远不会胜出，合并以后池子里的位置可以留给更多不同的手型，和动态规划的做法一样
     """
 
-    def __init__(self, size: int = 10) -> None:
+    def __init__(self, size: int = 10, merge_states: bool = False) -> None:
         self.curHandPoseRecordPool = []
         self.preHandPoseRecordPool = []
+        # 与curHandPoseRecordPool平行的熵值数组，始终保持升序，用于二分查找插入位置
+        self.curEntropys = []
         self.size = size
+        self.merge_states = merge_states
+        # 合并状态时，当前每个手型状态对应的记录器
+        self.curStates = {}
+        # 是否因为池子满了或者在线模式强制提交而丢弃过记录器，没有丢弃过时池子里的结果就是精确解
+        self.truncated = False
+
+    def setRecorders(self, recorders: List[Any]) -> None:
+        """
+        replace the current recorders, they are sorted by entropy and only the best ones are kept. 替换当前的记录器，按熵值排序后只保留最好的几个
+        """
+        recorders = sorted(
+            recorders, key=lambda recorder: recorder.currentEntropy)
+        self.curStates = {}
+        if self.merge_states:
+            for recorder in recorders:
+                stateKey = recorder.currentHandPose().stateKey()
+                if stateKey not in self.curStates and len(self.curStates) < self.size:
+                    self.curStates[stateKey] = recorder
+            recorders = list(self.curStates.values())
+        self.curHandPoseRecordPool = recorders[:self.size]
+        self.curEntropys = [
+            recorder.currentEntropy for recorder in self.curHandPoseRecordPool]
 
     def readyForRecord(self) -> None:
-        self.preHandPoseRecordPool = self.curHandPoseRecordPool[:]
+        self.preHandPoseRecordPool = self.curHandPoseRecordPool
         self.curHandPoseRecordPool = []
+        self.curEntropys = []
+        self.curStates = {}
 
     def check_insert_index(self, entropy: float) -> int:
-        current_size = len(self.curHandPoseRecordPool)
-        current_HandPoseRecord_is_largest = current_size > 0 and entropy >= self.curHandPoseRecordPool[
-            -1].currentEntropy
-        if current_size == self.size and current_HandPoseRecord_is_largest:
+        """
+        find the insert index of a new recorder, -1 means it can not be inserted. 找到新记录器的插入位置，返回-1表示无法插入
+        熵值相同时插在已有记录器之后，与逐个比较的排序结果保持一致
+        """
+        # 池子已满，而且新记录器不比最后一个好，直接拒绝，不需要二分查找
+        if len(self.curEntropys) == self.size and entropy >= self.curEntropys[-1]:
+            self.truncated = True
             return -1
 
-        if current_size == 0 or (current_size < self.size and current_HandPoseRecord_is_largest):
-            return current_size
-
-        for i in range(current_size):
-            if entropy < self.curHandPoseRecordPool[i].currentEntropy:
-                return i
-
-        return current_size
+        return bisect_right(self.curEntropys, entropy)
 
     def insert_new_hand_pose_recorder(self, newHandPoseRecorder, index):
+        if self.merge_states:
+            stateKey = newHandPoseRecorder.currentHandPose().stateKey()
+            oldRecorder = self.curStates.get(stateKey)
+            if oldRecorder is not None:
+                # 同一状态下已经有熵不比它大的记录器，新记录器直接丢弃
+                if oldRecorder.currentEntropy <= newHandPoseRecorder.currentEntropy:
+                    return
+                # 否则去掉旧的记录器，腾出来的位置留给新记录器
+                oldIndex = next(i for i, recorder in enumerate(
+                    self.curHandPoseRecordPool) if recorder is oldRecorder)
+                self.curHandPoseRecordPool.pop(oldIndex)
+                self.curEntropys.pop(oldIndex)
+                if oldIndex < index:
+                    index -= 1
+            self.curStates[stateKey] = newHandPoseRecorder
+
         # 插入新的元素
         self.curHandPoseRecordPool.insert(index, newHandPoseRecorder)
+        self.curEntropys.insert(index, newHandPoseRecorder.currentEntropy)
 
         # 如果插入后的大小超过了 self.size，移除最后一个元素
         if len(self.curHandPoseRecordPool) > self.size:
-            self.curHandPoseRecordPool.pop()
+            removedRecorder = self.curHandPoseRecordPool.pop()
+            self.curEntropys.pop()
+            self.truncated = True
+            if self.merge_states:
+                del self.curStates[removedRecorder.currentHandPose().stateKey()]
+
+
+def ancestorAt(node: HandPoseNode, length: int) -> HandPoseNode:
+    """
+    the ancestor of node whose path length is length. node的祖先中路径长度为length的那个节点
+    """
+    while node.length > length:
+        node = node.parent  # type: ignore
+    return node
+
+
+def commonAncestor(recorders: List[PoseRecorder]) -> Optional[HandPoseNode]:
+    """
+    the deepest node shared by the paths of all recorders, None if they share nothing. 所有记录器的路径共有的最深的节点，没有共有节点时返回None
+    """
+    nodes = [recorder.lastNode for recorder in recorders if recorder.lastNode is not None]
+    if not nodes:
+        return None
+    length = min(node.length for node in nodes)
+    # 同一个节点只需要往上走一次，路径汇合以后要比较的节点越来越少
+    uniqueNodes = {id(node): node for node in (
+        ancestorAt(node, length) for node in nodes)}
+    while len(uniqueNodes) > 1:
+        parents = [node.parent for node in uniqueNodes.values()]
+        if any(parent is None for parent in parents):
+            return None
+        uniqueNodes = {id(parent): parent for parent in parents}
+    return next(iter(uniqueNodes.values()))
+
+
+class OnlineDecoder():
+    """
+    commit the path shared by all recorders as soon as it appears, and drop it from memory. 一旦所有记录器的路径有了共同的前缀，就立刻提交这段路径，并把它从内存里释放
+    之后不论哪个记录器胜出，它的路径都经过这个共同的节点，所以提交的结果与搜索完再读取最优解完全相同
+    :param recorderClass: HandPoseRecorder or RightHandRecorder, used to convert nodes to records. 用于把节点转换为记录
+    :param tempoMap: tempo map of the song. 曲子的速度表
+    :param max_lag: if the uncommitted path grows longer than this, commit the path of the best recorder and drop the recorders that disagree with it, None means never. 未提交的路径比这个长时，强制提交最优记录器的路径并丢弃与它不一致的记录器，None表示从不强制提交
+    :param emit: called with every batch of committed records, if None they are kept in records. 每批提交的记录都会传给它，为None时保存在records里
+    """
+
+    def __init__(self, recorderClass: Type[PoseRecorder], tempoMap: TempoMap, max_lag: int | None = None, emit: Optional[Callable[[List[dict]], None]] = None) -> None:
+        self.recorderClass = recorderClass
+        self.tempoMap = tempoMap
+        self.max_lag = max_lag
+        self.emit = emit
+        self.records: List[dict] = []
+        # 已经提交的路径长度，第一个节点是初始手型，不输出
+        self.committedLength = 1
+        self.lastFrame = None
+        self.forcedCommits = 0
+        self.maxLag = 0
+
+    def _commit(self, lastNode: HandPoseNode) -> None:
+        nodes = []
+        node = lastNode
+        while node.length > self.committedLength:
+            nodes.append(node)
+            node = node.parent  # type: ignore
+        nodes.reverse()
+        # 切断已经提交的路径，之前的节点都可以被回收
+        lastNode.parent = None
+        self.committedLength = lastNode.length
+        if not nodes:
+            return
+
+        frames = self.tempoMap.ticks_to_frames(
+            [node.real_tick for node in nodes]).tolist()
+        records = []
+        for node, frame in zip(nodes, frames):
+            # 事件按时间顺序提交，与toRecords一样每个frame只保留第一条记录
+            if self.recorderClass.uniqueFrames and frame == self.lastFrame:
+                continue
+            self.lastFrame = frame
+            records.append(self.recorderClass.nodeRecord(node, frame))
+        if self.emit is not None:
+            self.emit(records)
+        else:
+            self.records.extend(records)
+
+    def update(self, handPoseRecordPool: HandPoseRecordPool) -> None:
+        """
+        call it after every event of the search. 在搜索的每个事件之后调用
+        """
+        recorders = handPoseRecordPool.curHandPoseRecordPool
+        if not recorders:
+            return
+        ancestor = commonAncestor(recorders)
+        bestNode = recorders[0].lastNode
+        if self.max_lag is not None and bestNode.length - self.committedLength > self.max_lag:
+            target = ancestorAt(bestNode, bestNode.length - self.max_lag)
+            if ancestor is None or ancestor.length < target.length:
+                agreeing = [recorder for recorder in recorders
+                            if ancestorAt(recorder.lastNode, target.length) is target]
+                if len(agreeing) < len(recorders):
+                    handPoseRecordPool.truncated = True
+                handPoseRecordPool.setRecorders(agreeing)
+                ancestor = target
+                self.forcedCommits += 1
+        if ancestor is not None and ancestor.length > self.committedLength:
+            self._commit(ancestor)
+        self.maxLag = max(self.maxLag, bestNode.length - self.committedLength)
+
+    def finish(self, bestRecorder: PoseRecorder) -> List[dict]:
+        """
+        commit the rest of the best path when the search is finished. 搜索结束后提交最优路径剩下的部分
+        :return: all committed records if emit is None. emit为None时返回所有提交的记录
+        """
+        if bestRecorder.lastNode is not None:
+            self._commit(bestRecorder.lastNode)
+        return self.records
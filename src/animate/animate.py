@@ -1,24 +1,24 @@
-import json
 import numpy as np
 from numpy import array, linalg, cross
 from ..hand.LeftFinger import PRESSSTATE
 from ..hand.RightHand import caculateRightHandFingers, calculateRightPick
-from ..utils.utils import lerp_by_fret, slerp
-from typing import Any
+from ..utils.utils import lerp_by_fret, slerp, slerp_many
+from ..utils.columnar import loadRecords, saveRecords
+from .avatar_rig import AvatarRig, FretTable, loadAvatarRig
+from typing import Any, Callable, List, Tuple
 
 
-def leftHand2Animation(avatar: str, recorder: str, animation_json_path: str, FPS: float, max_string_index: int, disable_barre: bool = True) -> None:
+def leftHand2Animation(avatar: str, recorder: str | List[dict], animation_json_path: str | None, FPS: float, max_string_index: int, disable_barre: bool = True, record_offsets: List[int] | None = None) -> List[dict]:
     """
-    :params recorder: the path of the recorder file
-    :params animation_json_path: the path of the file store information for animation
+    :params recorder: the path of the recorder file, or the recorder data in memory
+    :params animation_json_path: the path of the file store information for animation, None means not writing a file
     :params BPM: the BPM of the music
-    :params FPS: the FPS of the animation"""
-    json_file = f'asset\\controller_infos\\{avatar}.json'
-    with open(json_file, "r") as f:
-        avatar_data = json.load(f)
-    finger_position_p0 = array(avatar_data['LEFT_FINGER_POSITIONS']["P0"])
-    finger_position_p1 = array(avatar_data['LEFT_FINGER_POSITIONS']["P1"])
-    finger_position_p2 = array(avatar_data['LEFT_FINGER_POSITIONS']["P2"])
+    :params FPS: the FPS of the animation
+    :params record_offsets: if given, the index of the first animation item of every record and the total count are appended to it. 如果传入，会依次追加每个记录的第一个动画数据的索引，最后追加动画数据的总数"""
+    rig = loadAvatarRig(avatar)
+    finger_position_p0 = rig.leftFingerPositions["P0"]
+    finger_position_p1 = rig.leftFingerPositions["P1"]
+    finger_position_p2 = rig.leftFingerPositions["P2"]
 
     # 这是人物按下弦需要的时间，还是挺快的
     press_duration = FPS / 16
@@ -39,58 +39,55 @@ def leftHand2Animation(avatar: str, recorder: str, animation_json_path: str, FPS
 
     data_for_animation = []
 
-    with open(recorder, "r") as f:
-        handDicts = json.load(f)
-
-    # 初始化状态
-    init_state = None
+    handDicts = loadRecords(recorder)
+    if len(handDicts) == 0:
+        if record_offsets is not None:
+            record_offsets.append(0)
+        if animation_json_path is not None:
+            saveRecords(animation_json_path, data_for_animation)
+        return data_for_animation
+
+    # 每个姿势只计算一次，下一个动作的预备状态直接使用下一个姿势
+    poses = LeftHandPoses(rig, handDicts, normal, max_string_index,
+                          press_distance, disable_barre)
+    beat_states = poses.fingerInfos()
+
+    # 先确定每两个动作之间要插入哪些状态，再一次性计算所有需要的rest状态
+    gap_cases = []
+    rest_items = []
+    for i in range(len(handDicts)):
+        if i == len(handDicts) - 1:
+            gap_case = "last"
+        else:
+            gap_case = left_hand_gap_case(handDicts[i + 1]["frame"] - handDicts[i]["frame"],
+                                          press_duration, elapsed_frame, finger_return_to_rest_frame)
+        gap_cases.append(gap_case)
+        if gap_case in ("last", "full", "move"):
+            rest_items.append(i)
+
+    # 随机数的使用顺序与逐帧计算时相同：先是初始状态，然后按顺序是各个rest状态
+    random_vectors = np.random.rand(1 + len(rest_items), 3)
+    init_state = poses.restState(
+        0, beat_states[0], range(1, 5), random_vectors[0], press_distance, 0.5)
+    rest_states = {}
+    for rest_index, i in enumerate(rest_items):
+        finger_index_set_need_to_change = []
+        if i != len(handDicts) - 1:
+            finger_index_set_need_to_change = fingers_need_to_lift(
+                handDicts[i]["leftHand"], handDicts[i + 1]["leftHand"])
+        rest_states[i] = poses.restState(
+            i, beat_states[i], finger_index_set_need_to_change, random_vectors[1 + rest_index], press_distance, 0.25)
 
     for i in range(len(handDicts)):
         item = handDicts[i]
         frame = item["frame"]
         pitchwheel = item.get("pitchwheel", 0)
-
-        # 计算当前帧的动画信息（beat状态）
-        current_finger_infos = animatedLeftHand(
-            avatar_data, item, normal, max_string_index, pitchwheel, rest_finger_distance=press_distance, disable_barre=disable_barre)
-
-        # 获取需要抬指的手指索引集合
-        finger_index_set_need_to_change = set()
-
-        # 初始化下一帧信息
-        next_frame = None
-        next_finger_infos = None
-
-        # 如果不是最后一帧，获取下一帧信息
-        if i != len(handDicts) - 1:
-            next_frame = handDicts[i + 1]["frame"]
-            next_pitchwheel = handDicts[i + 1].get("pitchwheel", 0)
-            next_finger_infos = animatedLeftHand(
-                avatar_data, handDicts[i + 1], normal, max_string_index, next_pitchwheel, rest_finger_distance=press_distance, disable_barre=disable_barre)
-
-            # 对比当前手势和下一个手势，找出来姿势切换时需要抬指的手指
-            current_hand = item["leftHand"]
-            current_finger_dict = {
-                finger['fingerIndex']: finger['fingerInfo'] for finger in current_hand}
-
-            next_hand = handDicts[i + 1]["leftHand"]
-            next_finger_dict = {
-                finger['fingerIndex']: finger['fingerInfo'] for finger in next_hand}
-
-            for finger_index in range(1, 5):
-                current_finger = current_finger_dict.get(finger_index)
-                next_finger = next_finger_dict.get(finger_index)
-                # 如果一个手指当前是按弦状态，而下一个状态换弦了，就需要有抬指的动作（换品可以不抬指直接滑过去）
-                if current_finger and next_finger and \
-                   current_finger['press'] != 0 and \
-                   current_finger['stringIndex'] != next_finger['stringIndex']:
-                    finger_index_set_need_to_change.add(finger_index)
+        is_last = i == len(handDicts) - 1
+        if record_offsets is not None:
+            record_offsets.append(len(data_for_animation))
 
         # 第一帧需要添加初始状态
         if i == 0:
-            # 创建初始状态（所有手指处于休息状态）
-            init_state = create_init_state(
-                avatar_data, item, normal, max_string_index, pitchwheel, press_distance, disable_barre)
             data_for_animation.append({
                 "frame": 0,
                 "fingerInfos": init_state,
@@ -100,73 +97,323 @@ def leftHand2Animation(avatar: str, recorder: str, animation_json_path: str, FPS
         # 添加当前帧（beat状态）
         data_for_animation.append({
             "frame": frame,
-            "fingerInfos": current_finger_infos,
+            "fingerInfos": beat_states[i],
             "pitchwheel": pitchwheel
         })
 
         # 插入中间帧
         frames_to_insert = interpolate_left_hand_frames(
             current_frame=frame,
-            next_frame=next_frame,
-            current_beat_state=current_finger_infos,
-            next_ready_state=next_finger_infos,
-            finger_index_set_need_to_change=finger_index_set_need_to_change,
-            normal=normal,
-            press_distance=press_distance,
+            next_frame=None if is_last else handDicts[i + 1]["frame"],
+            current_beat_state=beat_states[i],
+            next_ready_state=None if is_last else beat_states[i + 1],
+            rest_state=rest_states.get(i),
+            gap_case=gap_cases[i],
             press_duration=press_duration,
             action_duration=elapsed_frame,
             rest_duration=finger_return_to_rest_frame,
             is_first_action=(i == 0),
             init_state=init_state,
             pitchwheel=pitchwheel,
-            next_pitchwheel=handDicts[i +
-                                      1].get("pitchwheel", 0) if i != len(handDicts) - 1 else 0
+            next_pitchwheel=0 if is_last else handDicts[i + 1].get("pitchwheel", 0)
         )
 
         # 将插值帧添加到动画数据中
         for frame_data in frames_to_insert:
             data_for_animation.append(frame_data)
 
-    with open(animation_json_path, "w") as f:
-        json.dump(data_for_animation, f)
+    if record_offsets is not None:
+        record_offsets.append(len(data_for_animation))
+    if animation_json_path is not None:
+        saveRecords(animation_json_path, data_for_animation)
+    return data_for_animation
 
 
-def create_init_state(avatar_data, item, normal, max_string_index, pitchwheel, press_distance, disable_barre):
-    """创建初始状态（所有手指处于休息位置）"""
-    # 复制当前状态作为基础
-    init_finger_infos = animatedLeftHand(
-        avatar_data, item, normal, max_string_index, pitchwheel, rest_finger_distance=press_distance, disable_barre=disable_barre)
+LEFT_FINGER_CONTROLLERS = {
+    1: "I_L",
+    2: "M_L",
+    3: "R_L",
+    4: "P_L"
+}
 
-    # 将所有手指移动到休息位置
-    left_finger_index_dict = {
-        1: "I_L",
-        2: "M_L",
-        3: "R_L",
-        4: "P_L"
-    }
 
+class LeftHandPoses():
+    """
+    beat poses of all left hand records, computed at once with numpy. 用numpy一次性计算所有左手记录的按弦姿势
+    每个控制器的结果保存为一个(记录数, 3或4)的数组，计算顺序与animatedLeftHand相同，结果逐位相同
+    :param rig: controller infos of the avatar. 角色的控制器信息
+    :param handDicts: left hand records. 左手记录
+    :param normal: normal of the fretboard. 指板平面的法线
+    :param rest_finger_distance: how high a finger is lifted. 手指抬起的高度
+    """
+
+    def __init__(self, rig: AvatarRig, handDicts: List[dict], normal: np.ndarray, max_string_index: int, rest_finger_distance: float, disable_barre: bool = False) -> None:
+        self.rig = rig
+        self.normal = normal
+        self.max_string_index = max_string_index
+
+        # 逐个手指收集品格、弦和抬指信息，每个手指是一行
+        finger_frets = []
+        finger_strings = []
+        finger_lifts = []
+        finger_barres = []
+        # 每个记录中各控制器的名字和所在的行，顺序与animatedLeftHand中写入字典的顺序相同
+        self.finger_rows: List[List[tuple]] = []
+        use_barres = []
+        hand_frets = []
+        index_strings = []
+        hand_states = []
+        barre_strings = []
+
+        for item in handDicts:
+            pitchwheel = item.get("pitchwheel", 0)
+            use_barre = item.get("use_barre", False) and not disable_barre
+            finger_string_numbers = {1: 0, 2: 0, 3: 0, 4: 0}
+            barre_finger_string_index = 0
+            rows = []
+            for finger_data in item["leftHand"]:
+                fingerIndex = finger_data["fingerIndex"]
+                stringIndex = finger_data["fingerInfo"]["stringIndex"]
+                fret = finger_data["fingerInfo"]["fret"]
+                press = finger_data["fingerInfo"]["press"]
+
+                # skip open string. 空弦音跳过
+                if fingerIndex == -1:
+                    continue
+
+                # 不按弦的手指会稍微移动，以避免和按弦的手指挤在一起
+                if press == PRESSSTATE['Open']:
+                    if stringIndex > 2:
+                        stringIndex -= 0.5
+                    else:
+                        stringIndex += 0.5
+
+                # 按弦的手指考虑是否有pitchWheel，以进行对应的移动
+                if press == PRESSSTATE['Pressed'] and pitchwheel != 0:
+                    pitch_move = pitchwheel / 8192
+                    if stringIndex > 2:
+                        stringIndex -= pitch_move
+                    else:
+                        stringIndex += pitch_move
+
+                is_barre = use_barre and fingerIndex == 1
+                lift = 0
+                if is_barre:
+                    barre_finger_string_index = stringIndex
+                else:
+                    finger_string_numbers[fingerIndex] = stringIndex
+                    # 如果手指没有按下，那么手指位置会稍微上移，小拇指抬得高一些
+                    if press == PRESSSTATE['Open']:
+                        lift = 2 if fingerIndex == 4 else 1
+
+                rows.append((LEFT_FINGER_CONTROLLERS.get(
+                    fingerIndex, "None"), len(finger_frets)))
+                finger_frets.append(fret)
+                finger_strings.append(stringIndex)
+                finger_lifts.append(lift)
+                finger_barres.append(is_barre)
+
+            self.finger_rows.append(rows)
+            use_barres.append(use_barre)
+            hand_frets.append(item["hand_position"])
+            index_strings.append(finger_string_numbers[1])
+            hand_states.append(finger_string_numbers[4] - finger_string_numbers[1])
+            barre_strings.append(barre_finger_string_index)
+
+        # --开始计算手指信息--
+        finger_strings_array = np.array(finger_strings, dtype=float)
+        finger_lifts_array = np.array(finger_lifts, dtype=int)
+        finger_barres_array = np.array(finger_barres, dtype=bool)
+        self.finger_positions = np.zeros((len(finger_frets), 3))
+
+        rows = np.flatnonzero(~finger_barres_array)
+        if len(rows):
+            fret_02, fret_13 = rig.tables("finger")
+            p_fret_0, p_fret_1 = self._fretValues(
+                fret_02, fret_13, [finger_frets[row] for row in rows])
+            self.finger_positions[rows] = p_fret_0 + \
+                (p_fret_1 - p_fret_0) * finger_strings_array[rows, None] / max_string_index
+            self.finger_positions[finger_lifts_array == 1] -= normal * rest_finger_distance
+            self.finger_positions[finger_lifts_array == 2] -= 2 * normal * rest_finger_distance
+
+        rows = np.flatnonzero(finger_barres_array)
+        if len(rows):
+            barre_02, barre_13 = rig.tables("barre", "I_L")
+            p_fret_0, p_fret_1 = self._fretValues(
+                barre_02, barre_13, [finger_frets[row] for row in rows])
+            self.finger_positions[rows] = p_fret_0 + (p_fret_1 - p_fret_0) * \
+                (finger_strings_array[rows, None] - 2) / (max_string_index - 2)
+
+        # --计算手位置，手臂IK，手旋转，大拇指位置，IK--
+        self.use_barres = np.array(use_barres, dtype=bool)
+        self.hand_frets = hand_frets
+        self.index_strings = np.array(index_strings, dtype=float)
+        self.hand_states = np.array(hand_states, dtype=float)
+        self.barre_strings = np.array(barre_strings, dtype=float)
+        self.hand_values = {value: self._handValues(value, "position")
+                            for value in ("H_L", "HP_L", "T_L", "TP_L")}
+        self.hand_values["H_rotation_L"] = self._handValues(
+            "H_rotation_L", "rotation")
+
+    @staticmethod
+    def _fretValues(fret_02: FretTable, fret_13: FretTable, frets: List[Any]) -> Tuple[np.ndarray, np.ndarray]:
+        return fret_02.atMany(frets), fret_13.atMany(frets)
+
+    def _handValues(self, value: str, valueType: str) -> List[list]:
+        rig = self.rig
+        max_string_index = self.max_string_index
+        count = len(self.hand_frets)
+        is_rotation = valueType != "position"
+        result: np.ndarray | None = None
+
+        def put(rows: np.ndarray, values: np.ndarray) -> None:
+            nonlocal result
+            if result is None:
+                result = np.empty((count, values.shape[1]))
+            result[rows] = values
+
+        # 非横按的手型，按hand_state分为Normal、Outer和Inner三种情况，算法与twiceLerp相同
+        rows = np.flatnonzero(~self.use_barres)
+        if len(rows):
+            normal_02, normal_13 = rig.tables("normal", value)
+            frets = [self.hand_frets[row] for row in rows]
+            p_normal_fret_02, p_normal_fret_13 = self._fretValues(
+                normal_02, normal_13, frets)
+            string_weight = self.index_strings[rows] / max_string_index
+            hand_state = self.hand_states[rows]
+            hand_weight = np.abs(hand_state / max_string_index)
+
+            def normal_values(selected: np.ndarray, quaternion: bool) -> np.ndarray:
+                if quaternion:
+                    return slerp_many(p_normal_fret_02[selected], p_normal_fret_13[selected], string_weight[selected])
+                return p_normal_fret_02[selected] + \
+                    (p_normal_fret_13[selected] - p_normal_fret_02[selected]) * string_weight[selected, None]
+
+            selected = hand_state == 0
+            if selected.any():
+                put(rows[selected], normal_values(
+                    selected, is_rotation and normal_02.is_quaternion))
+
+            # hand_state大于0时与Outer手型的P0-P2插值，小于0时与Inner手型的P1-P3插值
+            for side, selected, point in (("outer", hand_state > 0, 0), ("inner", hand_state < 0, 1)):
+                if not selected.any():
+                    continue
+                side_table = rig.tables(side, value)[point]
+                if side_table is None:
+                    raise KeyError(
+                        f"{rig.name} controller infos have no side hand shape {value}")
+                quaternion = is_rotation and side_table.is_quaternion
+                p_side = side_table.atMany(
+                    [fret for fret, use in zip(frets, selected) if use])
+                p_normal = normal_values(selected, quaternion)
+                if quaternion:
+                    put(rows[selected], slerp_many(
+                        p_normal, p_side, hand_weight[selected]))
+                else:
+                    put(rows[selected], p_normal +
+                        (p_side - p_normal) * hand_weight[selected, None])
+
+        # 横按的手型，算法与twiceLerpBarreHand相同
+        rows = np.flatnonzero(self.use_barres)
+        if len(rows):
+            barre_02, barre_13 = rig.tables("barre", value)
+            if barre_02 is None or barre_13 is None or not barre_02.size or not barre_13.size:
+                raise ValueError(f"Invalid position data:{value}")
+            p_fret_02, p_fret_13 = self._fretValues(
+                barre_02, barre_13, [self.hand_frets[row] for row in rows])
+            if is_rotation and barre_02.is_quaternion:
+                string_weight = (self.barre_strings[rows] - 2) / (max_string_index - 2)
+                put(rows, slerp_many(p_fret_02, p_fret_13, string_weight))
+            else:
+                put(rows, p_fret_02 + (p_fret_13 - p_fret_02) *
+                    (self.barre_strings[rows, None] - 2) / (max_string_index - 2))
+
+        return result.tolist() if result is not None else []
+
+    def fingerInfos(self) -> List[dict]:
+        """
+        the beat pose of each record, same as animatedLeftHand. 每个记录的按弦姿势，与animatedLeftHand的结果相同
+        """
+        finger_positions = self.finger_positions.tolist()
+        hand_values = self.hand_values
+        result = []
+        for i, rows in enumerate(self.finger_rows):
+            fingerInfos = {}
+            for controller_name, row in rows:
+                fingerInfos[controller_name] = finger_positions[row]
+            for value in ("H_L", "HP_L", "H_rotation_L", "T_L", "TP_L"):
+                fingerInfos[value] = hand_values[value][i]
+            result.append(fingerInfos)
+        return result
+
+    def restState(self, i: int, beat_state: dict, finger_indexes, random_vector: np.ndarray, press_distance: float, hand_move: float) -> dict:
+        """
+        lift some fingers of a beat pose and move the hand randomly. 抬起按弦姿势中的一些手指，并让手随机动一点
+        :param i: index of the record. 记录的索引
+        :param beat_state: the beat pose of the record. 这个记录的按弦姿势
+        :param finger_indexes: fingers to lift. 需要抬起的手指
+        :param random_vector: random direction of the hand. 手移动的随机方向
+        :param hand_move: how far the hand moves, relative to press_distance. 手移动的距离，相对于press_distance
+        """
+        finger_rows = dict(self.finger_rows[i])
+        state = beat_state.copy()
+
+        for finger_index in finger_indexes:
+            controller_name = LEFT_FINGER_CONTROLLERS[finger_index]
+            current_position = self.finger_positions[finger_rows[controller_name]]
+            # 小拇指休息时比其它手指抬得要高一点
+            if finger_index == 4:
+                new_position = current_position - 2 * self.normal * press_distance
+            else:
+                new_position = current_position - self.normal * press_distance
+            state[controller_name] = new_position.tolist()
+
+        random_vector = random_vector / np.linalg.norm(random_vector)
+        state["H_L"] = (array(state["H_L"]) +
+                        random_vector * press_distance * hand_move).tolist()
+        return state
+
+
+def fingers_need_to_lift(current_hand: List[dict], next_hand: List[dict]) -> List[int]:
+    """
+    对比当前手势和下一个手势，找出来姿势切换时需要抬指的手指
+    """
+    current_finger_dict = {
+        finger['fingerIndex']: finger['fingerInfo'] for finger in current_hand}
+    next_finger_dict = {
+        finger['fingerIndex']: finger['fingerInfo'] for finger in next_hand}
+
+    fingers = []
     for finger_index in range(1, 5):
-        controller_name = left_finger_index_dict[finger_index]
-        current_position = array(init_finger_infos[controller_name])
-        # 手指休息时比按弦时抬高一些
-        if finger_index == 4:  # 小拇指抬得更高
-            new_position = current_position - 2 * normal * press_distance
-        else:
-            new_position = current_position - normal * press_distance
-        init_finger_infos[controller_name] = new_position.tolist()
+        current_finger = current_finger_dict.get(finger_index)
+        next_finger = next_finger_dict.get(finger_index)
+        # 如果一个手指当前是按弦状态，而下一个状态换弦了，就需要有抬指的动作（换品可以不抬指直接滑过去）
+        if current_finger and next_finger and \
+           current_finger['press'] != 0 and \
+           current_finger['stringIndex'] != next_finger['stringIndex']:
+            fingers.append(finger_index)
+    return fingers
 
-    # 休息状态的手可以往后一点点位置
-    current_H_position = array(init_finger_infos["H_L"])
-    random_vector = np.random.rand(3)
-    random_vector = random_vector / np.linalg.norm(random_vector)
-    current_H_position += random_vector * press_distance * 0.5
-    init_finger_infos["H_L"] = current_H_position.tolist()
 
-    return init_finger_infos
+def left_hand_gap_case(T, press_duration, action_duration, rest_duration) -> str:
+    """
+    两个动作之间的时间T足够插入哪些状态
+    full: 保持结束、回弹结束、预备状态都可以插入
+    move: 去掉保持beat状态的帧，按完立马开始抬指
+    ready: 只够插入预备状态
+    none: 连预备状态都不够
+    """
+    if T >= rest_duration + action_duration+press_duration:
+        return "full"
+    elif T >= action_duration+press_duration:
+        return "move"
+    elif T >= press_duration:
+        return "ready"
+    return "none"
 
 
-def interpolate_left_hand_frames(current_frame, next_frame, current_beat_state, next_ready_state,
-                                 finger_index_set_need_to_change, normal, press_distance, press_duration, action_duration, rest_duration,
+def interpolate_left_hand_frames(current_frame, next_frame, current_beat_state, next_ready_state, rest_state, gap_case,
+                                 press_duration, action_duration, rest_duration,
                                  is_first_action, init_state, pitchwheel, next_pitchwheel):
     """根据通用插帧逻辑生成左手动画帧"""
     frames_to_insert = []
@@ -183,11 +430,8 @@ def interpolate_left_hand_frames(current_frame, next_frame, current_beat_state,
             })
 
     # 如果没有下一个动作帧，仅插入当前动作的beat状态，以示保持
-    if next_frame is None:
+    if gap_case == "last":
         rest_time = current_frame + rest_duration
-        # 创建rest状态（抬指状态）
-        rest_state = create_rest_state(
-            current_beat_state, press_distance, finger_index_set_need_to_change, normal)
         frames_to_insert.append({
             "frame": rest_time,
             "fingerInfos": current_beat_state,
@@ -195,17 +439,11 @@ def interpolate_left_hand_frames(current_frame, next_frame, current_beat_state,
         })
         return frames_to_insert
 
-    # 获取当前和下一个动作帧的时间戳
-    current_time = current_frame
+    # 获取下一个动作帧的时间戳
     next_time = next_frame
-    T = next_time - current_time  # 可用时间
 
     # 情况1: 时间足够插入所有状态（保持结束、回弹结束、预备状态）
-    if T >= rest_duration + action_duration+press_duration:
-        # 创建rest状态（抬指状态）
-        rest_state = create_rest_state(
-            current_beat_state, press_distance, finger_index_set_need_to_change, normal)
-
+    if gap_case == "full":
         rest_start_time = next_time - press_duration - action_duration-rest_duration
         rest_end_time = next_time - press_duration - action_duration
         ready_time = next_time - press_duration
@@ -232,13 +470,10 @@ def interpolate_left_hand_frames(current_frame, next_frame, current_beat_state,
         })
 
     # 情况2: 时间不够插入所有状态，但足够插入预备状态和移动过程，所以可以去掉保持beat状态的帧，也就是按完立马开始抬指
-    elif T >= action_duration+press_duration:
+    elif gap_case == "move":
         ready_time = next_time - press_duration
         rest_end_time = next_time - press_duration - action_duration
 
-        # 创建rest状态（抬指状态）
-        rest_state = create_rest_state(
-            current_beat_state, press_distance, finger_index_set_need_to_change, normal)
         frames_to_insert.append({
             "frame": rest_end_time,
             "fingerInfos": rest_state,
@@ -249,7 +484,7 @@ def interpolate_left_hand_frames(current_frame, next_frame, current_beat_state,
             "fingerInfos": next_ready_state,
             "pitchwheel": next_pitchwheel
         })
-    elif T >= press_duration:
+    elif gap_case == "ready":
         # 时间只够插入预备状态，所以还是要填入预备状态的
         ready_time = next_time - press_duration
 
@@ -265,69 +500,43 @@ def interpolate_left_hand_frames(current_frame, next_frame, current_beat_state,
     return frames_to_insert
 
 
-def create_rest_state(beat_state, press_distance, finger_index_set_need_to_change, normal):
-    """创建手指抬高的休息状态"""
-    # 复制当前状态
-    rest_state = beat_state.copy()
-
-    left_finger_index_dict = {
-        1: "I_L",
-        2: "M_L",
-        3: "R_L",
-        4: "P_L"
-    }
-
-    # 抬高需要改变的手指
-    for rest_finger_index in list(finger_index_set_need_to_change):
-        controller_name = left_finger_index_dict[rest_finger_index]
-        current_position = array(rest_state[controller_name])
-        # 小拇指休息时比其它手指抬得要高一点
-        if rest_finger_index == 4:
-            new_position = current_position - 2 * normal * press_distance
-        else:
-            new_position = current_position - normal * press_distance
-        rest_state[controller_name] = new_position.tolist()
-
-    # rest状态的手随机动一点
-    current_H_Position = array(rest_state['H_L'])
-    random_vector = np.random.rand(3)
-    random_vector = random_vector / np.linalg.norm(random_vector)
-    current_H_Position += random_vector * press_distance * 0.25
-    rest_state['H_L'] = current_H_Position.tolist()
-
-    return rest_state
+def addPitchwheel(left_hand_recorder_file: str, pitch_wheel_map: list):
+    data = loadRecords(left_hand_recorder_file)
+    saveRecords(left_hand_recorder_file, insertPitchwheel(
+        data, pitch_wheel_map), indent=4)
 
 
-def addPitchwheel(left_hand_recorder_file: str, pitch_wheel_map: list):
-    with open(left_hand_recorder_file, "r") as f:
-        data = json.load(f)
-        total_itmes = len(data)
+def insertPitchwheel(data: List[dict], pitch_wheel_map: list) -> List[dict]:
+    """
+    insert pitchwheel items into left hand records. 把推弦动作插入到左手记录中
+    :return: new records. 新的记录
+    """
+    total_itmes = len(data)
 
-        new_data = []
+    new_data = []
 
-        for i in range(total_itmes):
-            new_item = data[i]
-            new_item['pitchwheel'] = 0
-            new_data.append(new_item)
+    for i in range(total_itmes):
+        new_item = data[i]
+        new_item['pitchwheel'] = 0
+        new_data.append(new_item)
 
-            if i != total_itmes - 1:
-                recorder_tick = data[i]["real_tick"]
-                next_tick = data[i + 1]["real_tick"]
+        if i != total_itmes - 1:
+            recorder_tick = data[i]["real_tick"]
+            next_tick = data[i + 1]["real_tick"]
 
-                for pitch_wheel_item in pitch_wheel_map:
-                    tick = pitch_wheel_item['real_tick']
-                    if recorder_tick <= tick <= next_tick:
-                        insert_item = new_item.copy()
-                        insert_item['real_tick'] = tick
-                        insert_item['frame'] = pitch_wheel_item['frame']
-                        insert_item['pitchwheel'] = pitch_wheel_item['pitchwheel']
-                        new_data.append(insert_item)
+            for pitch_wheel_item in pitch_wheel_map:
+                tick = pitch_wheel_item['real_tick']
+                if recorder_tick <= tick <= next_tick:
+                    insert_item = new_item.copy()
+                    insert_item['real_tick'] = tick
+                    insert_item['frame'] = pitch_wheel_item['frame']
+                    insert_item['pitchwheel'] = pitch_wheel_item['pitchwheel']
+                    new_data.append(insert_item)
 
-        with open(left_hand_recorder_file, "w") as f:
-            json.dump(new_data, f, indent=4)
+    return new_data
 
 
-def animatedLeftHand(avatar_data: object, item: Any, normal: np.ndarray, max_string_index: int, pitchwheel: int, rest_finger_distance, disable_barre: bool = False):
+def animatedLeftHand(rig: AvatarRig, item: Any, normal: np.ndarray, max_string_index: int, pitchwheel: int, rest_finger_distance, disable_barre: bool = False):
     leftHand = item["leftHand"]
     hand_fret = item["hand_position"]
     use_barre = item.get("use_barre", False) and not disable_barre
@@ -373,13 +582,13 @@ def animatedLeftHand(avatar_data: object, item: Any, normal: np.ndarray, max_str
         # 手指的横按与非横按使用两套不同的计算方式
         if use_barre and fingerIndex == 1:
             finger_position = twiceLerpBarreFingers(
-                avatar_data, fret, stringIndex, max_string_index)
+                rig, fret, stringIndex, max_string_index)
             position_value_name = "I_L"
             barre_finger_string_index = stringIndex
         else:
             finger_string_numbers[fingerIndex] = stringIndex
             finger_position = twiceLerpFingers(
-                avatar_data, fret, stringIndex, max_string_index)
+                rig, fret, stringIndex, max_string_index)
             # 如果手指没有按下，那么手指位置会稍微上移
             if press == PRESSSTATE['Open']:
                 # 小拇指就是抬得高一些
@@ -409,7 +618,7 @@ def animatedLeftHand(avatar_data: object, item: Any, normal: np.ndarray, max_str
     # --计算手位置--
     if use_barre:
         hand_position = twiceLerpBarreHand(
-            avatar_data=avatar_data,
+            rig=rig,
             value="H_L",
             valueType="position",
             fret=hand_fret,
@@ -418,7 +627,7 @@ def animatedLeftHand(avatar_data: object, item: Any, normal: np.ndarray, max_str
         )
     else:
         hand_position = twiceLerp(
-            avatar_data=avatar_data,
+            rig=rig,
             hand_state=hand_state,
             value="H_L",
             valueType="position",
@@ -432,7 +641,7 @@ def animatedLeftHand(avatar_data: object, item: Any, normal: np.ndarray, max_str
     # --计算手臂IK，手旋转，大拇指位置，IK--
     if use_barre:
         hand_IK_pivot_position = twiceLerpBarreHand(
-            avatar_data=avatar_data,
+            rig=rig,
             value="HP_L",
             valueType="position",
             fret=hand_fret,
@@ -440,7 +649,7 @@ def animatedLeftHand(avatar_data: object, item: Any, normal: np.ndarray, max_str
             max_string_index=max_string_index
         )
         hand_rotation_l = twiceLerpBarreHand(
-            avatar_data=avatar_data,
+            rig=rig,
             value="H_rotation_L",
             valueType="rotation",
             fret=hand_fret,
@@ -448,7 +657,7 @@ def animatedLeftHand(avatar_data: object, item: Any, normal: np.ndarray, max_str
             max_string_index=max_string_index
         )
         thumb_position = twiceLerpBarreHand(
-            avatar_data=avatar_data,
+            rig=rig,
             value="T_L",
             valueType="position",
             fret=hand_fret,
@@ -456,7 +665,7 @@ def animatedLeftHand(avatar_data: object, item: Any, normal: np.ndarray, max_str
             max_string_index=max_string_index
         )
         thumb_IK_pivot_position = twiceLerpBarreHand(
-            avatar_data=avatar_data,
+            rig=rig,
             value="TP_L",
             valueType="position",
             fret=hand_fret,
@@ -465,7 +674,7 @@ def animatedLeftHand(avatar_data: object, item: Any, normal: np.ndarray, max_str
         )
     else:
         hand_IK_pivot_position = twiceLerp(
-            avatar_data=avatar_data,
+            rig=rig,
             hand_state=hand_state,
             value="HP_L",
             valueType="position",
@@ -474,7 +683,7 @@ def animatedLeftHand(avatar_data: object, item: Any, normal: np.ndarray, max_str
             max_string_index=max_string_index
         )
         hand_rotation_l = twiceLerp(
-            avatar_data=avatar_data,
+            rig=rig,
             hand_state=hand_state,
             value="H_rotation_L",
             valueType="rotation",
@@ -483,7 +692,7 @@ def animatedLeftHand(avatar_data: object, item: Any, normal: np.ndarray, max_str
             max_string_index=max_string_index
         )
         thumb_position = twiceLerp(
-            avatar_data=avatar_data,
+            rig=rig,
             hand_state=hand_state,
             value="T_L",
             valueType="position",
@@ -492,7 +701,7 @@ def animatedLeftHand(avatar_data: object, item: Any, normal: np.ndarray, max_str
             max_string_index=max_string_index
         )
         thumb_IK_pivot_position = twiceLerp(
-            avatar_data=avatar_data,
+            rig=rig,
             hand_state=hand_state,
             value="TP_L",
             valueType="position",
@@ -509,163 +718,171 @@ def animatedLeftHand(avatar_data: object, item: Any, normal: np.ndarray, max_str
     return fingerInfos
 
 
-def rightHand2Animation(avatar: str, recorder: str, animation: str, FPS: int, max_string_index: int) -> None:
+def rightHand2Animation(avatar: str, recorder: str | List[dict], animation: str | None, FPS: int, max_string_index: int, seed: int | None = None, record_offsets: List[int] | None = None) -> List[dict]:
+    """
+    :param seed: seed of the random jitter of the palm, np.random is used if it is None. 手掌随机移动的随机种子，为None时使用np.random
+    :param record_offsets: the same as in leftHand2Animation. 与leftHand2Animation中的相同
+    """
     data_for_animation = []
     # 这里是计算按弦需要保持的时间
     elapsed_frame = int(FPS / 15)
-    json_file = f'asset/controller_infos/{avatar}.json'
-    with open(json_file, 'r') as f:
-        avatar_data = json.load(f)
-        if not avatar_data:
-            raise Exception("avatar_data is empty")
-
-    with open(recorder, "r") as f:
-        handDicts = json.load(f)
-        hand_count = len(handDicts)
-
-        for i in range(hand_count):
-            data = handDicts[i]
-            frame = data['frame']
-            right_hand = data["rightHand"]
-            usedFingers = right_hand["usedFingers"]
-            rightFingerPositions = right_hand["rightFingerPositions"]
-
-            # 这个usedFingers为空，表示是扫弦，所以播放时间要长一些
-            time_multiplier = 2 if usedFingers == [] else 1
-            played_frame = frame + elapsed_frame * time_multiplier
-
-            played_finished_frame = None
-            hold_pose_frame = None
-            if i != hand_count-1:
-                next_frame = handDicts[i + 1]['frame']
-                if next_frame > played_frame + elapsed_frame:
-                    played_finished_frame = played_frame + elapsed_frame
-                    if next_frame > played_finished_frame + elapsed_frame:
-                        hold_pose_frame = next_frame - elapsed_frame
-
-            ready = caculateRightHandFingers(avatar_data,
-                                             rightFingerPositions, usedFingers, max_string_index, isAfterPlayed=False)
-
-            played = caculateRightHandFingers(avatar_data,
-                                              rightFingerPositions, usedFingers, max_string_index, isAfterPlayed=True)
-
-            # 右手拨弦分为四个阶段，准备拨弦，拨弦，拨弦后维持动作，返回准备状态。
-            # 如果与下一个音符之间的间隔足够长，就需要把这些动作都记录下来
-
-            # 触弦帧
-            data_for_animation.append({
-                "frame": frame,
-                "fingerInfos": ready,
-            })
+    rig = loadAvatarRig(avatar)
+    rng = None if seed is None else np.random.RandomState(seed)
+
+    handDicts = loadRecords(recorder)
+    hand_count = len(handDicts)
+
+    for i in range(hand_count):
+        data = handDicts[i]
+        frame = data['frame']
+        right_hand = data["rightHand"]
+        usedFingers = right_hand["usedFingers"]
+        rightFingerPositions = right_hand["rightFingerPositions"]
+
+        # 这个usedFingers为空，表示是扫弦，所以播放时间要长一些
+        time_multiplier = 2 if usedFingers == [] else 1
+        played_frame = frame + elapsed_frame * time_multiplier
+
+        played_finished_frame = None
+        hold_pose_frame = None
+        if i != hand_count-1:
+            next_frame = handDicts[i + 1]['frame']
+            if next_frame > played_frame + elapsed_frame:
+                played_finished_frame = played_frame + elapsed_frame
+                if next_frame > played_finished_frame + elapsed_frame:
+                    hold_pose_frame = next_frame - elapsed_frame
+
+        ready = caculateRightHandFingers(rig.data,
+                                         rightFingerPositions, usedFingers, max_string_index, isAfterPlayed=False,
+                                         geometry_cache=rig.rightHandGeometry, rng=rng)
+
+        played = caculateRightHandFingers(rig.data,
+                                          rightFingerPositions, usedFingers, max_string_index, isAfterPlayed=True,
+                                          geometry_cache=rig.rightHandGeometry, rng=rng)
+        if record_offsets is not None:
+            record_offsets.append(len(data_for_animation))
+
+        # 右手拨弦分为四个阶段，准备拨弦，拨弦，拨弦后维持动作，返回准备状态。
+        # 如果与下一个音符之间的间隔足够长，就需要把这些动作都记录下来
+
+        # 触弦帧
+        data_for_animation.append({
+            "frame": frame,
+            "fingerInfos": ready,
+        })
+        data_for_animation.append({
+            "frame": played_frame,
+            "fingerInfos": played,
+        })
+        # 拨弦后维持动作帧
+        if played_finished_frame is not None:
             data_for_animation.append({
-                "frame": played_frame,
+                "frame": played_finished_frame,
                 "fingerInfos": played,
             })
-            # 拨弦后维持动作帧
-            if played_finished_frame is not None:
-                data_for_animation.append({
-                    "frame": played_finished_frame,
-                    "fingerInfos": played,
-                })
 
-            # 拨弦后返回准备状态帧
-            if hold_pose_frame is not None:
-                data_for_animation.append({
-                    "frame": hold_pose_frame,
-                    "fingerInfos": ready,
-                })
+        # 拨弦后返回准备状态帧
+        if hold_pose_frame is not None:
+            data_for_animation.append({
+                "frame": hold_pose_frame,
+                "fingerInfos": ready,
+            })
 
-    with open(animation, "w") as f:
-        json.dump(data_for_animation, f)
+    if record_offsets is not None:
+        record_offsets.append(len(data_for_animation))
+    if animation is not None:
+        saveRecords(animation, data_for_animation)
+    return data_for_animation
 
 
-def ElectronicRightHand2Animation(avatar: str, right_hand_recorder_file: str, right_hand_animation_file: str, FPS: int, guitar_max_string_index: int = 5) -> None:
+def ElectronicRightHand2Animation(avatar: str, right_hand_recorder_file: str | List[dict], right_hand_animation_file: str | None, FPS: int, guitar_max_string_index: int = 5, record_offsets: List[int] | None = None) -> List[dict]:
+    """
+    :param record_offsets: the same as in leftHand2Animation. 与leftHand2Animation中的相同
+    """
     pick_position = 5.5
     data_for_animation = []
     # 这里是计算拨弦需要保持的时间
     elapsed_frame = FPS / 15.0
 
-    with open(right_hand_recorder_file, "r") as f:
-        handDicts = json.load(f)
-
-        for i in range(len(handDicts)):
-            data = handDicts[i]
-            frame = data['frame']
-            strings = data["strings"]
-            isArpeggio = True if len(strings) > 3 else False
-            min_string = min(strings)
-            max_string = max(strings)
-            time_multiplier = 2 if len(strings) > 2 else 1
-            played_frame = frame + elapsed_frame * time_multiplier
-
-            played_finished_frame = None
-            if i < len(handDicts)-1:
-                next_frame = handDicts[i + 1]['frame']
-                if next_frame > played_frame + elapsed_frame:
-                    played_finished_frame = played_frame + elapsed_frame
-
-            # 如果pick当前的位置是在最低弦下面，那么以最低弦为演奏弦并且上扫弦
-            # 如果pick当前的位置是在最高弦上面，那么以最高弦为演奏弦并且下扫弦
-            pick_on_low_position = pick_position < min_string
-            start_string = min_string if pick_on_low_position else max_string
-            end_string = max_string if pick_on_low_position else min_string
-            should_start_at_lower_position = pick_on_low_position
-            should_end_at_lower_position = not pick_on_low_position
-
-            ready = calculateRightPick(
-                avatar, start_string, isArpeggio, should_start_at_lower_position, guitar_max_string_index)
-
-            played = calculateRightPick(
-                avatar, end_string, isArpeggio, should_end_at_lower_position, guitar_max_string_index)
-
-            if isArpeggio and should_end_at_lower_position:
-                pick_position = -0.5
-            else:
-                pick_position = end_string + 0.5 if should_end_at_lower_position else end_string - 0.5
+    handDicts = loadRecords(right_hand_recorder_file)
 
-            # pick拨弦分为三个阶段，准备拨弦，拨弦，拨弦后维持动作。它没有再返回准备状态的必要。
-            data_for_animation.append({
-                "frame": frame,
-                "fingerInfos": ready
-            })
+    for i in range(len(handDicts)):
+        data = handDicts[i]
+        frame = data['frame']
+        strings = data["strings"]
+        isArpeggio = True if len(strings) > 3 else False
+        min_string = min(strings)
+        max_string = max(strings)
+        time_multiplier = 2 if len(strings) > 2 else 1
+        played_frame = frame + elapsed_frame * time_multiplier
+
+        played_finished_frame = None
+        if i < len(handDicts)-1:
+            next_frame = handDicts[i + 1]['frame']
+            if next_frame > played_frame + elapsed_frame:
+                played_finished_frame = played_frame + elapsed_frame
+
+        # 如果pick当前的位置是在最低弦下面，那么以最低弦为演奏弦并且上扫弦
+        # 如果pick当前的位置是在最高弦上面，那么以最高弦为演奏弦并且下扫弦
+        pick_on_low_position = pick_position < min_string
+        start_string = min_string if pick_on_low_position else max_string
+        end_string = max_string if pick_on_low_position else min_string
+        should_start_at_lower_position = pick_on_low_position
+        should_end_at_lower_position = not pick_on_low_position
+
+        ready = calculateRightPick(
+            avatar, start_string, isArpeggio, should_start_at_lower_position, guitar_max_string_index)
+
+        played = calculateRightPick(
+            avatar, end_string, isArpeggio, should_end_at_lower_position, guitar_max_string_index)
+
+        if isArpeggio and should_end_at_lower_position:
+            pick_position = -0.5
+        else:
+            pick_position = end_string + 0.5 if should_end_at_lower_position else end_string - 0.5
+
+        # pick拨弦分为三个阶段，准备拨弦，拨弦，拨弦后维持动作。它没有再返回准备状态的必要。
+        if record_offsets is not None:
+            record_offsets.append(len(data_for_animation))
+        data_for_animation.append({
+            "frame": frame,
+            "fingerInfos": ready
+        })
+
+        data_for_animation.append({
+            "frame": played_frame,
+            "fingerInfos": played
+        })
 
+        if played_finished_frame is not None:
             data_for_animation.append({
-                "frame": played_frame,
+                "frame": played_finished_frame,
                 "fingerInfos": played
             })
 
-            if played_finished_frame is not None:
-                data_for_animation.append({
-                    "frame": played_finished_frame,
-                    "fingerInfos": played
-                })
-
-    with open(right_hand_animation_file, "w") as f:
-        json.dump(data_for_animation, f, indent=4)
+    if record_offsets is not None:
+        record_offsets.append(len(data_for_animation))
+    if right_hand_animation_file is not None:
+        saveRecords(right_hand_animation_file, data_for_animation, indent=4)
+    return data_for_animation
 
 
-def twiceLerpFingers(avatar_data: Any, fret: float, stringIndex: int, max_string_index: int) -> np.ndarray:
-    p0 = array(avatar_data['LEFT_FINGER_POSITIONS']["P0"])
-    p1 = array(avatar_data['LEFT_FINGER_POSITIONS']["P1"])
-    p2 = array(avatar_data['LEFT_FINGER_POSITIONS']["P2"])
-    p3 = array(avatar_data['LEFT_FINGER_POSITIONS']["P3"])
+def twiceLerpFingers(rig: AvatarRig, fret: float, stringIndex: int, max_string_index: int) -> np.ndarray:
+    fret_02, fret_13 = rig.tables("finger")
 
-    p_fret_0 = lerp_by_fret(fret, p0, p2)
-    p_fret_1 = lerp_by_fret(fret, p1, p3)
+    p_fret_0 = fret_02.at(fret)
+    p_fret_1 = fret_13.at(fret)
 
     p_final = p_fret_0 + (p_fret_1 - p_fret_0) * stringIndex / max_string_index
 
     return p_final
 
 
-def twiceLerpBarreFingers(avatar_data: Any, fret: float, finger_string_index: int, max_string_index: int) -> np.ndarray:
-    barre_p0 = array(avatar_data['BARRE_LEFT_HAND_POSITIONS']["P0"]["I_L"])
-    barre_p1 = array(avatar_data['BARRE_LEFT_HAND_POSITIONS']["P1"]["I_L"])
-    barre_p2 = array(avatar_data['BARRE_LEFT_HAND_POSITIONS']["P2"]["I_L"])
-    barre_p3 = array(avatar_data['BARRE_LEFT_HAND_POSITIONS']["P3"]["I_L"])
+def twiceLerpBarreFingers(rig: AvatarRig, fret: float, finger_string_index: int, max_string_index: int) -> np.ndarray:
+    barre_02, barre_13 = rig.tables("barre", "I_L")
 
-    p_fret_0 = lerp_by_fret(fret, barre_p0, barre_p2)
-    p_fret_1 = lerp_by_fret(fret, barre_p1, barre_p3)
+    p_fret_0 = barre_02.at(fret)
+    p_fret_1 = barre_13.at(fret)
 
     # 使用clamp后的值进行计算
     p_final = p_fret_0 + (p_fret_1 - p_fret_0) * \
@@ -674,9 +891,7 @@ def twiceLerpBarreFingers(avatar_data: Any, fret: float, finger_string_index: in
     return p_final
 
 
-def twiceLerp(avatar_data: Any, hand_state: int, value: str, valueType: str, fret: float, stringIndex: int | float, max_string_index: int) -> np.ndarray:
-    data_dict = None
-
+def twiceLerp(rig: AvatarRig, hand_state: int, value: str, valueType: str, fret: float, stringIndex: int | float, max_string_index: int) -> np.ndarray:
     """
     这个函数实现了两层插值计算：
     1. 首先在相同手型内，根据品格(fret)进行插值计算 (1品到12品之间)
@@ -689,34 +904,23 @@ def twiceLerp(avatar_data: Any, hand_state: int, value: str, valueType: str, fre
     - hand_state < 0: 说明小拇指的弦索引比食指的弦索引小。这时候可以先计算出该品格上的P02_normal和P13_normal两个Normal手型，再计算出该品格上的P13_Inner手型。先用P02上的两个手型用hand_weight进行插值，再用P02插值结果与P13的结果用string_weight进行插值，得到最终结果。
     
     参数：
-    - avatar_data: 模型数据字典
+    - rig: 模型的控制器信息，见src/animate/avatar_rig.py
 
     - hand_state > 0: 在Outer和Normal手型之间插值，插值权重为 hand_weight
     - hand_state < 0: 在Normal和Inner手型之间插值，插值权重为 hand_weight   
     """
-    normal_rotation_is_quaternion = False
+    # 旋转值统一使用H_rotation_L的品格表，位置值使用对应控制器的品格表
+    table_value = value if valueType == "position" else "H_rotation_L"
     # 这个值其实相当于食指的索引除以最大弦的索引，它与hand_state一起，可以表达出当前手型的食指和小拇指的弦索引，并且可以在三种不同手型中进行插值计算
     string_weight = stringIndex / max_string_index
     hand_weight = abs(hand_state/max_string_index)
 
-    if valueType == "position":
-        data_dict = avatar_data['NORMAL_LEFT_HAND_POSITIONS']
-        p0 = array(data_dict["P0"][value])
-        p1 = array(data_dict["P1"][value])
-        p2 = array(data_dict["P2"][value])
-        p3 = array(data_dict["P3"][value])
-    else:
-        data_dict = avatar_data["ROTATIONS"]['H_rotation_L']["Normal"]
-        p0 = array(data_dict["P0"])
-        p1 = array(data_dict["P1"])
-        p2 = array(data_dict["P2"])
-        p3 = array(data_dict["P3"])
-
-        # 检查是否为四元数（长度为4）或欧拉角（长度为3）
-        normal_rotation_is_quaternion = len(p0) == 4
+    normal_02, normal_13 = rig.tables("normal", table_value)
+    # 检查是否为四元数（长度为4）或欧拉角（长度为3）
+    normal_rotation_is_quaternion = valueType != "position" and normal_02.is_quaternion
 
-    p_normal_fret_02 = lerp_by_fret(fret, p0, p2)
-    p_normal_fret_13 = lerp_by_fret(fret, p1, p3)
+    p_normal_fret_02 = normal_02.at(fret)
+    p_normal_fret_13 = normal_13.at(fret)
 
     if hand_state == 0:
         if normal_rotation_is_quaternion:
@@ -725,96 +929,56 @@ def twiceLerp(avatar_data: Any, hand_state: int, value: str, valueType: str, fre
             # 其它情况无论是位置还是旋转值，都使用常规的线性插值
             p_final = p_normal_fret_02 + \
                 (p_normal_fret_13 - p_normal_fret_02) * string_weight
-    elif hand_state > 0:
-        outer_rotation_is_quaternion = False
-        if valueType == "position":
-            outer_data_dict = avatar_data['OUTER_LEFT_HAND_POSITIONS']
-            out_p0 = array(outer_data_dict["P0"][value])
-            out_p2 = array(outer_data_dict["P2"][value])
-        else:
-            outer_data_dict = avatar_data["ROTATIONS"]['H_rotation_L']["Outer"]
-            out_p0 = array(outer_data_dict["P0"])
-            out_p2 = array(outer_data_dict["P2"])
-            # 检查是否为四元数
-            outer_rotation_is_quaternion = len(out_p0) == 4
-
-        # 这个变量的后缀0，表示的是在0-2两个位置中进行品格插值以后，得到的结果，当然直接后缀写成零不太优雅，但姑且先这样写
-        p_outer = lerp_by_fret(fret, out_p0, out_p2)
-
-        if outer_rotation_is_quaternion:
-            # 四元数插值
-            p_normal = slerp(p_normal_fret_02, p_normal_fret_13, string_weight)
-            p_final = slerp(p_normal, p_outer, hand_weight)
-        else:
-            p_normal = p_normal_fret_02 + \
-                (p_normal_fret_13 - p_normal_fret_02) * string_weight
-            p_final = p_normal + \
-                (p_outer - p_normal) * hand_weight
     else:
-        inner_rotation_is_quaternion = False
-        if valueType == "position":
-            inner_data_dict = avatar_data['INNER_LEFT_HAND_POSITIONS']
-            inner_p1 = array(inner_data_dict["P1"][value])
-            inner_p3 = array(inner_data_dict["P3"][value])
+        # hand_state大于0时与Outer手型的P0-P2插值，小于0时与Inner手型的P1-P3插值
+        if hand_state > 0:
+            side_table = rig.tables("outer", table_value)[0]
         else:
-            inner_data_dict = avatar_data["ROTATIONS"]['H_rotation_L']["Inner"]
-            inner_p1 = array(inner_data_dict["P1"])
-            inner_p3 = array(inner_data_dict["P3"])
-
-            # 检查是否为四元数
-            inner_rotation_is_quaternion = len(inner_p1) == 4
-        # 这个后缀1，是在1-3位置之间进行品格插值以后得到的结果，后缀姑且先写1
-        p_inner = lerp_by_fret(fret, inner_p1, inner_p3)
+            side_table = rig.tables("inner", table_value)[1]
+        if side_table is None:
+            raise KeyError(f"{rig.name} controller infos have no side hand shape {table_value}")
+        side_rotation_is_quaternion = valueType != "position" and side_table.is_quaternion
+        p_side = side_table.at(fret)
 
-        if inner_rotation_is_quaternion:
+        if side_rotation_is_quaternion:
             # 四元数插值
             p_normal = slerp(p_normal_fret_02, p_normal_fret_13, string_weight)
-            p_final = slerp(p_normal, p_inner, hand_weight)
+            p_final = slerp(p_normal, p_side, hand_weight)
         else:
             # 标准线性插值
             p_normal = p_normal_fret_02 + \
                 (p_normal_fret_13 - p_normal_fret_02) * string_weight
             p_final = p_normal + \
-                (p_inner - p_normal) * hand_weight
+                (p_side - p_normal) * hand_weight
 
     return p_final
 
 
 def twiceLerpBarreHand(
-    avatar_data,
+    rig: AvatarRig,
     value,
     valueType,
     fret,
     stringIndex,
     max_string_index
 ):
-    data_dict = None
     barre_rotation_is_quaternion = False
     string_weight = (stringIndex-2) / (max_string_index-2)
 
     if valueType == "position":
-        data_dict = avatar_data['BARRE_LEFT_HAND_POSITIONS']
-        p0 = array(data_dict["P0"][value])
-        p1 = array(data_dict["P1"][value])
-        p2 = array(data_dict["P2"][value])
-        p3 = array(data_dict["P3"][value])
-        if p0 is None or p1 is None or p2 is None or p3 is None or \
-                not p0.size or not p1.size or not p2.size or not p3.size:
+        barre_02, barre_13 = rig.tables("barre", value)
+        if barre_02 is None or barre_13 is None or not barre_02.size or not barre_13.size:
             raise ValueError(f"Invalid position data:{value}")
     elif valueType == "rotation":
-        data_dict = avatar_data["ROTATIONS"]['H_rotation_L']["Barre"]
-        p0 = array(data_dict["P0"])
-        p1 = array(data_dict["P1"])
-        p2 = array(data_dict["P2"])
-        p3 = array(data_dict["P3"])
+        barre_02, barre_13 = rig.tables("barre", "H_rotation_L")
 
         # 检查是否为四元数（长度为4）或欧拉角（长度为3）
-        barre_rotation_is_quaternion = len(p0) == 4
+        barre_rotation_is_quaternion = barre_02.is_quaternion
     else:
         raise ValueError("Invalid value type")
 
-    p_fret_02 = lerp_by_fret(fret, p0, p2)
-    p_fret_13 = lerp_by_fret(fret, p1, p3)
+    p_fret_02 = barre_02.at(fret)
+    p_fret_13 = barre_13.at(fret)
     if barre_rotation_is_quaternion:
         p_final = slerp(p_fret_02, p_fret_13, string_weight)
     else:
@@ -824,10 +988,12 @@ def twiceLerpBarreHand(
     return p_final
 
 
-def animated_guitar_string(left_recorder: str, string_recorder: str, FPS: int) -> None:
+def animated_guitar_string(left_recorder: str | List[dict], string_recorder: str | None, FPS: int, record_offsets: List[int] | None = None) -> List[dict]:
+    """
+    :param record_offsets: the same as in leftHand2Animation. 与leftHand2Animation中的相同
+    """
     elapsed_frame = FPS / 8.0
-    with open(left_recorder, "r") as f:
-        handDicts = json.load(f)
+    handDicts = loadRecords(left_recorder)
 
     data_for_animation = []
 
@@ -844,6 +1010,8 @@ def animated_guitar_string(left_recorder: str, string_recorder: str, FPS: int) -
                 string_last_frame = frame + elapsed_frame
         else:
             string_last_frame = frame + elapsed_frame
+        if record_offsets is not None:
+            record_offsets.append(len(data_for_animation))
 
         for finger_data in leftHand:
             fingerIndex = finger_data["fingerIndex"]
@@ -890,5 +1058,56 @@ def animated_guitar_string(left_recorder: str, string_recorder: str, FPS: int) -
                 }
                 data_for_animation.append(middle)
 
-    with open(string_recorder, "w") as f:
-        json.dump(data_for_animation, f, indent=4)
+    if record_offsets is not None:
+        record_offsets.append(len(data_for_animation))
+    if string_recorder is not None:
+        saveRecords(string_recorder, data_for_animation, indent=4)
+    return data_for_animation
+
+
+def updateAnimation(animate: Callable[[List[dict], List[int]], List[dict]], oldRecords: List[dict], newRecords: List[dict], oldAnimation: List[dict], oldOffsets: List[int], record_offsets: List[int], stateful: bool = False) -> Tuple[List[dict], int, int]:
+    """
+    regenerate only the animation of the records around the changed ones, the rest is taken from the old animation. 只重新生成改动的记录附近的动画，其余部分直接使用旧的动画
+    :param animate: animate(records, record_offsets) generates the animation of records, for example leftHand2Animation with fixed avatar and FPS. 生成动画的函数
+    :param oldOffsets: record_offsets of oldAnimation. oldAnimation的record_offsets
+    :param record_offsets: record offsets of the result are appended to it. 结果的record_offsets会追加到它里面
+    :param stateful: animate carries state from one record to the next, like the pick position of ElectronicRightHand2Animation, so everything after the first changed record is regenerated. 动画会把状态从一个记录带到下一个记录，比如ElectronicRightHand2Animation中pick的位置，此时第一个改动的记录之后的动画全部重新生成
+    :return: the animation, and the range of new records whose animation is regenerated. 动画，以及重新生成了动画的新记录范围
+    """
+    count = len(newRecords)
+    limit = min(len(oldRecords), count)
+    prefix = 0
+    while prefix < limit and oldRecords[prefix] == newRecords[prefix]:
+        prefix += 1
+    if prefix == len(oldRecords) == count:
+        record_offsets.extend(oldOffsets)
+        return oldAnimation, 0, 0
+    suffix = 0
+    while suffix < limit - prefix and oldRecords[-1 - suffix] == newRecords[-1 - suffix]:
+        suffix += 1
+
+    # 每个记录的动画只和它自己以及前后相邻的记录有关，所以改动记录的前后各多生成一个
+    start = max(0, prefix - 1)
+    if stateful:
+        # 带状态的动画依赖于前面所有的记录，只能从头生成，并替换掉从改动的记录开始直到结尾的部分
+        end = count
+        contextStart = 0
+        contextEnd = count
+    else:
+        end = min(count, count - suffix + 1)
+        # 再各多带一个记录作为上下文，保证生成的边界与完整生成时相同
+        contextStart = max(0, start - 1)
+        contextEnd = min(count, end + 1)
+    oldEnd = len(oldRecords) - (count - end)
+    offsets: List[int] = []
+    animation = animate(newRecords[contextStart:contextEnd], offsets)
+    regenerated = animation[offsets[start - contextStart]:offsets[end - contextStart]]
+
+    oldStart = oldOffsets[start]
+    oldStop = oldOffsets[oldEnd]
+    record_offsets.extend(oldOffsets[:start])
+    record_offsets.extend(oldStart + offset - offsets[start - contextStart]
+                          for offset in offsets[start - contextStart:end - contextStart])
+    record_offsets.extend(offset - oldStop + oldStart + len(regenerated)
+                          for offset in oldOffsets[oldEnd:])
+    return oldAnimation[:oldStart] + regenerated + oldAnimation[oldStop:], start, end
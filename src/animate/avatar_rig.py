@@ -0,0 +1,132 @@
+"""
+controller infos of an avatar, loaded once and converted to numpy arrays. 角色的控制器信息，只读取一次并转换为numpy数组
+左手动画里每一帧的每根手指都要按品格插值，这里预先算好0~24品的插值结果，动画循环里只需要查表
+"""
+import json
+import os
+from functools import lru_cache
+from typing import Any, Dict, Sequence, Tuple
+
+import numpy as np
+
+from ..utils.utils import lerp_by_fret
+
+# 预先计算插值结果的最高品格
+MAX_RIG_FRET = 24
+
+# 各种左手手型在控制器信息里对应的位置和旋转的键
+LEFT_HAND_SECTIONS = {
+    "normal": ("NORMAL_LEFT_HAND_POSITIONS", "Normal"),
+    "outer": ("OUTER_LEFT_HAND_POSITIONS", "Outer"),
+    "inner": ("INNER_LEFT_HAND_POSITIONS", "Inner"),
+    "barre": ("BARRE_LEFT_HAND_POSITIONS", "Barre"),
+}
+
+
+class FretTable():
+    """
+    values of a controller at every fret, interpolated between its 1st fret and 12th fret values. 一个控制器在每个品格上的值，由1品和12品的值插值得到
+    :param value_1: value at the 1st fret. 1品的值
+    :param value_12: value at the 12th fret. 12品的值
+    """
+    __slots__ = ("value_1", "value_12", "values", "is_quaternion")
+
+    def __init__(self, value_1: Any, value_12: Any) -> None:
+        self.value_1 = np.array(value_1)
+        self.value_12 = np.array(value_12)
+        # 每一行都由lerp_by_fret算出，查表结果与直接计算的结果逐位相同
+        self.values = np.array([lerp_by_fret(fret, self.value_1, self.value_12)
+                               for fret in range(MAX_RIG_FRET + 1)], dtype=float)
+        self.values.setflags(write=False)
+        self.is_quaternion = len(self.value_1) == 4
+
+    @property
+    def size(self) -> int:
+        return self.value_1.size
+
+    def at(self, fret: float) -> np.ndarray:
+        """
+        value at a fret, frets out of the table are calculated directly. 某个品格上的值，超出表格范围的品格直接计算
+        """
+        if isinstance(fret, int) and 0 <= fret <= MAX_RIG_FRET:
+            return self.values[fret]
+        return lerp_by_fret(fret, self.value_1, self.value_12)
+
+    def atMany(self, frets: Sequence[Any]) -> np.ndarray:
+        """
+        values at many frets at once, one row for each fret. 一次取出多个品格上的值，每个品格一行
+        """
+        fret_array = np.asarray(frets)
+        if fret_array.dtype.kind == "i" and ((fret_array >= 0) & (fret_array <= MAX_RIG_FRET)).all():
+            return self.values[fret_array]
+        return np.array([self.at(fret) for fret in frets], dtype=float).reshape(len(frets), self.size)
+
+
+class AvatarRig():
+    """
+    all left hand positions and rotations of an avatar as fret tables, and a memo of right hand geometries. 一个角色所有左手位置和旋转的品格表，以及右手手型的缓存
+    :param avatar_data: content of asset/controller_infos/<avatar>.json. 控制器信息文件的内容
+    :param name: name of the avatar, used in error messages. 角色名，用于报错信息
+    """
+
+    def __init__(self, avatar_data: Dict[str, Any], name: str = "") -> None:
+        self.data = avatar_data
+        self.name = name
+        self.leftFingerPositions = {key: np.array(value) for key, value in avatar_data.get(
+            "LEFT_FINGER_POSITIONS", {}).items()}
+        # (手型, 控制器名) -> (P0到P2的品格表, P1到P3的品格表)，缺少的一侧为None
+        self.fretTables: Dict[Tuple[str, str], Tuple[FretTable | None, FretTable | None]] = {}
+        # 右手手型的缓存，由new_finger_position_method填充，不包含手掌的随机移动
+        self.rightHandGeometry: Dict[Tuple, Any] = {}
+
+        if self.leftFingerPositions:
+            self.fretTables[("finger", "")] = self._pairTables(
+                avatar_data["LEFT_FINGER_POSITIONS"])
+
+        rotations = avatar_data.get("ROTATIONS", {}).get("H_rotation_L", {})
+        for section, (positionKey, rotationKey) in LEFT_HAND_SECTIONS.items():
+            positions = avatar_data.get(positionKey, {})
+            values = dict.fromkeys(
+                value for points in positions.values() for value in points)
+            for value in values:
+                self.fretTables[(section, value)] = self._pairTables(
+                    {point: points[value] for point, points in positions.items() if value in points})
+            if rotationKey in rotations:
+                self.fretTables[(section, "H_rotation_L")] = self._pairTables(
+                    rotations[rotationKey])
+
+    @staticmethod
+    def _pairTables(points: Dict[str, Any]) -> Tuple[FretTable | None, FretTable | None]:
+        fret_02 = FretTable(points["P0"], points["P2"]) if "P0" in points and "P2" in points else None
+        fret_13 = FretTable(points["P1"], points["P3"]) if "P1" in points and "P3" in points else None
+        return fret_02, fret_13
+
+    def tables(self, section: str, value: str = "") -> Tuple[FretTable, FretTable]:
+        """
+        fret tables of a controller in a hand shape. 某种手型下一个控制器的品格表
+        :param section: finger, normal, outer, inner or barre. 手指或者某种手型
+        :param value: name of the controller, such as H_L or H_rotation_L. 控制器名，比如H_L或者H_rotation_L
+        :return: tables between P0 and P2, and between P1 and P3. P0到P2和P1到P3之间的品格表
+        """
+        tables = self.fretTables.get((section, value))
+        if tables is None:
+            raise KeyError(
+                f"{self.name} controller infos have no {section} {value}")
+        return tables  # type: ignore
+
+
+@lru_cache(maxsize=8)
+def _loadAvatarRig(json_file: str, mtime: float) -> AvatarRig:
+    with open(json_file, "r") as f:
+        avatar_data = json.load(f)
+    if not avatar_data:
+        raise Exception("avatar_data is empty")
+    return AvatarRig(avatar_data, os.path.basename(json_file).split(".")[0])
+
+
+def loadAvatarRig(avatar: str) -> AvatarRig:
+    """
+    load the rig of an avatar, the file is read again only if it has been modified. 读取角色的控制器信息，只有文件被修改过才会重新读取
+    """
+    json_file = f'asset/controller_infos/{avatar}.json'
+    return _loadAvatarRig(os.path.abspath(json_file), os.path.getmtime(json_file))
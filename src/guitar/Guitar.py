@@ -1,5 +1,9 @@
 from .GuitarString import GuitarString
-from typing import List, Any
+from types import MappingProxyType
+from typing import List, Any, Mapping, Tuple
+
+# 一个音符在吉他上的位置：(弦索引, 品格, 是否是泛音)
+NotePosition = Tuple[int, int, bool]
 
 
 class Guitar():
@@ -16,6 +20,17 @@ class Guitar():
         self.guitarStrings = guitarStrings
         self.use_harm_notes = use_harm_note
         self.harm_notes = self.getHarmonicNotes()
+        self.notePositions = self.buildNotePositions()
+
+    def __getstate__(self) -> dict:
+        # MappingProxyType不能被pickle，传给其它进程时去掉索引，读取时再重建
+        state = self.__dict__.copy()
+        del state["notePositions"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.notePositions = self.buildNotePositions()
 
     @property
     def getStringDistance(self) -> float:
@@ -56,3 +71,30 @@ class Guitar():
                 "note": base_note.num + 28
             })
         return all_harm_notes
+
+    def buildNotePositions(self) -> Mapping[int, Tuple[NotePosition, ...]]:
+        """
+        build an immutable index from note to all its positions on the guitar. 建立一个从音符到它在吉他上所有位置的不可变索引
+        同一个音符的位置按弦的顺序排列，同一根弦上泛音在前，普通按法在后
+        :return: a mapping like {note: ((string index, fret, is harmonic), ...)}. 形如{音符: ((弦索引, 品格, 是否是泛音), ...)}的映射
+        """
+        positions: dict[int, list[NotePosition]] = {}
+        for guitarString in self.guitarStrings:
+            string_index = guitarString._stringIndex
+            for harm_note in self.harm_notes:
+                if harm_note["index"] == string_index:
+                    positions.setdefault(harm_note["note"], []).append(
+                        (string_index, harm_note["fret"], True))
+            for fret in range(24):
+                note = guitarString.getBaseNote() + fret
+                positions.setdefault(note, []).append(
+                    (string_index, fret, False))
+
+        return MappingProxyType({note: tuple(note_positions) for note, note_positions in positions.items()})
+
+    def getNotePositions(self, note: int) -> Tuple[NotePosition, ...]:
+        """
+        :param note: note. 音符
+        :return: all positions of the note on the guitar, including harmonics. 音符在吉他上的所有位置，包括泛音
+        """
+        return self.notePositions.get(note, ())
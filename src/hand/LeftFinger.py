@@ -2,6 +2,7 @@ from ..guitar.GuitarString import GuitarString
 from ..guitar.Guitar import Guitar
 from ..utils.utils import lerp_by_fret
 import math
+import numpy as np
 
 PRESSSTATE: dict = {
     "Open": 0,
@@ -21,6 +22,52 @@ FINGERS: dict = {
     "Pinky": 4
 }
 
+# 由索引反查名字的表，避免每次创建手指时都重建列表
+PRESSSTATE_NAMES: dict = {value: key for key, value in PRESSSTATE.items()}
+FINGER_NAMES: dict = {value: key for key, value in FINGERS.items()}
+
+
+# 查表所支持的最高品格
+MAX_TABLE_FRET = 24
+
+# 0~24品在弦上的相对位置，与fretDistanceTo里lerp_by_fret的计算结果完全一致
+FRET_POSITION_TABLE = np.array([lerp_by_fret(0, 0.5, fret)
+                               for fret in range(MAX_TABLE_FRET + 1)])
+
+_fingerDistanceTables: dict = {}
+
+
+def getFingerDistanceTable(guitar: Guitar) -> np.ndarray:
+    """
+    a lookup table of finger distances, indexed by [string distance, start fret, end fret]. 手指位移的查找表，下标是[弦距, 起始品格, 目标品格]
+    每个值都按LeftFinger.distanceTo的顺序计算，查表结果与逐个计算的结果逐位相同
+    :param guitar: guitar. 吉他
+    :return: distance table. 位移表
+    """
+    key = (guitar._stringDistance, guitar._fullString,
+           len(guitar.guitarStrings))
+    table = _fingerDistanceTables.get(key)
+    if table is not None:
+        return table
+
+    table = np.zeros((len(guitar.guitarStrings),
+                     MAX_TABLE_FRET + 1, MAX_TABLE_FRET + 1))
+    for string_distance in range(len(guitar.guitarStrings)):
+        fingerStringDistance = string_distance * \
+            guitar._stringDistance if string_distance else 0
+        for start_fret in range(MAX_TABLE_FRET + 1):
+            for end_fret in range(MAX_TABLE_FRET + 1):
+                fingerFretDistance = 0
+                if start_fret != end_fret:
+                    fingerFretDistance = guitar._fullString * \
+                        abs(float(FRET_POSITION_TABLE[end_fret]) -
+                            float(FRET_POSITION_TABLE[start_fret]))
+                table[string_distance, start_fret, end_fret] = math.sqrt(
+                    math.pow(fingerStringDistance, 2) + math.pow(fingerFretDistance, 2))
+
+    _fingerDistanceTables[key] = table
+    return table
+
 
 class LeftFinger:
     """
@@ -30,17 +77,34 @@ class LeftFinger:
     fret: Fret number. 品数
     press: Press state. 按弦状态
     """
+    # 束搜索里会创建大量手指，用__slots__省掉每个实例的__dict__
+    __slots__ = ("_fingerIndex", "_fingerName", "stringIndex", "fret", "press")
 
     def __init__(self, fingerIndex: int, guitarString: GuitarString, fret: int = 1, press: str = "Open"):
 
         self._fingerIndex = fingerIndex
         # fingerName等于FINGERS中值为fingerIndex的key值
-        self._fingerName = list(FINGERS.keys())[list(
-            FINGERS.values()).index(fingerIndex)]
+        self._fingerName = FINGER_NAMES[fingerIndex]
         self.stringIndex = guitarString._stringIndex
         self.fret = fret
         self.press = PRESSSTATE[press]
 
+    def toState(self) -> list:
+        """
+        the finger as [fingerIndex, stringIndex, fret, press], used by checkpoints. 以[fingerIndex, stringIndex, fret, press]表示的手指，用于保存检查点
+        """
+        return [int(self._fingerIndex), int(self.stringIndex), int(self.fret), int(self.press)]
+
+    @classmethod
+    def fromState(cls, state: list) -> "LeftFinger":
+        """
+        rebuild a finger from toState without a GuitarString. 不需要GuitarString，从toState的结果重建手指
+        """
+        finger = cls.__new__(cls)
+        finger._fingerIndex, finger.stringIndex, finger.fret, finger.press = state
+        finger._fingerName = FINGER_NAMES[finger._fingerIndex]
+        return finger
+
     @property
     def getFingerName(self) -> str:
         return self._fingerName
@@ -51,8 +115,7 @@ class LeftFinger:
 
     def output(self) -> None:
         print(self._fingerIndex, "|",
-              self.stringIndex, "string | ", self.fret, "fret |  ", list(PRESSSTATE.keys())[list(
-                  PRESSSTATE.values()).index(self.press)])
+              self.stringIndex, "string | ", self.fret, "fret |  ", PRESSSTATE_NAMES[self.press])
 
     def distanceTo(self, guitar: Guitar, targetFinger: 'LeftFinger') -> float:
         """
@@ -1,6 +1,7 @@
-from .LeftFinger import LeftFinger, PRESSSTATE
+from .LeftFinger import LeftFinger, PRESSSTATE, PRESSSTATE_NAMES, MAX_TABLE_FRET, getFingerDistanceTable
 from ..guitar.Guitar import Guitar
-from typing import List, Any
+from typing import List, Any, Sequence, Tuple, Optional
+import numpy as np
 
 
 class LeftHand():
@@ -9,6 +10,8 @@ class LeftHand():
     LeftFingers: List of LeftFinger. 手指列表
     maxFingerDistance: Maximum distance between two adjacent fingers. 两只相邻手指所能打开的最大距离，单位是cm
     """
+    __slots__ = ("fingers", "_maxFingerDistance",
+                 "fingerDistanceTofretboard", "handPosition", "useBarre")
 
     def __init__(self, LeftFingers: List[LeftFinger], use_barre: bool = False, maxFingerDistance: float = 5.73, ) -> None:
         self.fingers = LeftFingers
@@ -18,6 +21,47 @@ class LeftHand():
         self.reArrangeFingers()
         self.useBarre = use_barre
 
+    def stateKey(self) -> tuple:
+        """
+        a hashable key of the hand state, hands with the same key have the same future transitions. 手型状态的可哈希键，键相同的手型之后的转移完全相同
+        """
+        return (self.handPosition, self.useBarre, tuple((finger._fingerIndex, finger.stringIndex, finger.fret, finger.press) for finger in self.fingers))
+
+    def toState(self) -> dict:
+        """
+        the hand as plain values, used by checkpoints. 以普通数值表示的手型，用于保存检查点
+        """
+        return {"fingers": [finger.toState() for finger in self.fingers], "useBarre": bool(self.useBarre),
+                "handPosition": int(self.handPosition), "maxFingerDistance": float(self._maxFingerDistance)}
+
+    @classmethod
+    def fromState(cls, state: dict) -> "LeftHand":
+        """
+        rebuild a hand from toState, the fingers are already rearranged so the constructor is skipped. 从toState的结果重建手型，手指已经整理过，所以不再经过构造函数
+        """
+        hand = cls.__new__(cls)
+        hand.fingers = [LeftFinger.fromState(finger)
+                        for finger in state["fingers"]]
+        hand._maxFingerDistance = state["maxFingerDistance"]
+        hand.fingerDistanceTofretboard = 0.025
+        hand.handPosition = state["handPosition"]
+        hand.useBarre = state["useBarre"]
+        return hand
+
+    @staticmethod
+    def candidateStateKey(fingers: Sequence[LeftFinger], use_barre: bool) -> tuple:
+        """
+        the stateKey of LeftHand(fingers, use_barre), without creating the hand or modifying the fingers. 不创建手型、不修改手指，算出LeftHand(fingers, use_barre)的stateKey
+        """
+        handPosition = 1
+        for finger in fingers:
+            if finger._fingerIndex == 1 and finger.fret > 1:
+                handPosition = finger.fret
+        # 与reArrangeFingers一致，fret为0的手指是抬起的，并放在把位对应的品格上
+        return (handPosition, use_barre, tuple((finger._fingerIndex, finger.stringIndex, handPosition + finger._fingerIndex - 1, PRESSSTATE["Open"])
+                                               if finger._fingerIndex != 0 and finger.fret == 0 else
+                                               (finger._fingerIndex, finger.stringIndex, finger.fret, finger.press) for finger in fingers))
+
     @property
     def getMaxFingerDistance(self) -> float:
         return self._maxFingerDistance
@@ -207,10 +251,23 @@ class LeftHand():
 
         return handPosition
 
-    def generateNextHands(self, guitar: Guitar, fingerPositions: List[dict[str, int]]) -> Any:
+    @staticmethod
+    def calculateNextHandPosition(fingerPositions: Sequence[Tuple[int, int, int]]) -> Optional[int]:
+        """
+        calculate the hand position of the next hand, it is the same as the one in generateNextHands. 计算下一个手型的把位，与generateNextHands里的计算一致
+        :param fingerPositions: List of (string index, fret, index of finger which pressed it). (弦的索引, 品格, 按下它的手指的索引)的列表
+        :return: hand position, None if no finger presses a string, which means the hand position follows the previous hand. 把位，如果没有按弦手指就返回None，表示沿用前一个手型的把位
+        """
+        pressedPositions = [(fret, finger_index) for _, fret,
+                            finger_index in fingerPositions if finger_index != -1]
+        if not pressedPositions:
+            return None
+        return max(1, min(fret for fret, _ in pressedPositions) - (min(finger_index for _, finger_index in pressedPositions) - 1))
+
+    def generateNextHands(self, guitar: Guitar, fingerPositions: Sequence[Tuple[int, int, int]]) -> Any:
         """
         :parma guitar: Guitar. 吉他
-        :param chord: List of notes, including fret and string index and index of finger which pressed it. 音符列表，包括品格，弦的索引和按下它的手指的索引
+        :param fingerPositions: List of (string index, fret, index of finger which pressed it), finger is -1 for open strings. (弦的索引, 品格, 按下它的手指的索引)的列表，空弦音的手指为-1
         :return: List of next hands and their entropy. 下一个手型和它们的熵的列表
         """
         # 初始化空弦数据，按弦数据，横按数据，休息数据
@@ -242,10 +299,7 @@ class LeftHand():
         newHandPosition = 0
 
         # --第一次循环，处理空弦音，并且计算各个手指的触弦总数,更新最高和最低按弦索引，更新使用的手指索引--
-        for fingerPosition in fingerPositions:
-            fret = fingerPosition.get('fret', -1)
-            finger_index = fingerPosition.get('finger', -1)
-            string_index = fingerPosition.get('index', -1)
+        for string_index, fret, finger_index in fingerPositions:
             # --生成空弦音的手指--
             if finger_index == -1:
                 empty_finger = LeftFinger(
@@ -325,8 +379,8 @@ class LeftHand():
                 continue
 
             # 读取手指在前一个手型里的位置信息
-            same_finger = [
-                finger for finger in self.fingers if finger._fingerIndex == old_finger_index][0]
+            same_finger = next(
+                finger for finger in self.fingers if finger._fingerIndex == old_finger_index)
             old_fret = same_finger.fret
             old_string_index = same_finger.stringIndex
 
@@ -356,8 +410,7 @@ class LeftHand():
                 continue
 
             # 能运行到这里的都是保留指，直接用原状态生成新的保留指
-            press_state = next(k for k, v in PRESSSTATE.items()
-                               if v == same_finger.press)
+            press_state = PRESSSTATE_NAMES[same_finger.press]
 
             # 如果上一个手型有食指横按，判断一下是否需要保留食指横按
             if same_finger.press == PRESSSTATE["Barre"] and same_finger._fingerIndex == 1 and used_string_index_set:
@@ -438,5 +491,85 @@ class LeftHand():
         return entropy
 
 
+def stackFingerStates(fingersList: Sequence[Sequence[LeftFinger]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    pack the fingers 1~4 of many hands into arrays, only the first finger of each index is used, the same as caculateDiff. 把多个手型的1~4指打包成数组，每个索引只取第一个手指，与caculateDiff一致
+    :param fingersList: fingers of each hand. 每个手型的手指列表
+    :return: string index, fret, finger exists, finger is pressed, all in shape (hand count, 4). 弦索引、品格、手指是否存在、手指是否按下，形状都是(手型数, 4)
+    """
+    strings = []
+    frets = []
+    exists = []
+    pressed = []
+    for fingers in fingersList:
+        string_row = [0] * 4
+        fret_row = [0] * 4
+        exist_row = [False] * 4
+        pressed_row = [False] * 4
+        for finger in fingers:
+            column = finger._fingerIndex - 1
+            if column < 0 or exist_row[column]:
+                continue
+            string_row[column] = finger.stringIndex
+            fret_row[column] = finger.fret
+            exist_row[column] = True
+            pressed_row[column] = finger.press != PRESSSTATE["Open"]
+        strings.append(string_row)
+        frets.append(fret_row)
+        exists.append(exist_row)
+        pressed.append(pressed_row)
+
+    return (np.array(strings, dtype=np.intp).reshape(-1, 4), np.array(frets, dtype=np.intp).reshape(-1, 4),
+            np.array(exists, dtype=bool).reshape(-1, 4), np.array(pressed, dtype=bool).reshape(-1, 4))
+
+
+def caculateDiffMatrix(prevHands: Sequence[LeftHand], candidateFingers: Sequence[Sequence[LeftFinger]], candidatePositions: Sequence[int], guitar: Guitar) -> np.ndarray:
+    """
+    calculate the entropy of every (previous hand, candidate hand) pair at once. 一次性计算每一对(前一个手型, 候选手型)的熵
+    结果与逐对调用prevHand.caculateDiff(candidateFingers, candidatePosition, guitar)逐位相同，加法顺序也保持一致
+    :param prevHands: previous hands. 前一个手型的列表
+    :param candidateFingers: fingers of candidate hands. 候选手型的手指列表
+    :param candidatePositions: hand positions of candidate hands. 候选手型的把位
+    :param guitar: guitar. 吉他
+    :return: entropy matrix in shape (previous hand count, candidate count). 熵矩阵，形状是(前一个手型数, 候选手型数)
+    """
+    prevStrings, prevFrets, prevExists, _ = stackFingerStates(
+        [hand.fingers for hand in prevHands])
+    candStrings, candFrets, candExists, candPressed = stackFingerStates(
+        candidateFingers)
+    if max(prevFrets.max(initial=0), candFrets.max(initial=0)) > MAX_TABLE_FRET:
+        raise ValueError(f"fret out of range 0~{MAX_TABLE_FRET}")
+    distanceTable = getFingerDistanceTable(guitar)
+
+    prevPositions = np.array([hand.handPosition for hand in prevHands])
+    candPositions = np.array(candidatePositions, dtype=prevPositions.dtype)
+    pressCosts = np.array(
+        [hand.fingerDistanceTofretboard for hand in prevHands])
+
+    # 换把时抬指的熵，按caculateDiff里逐个手指累加的顺序来算
+    liftCosts = []
+    for hand in prevHands:
+        liftCost = 0
+        for finger in hand.fingers:
+            if finger.press != PRESSSTATE["Open"]:
+                liftCost += hand.fingerDistanceTofretboard
+        liftCosts.append(liftCost)
+    liftCosts = np.array(liftCosts, dtype=float)
+
+    entropy = np.where(prevPositions[:, None] != candPositions[None, :],
+                       liftCosts[:, None], 0.0)
+
+    # 计算每一个手指的位移，以及按下手指的熵
+    for column in range(4):
+        bothExist = prevExists[:, column, None] & candExists[None, :, column]
+        distance = distanceTable[np.abs(prevStrings[:, column, None] - candStrings[None, :, column]),
+                                 prevFrets[:, column, None], candFrets[None, :, column]]
+        entropy = entropy + np.where(bothExist, distance, 0.0)
+        entropy = entropy + np.where(bothExist & candPressed[None, :, column],
+                                     pressCosts[:, None], 0.0)
+
+    return entropy
+
+
 def print_strikethrough(text):
     return f"\033[9m{text}\033[0m"
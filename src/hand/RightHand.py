@@ -1,4 +1,4 @@
-from typing import List, Dict, Union, Any
+from typing import List, Dict, Union, Any, Sequence
 import itertools
 from numpy import array, linalg
 import numpy as np
@@ -13,6 +13,13 @@ RightFingers = {
     "a": 3
 }
 
+# 每根手指在usedFingers位掩码里的位
+RightFingerBits = {finger: 1 << index for finger, index in RightFingers.items()}
+# 4位掩码里1的个数，也就是手指的个数
+FINGER_COUNTS = np.array([bin(mask).count("1") for mask in range(16)])
+# 每个角色最多缓存的右手手型数，超过时清空
+GEOMETRY_CACHE_SIZE = 4096
+
 
 class RightHand():
     def __init__(self, usedFingers: List[str], rightFingerPositions: List[int], preUsedFingers: List[str], isArpeggio: bool = False, is_playing_bass: bool = False):
@@ -22,6 +29,24 @@ class RightHand():
         self.isArpeggio = isArpeggio
         self.is_playing_bass = is_playing_bass
 
+    def stateKey(self) -> tuple:
+        """
+        a hashable key of the hand state, hands with the same key have the same future transitions. 手型状态的可哈希键，键相同的手型之后的转移完全相同
+        caculateDiff只用到前4个手指位置，以及usedFingers和preUsedFingers的集合
+        """
+        return (tuple(self.rightFingerPositions[:4]), fingerMask(self.usedFingers), fingerMask(self.preUsedFingers))
+
+    def toState(self) -> dict:
+        """
+        the hand as plain values, used by checkpoints. 以普通数值表示的手型，用于保存检查点
+        """
+        return {"usedFingers": list(self.usedFingers), "rightFingerPositions": [int(position) for position in self.rightFingerPositions],
+                "preUsedFingers": list(self.preUsedFingers), "isArpeggio": bool(self.isArpeggio), "is_playing_bass": bool(self.is_playing_bass)}
+
+    @classmethod
+    def fromState(cls, state: dict) -> "RightHand":
+        return cls(**state)
+
     def validateRightHand(self, usedFingers: list[str] = [], rightFingerPositions: list[int] = []) -> bool:
 
         if len(rightFingerPositions) == 0:
@@ -107,6 +132,53 @@ class RightHand():
         return True
 
 
+def fingerMask(fingers: Sequence[str]) -> int:
+    """
+    encode fingers as a bitmask, repeated fingers are counted once like a set. 把手指编码成位掩码，重复的手指和集合一样只算一次
+    """
+    mask = 0
+    for finger in fingers:
+        mask |= RightFingerBits[finger]
+    return mask
+
+
+def caculateRightHandDiffMatrix(prevHands: Sequence[RightHand], candidateFingers: Sequence[Sequence[str]], candidatePositions: Sequence[Sequence[int]]) -> np.ndarray:
+    """
+    calculate the entropy of every (previous hand, candidate hand) pair at once. 一次性计算每一对(前一个手型, 候选手型)的熵
+    结果与逐对调用prevHand.caculateDiff(candidateHand)逐位相同
+    :param prevHands: previous hands. 前一个手型的列表
+    :param candidateFingers: used fingers of candidate hands. 候选手型拨弦的手指
+    :param candidatePositions: finger positions of candidate hands. 候选手型的手指位置
+    :return: entropy matrix in shape (previous hand count, candidate count). 熵矩阵，形状是(前一个手型数, 候选手型数)
+    """
+    repeat_punish = 10
+    prevPositions = np.array([hand.rightFingerPositions[:4]
+                             for hand in prevHands], dtype=np.intp).reshape(-1, 4)
+    candPositions = np.array([positions[:4]
+                             for positions in candidatePositions], dtype=np.intp).reshape(-1, 4)
+    prevUsed = np.array([fingerMask(hand.usedFingers)
+                        for hand in prevHands], dtype=np.intp)
+    prevPreUsed = np.array([fingerMask(hand.preUsedFingers)
+                           for hand in prevHands], dtype=np.intp)
+    candUsed = np.array([fingerMask(fingers)
+                        for fingers in candidateFingers], dtype=np.intp)
+
+    # 手指改变所在弦位置的情况，每有移动一根弦距就加1单位的diff
+    diff = np.abs(prevPositions[:, None, :] -
+                  candPositions[None, :, :]).sum(axis=2).astype(float)
+
+    common = prevUsed[:, None] & candUsed[None, :]
+    pre_common = prevPreUsed[:, None] & candUsed[None, :]
+    common_p = common & RightFingerBits["p"]
+    pre_common_p = pre_common & RightFingerBits["p"]
+
+    # 重复使用p指按repeat_punish来算，其它手指按双倍repeat_punish来算，所有的值都是0.5的整数倍，加法顺序不影响结果
+    diff += repeat_punish * common_p + 0.5 * repeat_punish * pre_common_p
+    diff += 2 * repeat_punish * ((FINGER_COUNTS[common] - common_p) +
+                                 0.5 * (FINGER_COUNTS[pre_common] - pre_common_p))
+    return diff
+
+
 def finger_string_map_generator(allFingers: List[str], touchedStrings: List[int], unusedFingers: List[str], allStrings: List[int], prev_finger_string_map: List[Dict[str, Any]] = []):
     if touchedStrings == []:
         for result in rest_finger_string_map_generator(unusedFingers, allStrings, prev_finger_string_map):
@@ -224,7 +296,37 @@ def get_usedFingers(finger_list: List[Any], usedStrings: List[int]):
     return [item['finger'] for item in finger_list if item['string'] in usedStrings]
 
 
-def new_finger_position_method(avatar_data: Any, rightFingerPositions: List[int], isArpeggio: bool, isAfterPlayed: bool, hand_position: float, usedRightFingers: List[str],  max_string_index: int) -> Dict:
+def new_finger_position_method(avatar_data: Any, rightFingerPositions: List[int], isArpeggio: bool, isAfterPlayed: bool, hand_position: float, usedRightFingers: List[str],  max_string_index: int, geometry_cache: Dict | None = None, rng: Any = None) -> Dict:
+    """
+    计算右手所有控制器的位置，手型本身只由参数决定，可以缓存在geometry_cache里，最后再给手掌加上一点随机移动。
+    :param geometry_cache: memo of hand geometries of one avatar, keyed by the arguments. 同一个角色的手型缓存，键是各个参数
+    :param rng: random generator for the jitter of the palm, np.random by default. 手掌随机移动用的随机数生成器，默认使用np.random
+    """
+    key = (tuple(rightFingerPositions), tuple(usedRightFingers),
+           isArpeggio, isAfterPlayed, hand_position, max_string_index)
+    geometry = None if geometry_cache is None else geometry_cache.get(key)
+    if geometry is None:
+        geometry = right_hand_geometry(avatar_data, rightFingerPositions, isArpeggio,
+                                       isAfterPlayed, hand_position, usedRightFingers, max_string_index)
+        if geometry_cache is not None:
+            # 缓存跟着角色一直保留，超过上限时清空，避免批量处理很多曲子时无限增长
+            if len(geometry_cache) >= GEOMETRY_CACHE_SIZE:
+                geometry_cache.clear()
+            geometry_cache[key] = geometry
+    H_R, fingerMoveDistanceWhilePlay, values = geometry
+
+    # 给最终的手掌位置添加一点随机移动，缓存的手型里不包含这个随机移动
+    random_vector = (np.random if rng is None else rng).rand(3)
+    random_vector = random_vector / np.linalg.norm(random_vector)
+    H_R = H_R + random_vector * fingerMoveDistanceWhilePlay * 0.5
+
+    result = {'H_R': H_R.tolist()}
+    for name, value in values.items():
+        result[name] = list(value)
+    return result
+
+
+def right_hand_geometry(avatar_data: Any, rightFingerPositions: List[int], isArpeggio: bool, isAfterPlayed: bool, hand_position: float, usedRightFingers: List[str],  max_string_index: int):
     """
     新的定位方法基本上是这样的：
     如果是扫弦，那么直接读取扫弦状态的基准状态，然后结束。
@@ -233,9 +335,8 @@ def new_finger_position_method(avatar_data: Any, rightFingerPositions: List[int]
     计算出来拨弦手指的触弦点以后，根据当前是否拨弦结束，来决定手指实际应该停留的位置。
     如果拨弦指是IMA指，那么预备点和结束点以及触弦点，都是在手掌->手指的直线上。
     如果拨弦指大拇指指，需要额外读取一个拨弦方向，然后计算出来预备点，结束点的位置。
+    返回不含随机移动的手掌位置，手指运动的距离，以及其它控制器的位置。
     """
-    result = {}
-
     # 根据手掌的位置先计算所有确定手掌和手臂位置的点
     h0 = array(avatar_data['RIGHT_HAND_POSITIONS']['Normal_P0_H_R'])
     h3 = array(avatar_data['RIGHT_HAND_POSITIONS']['Normal_P3_H_R'])
@@ -392,13 +493,7 @@ def new_finger_position_method(avatar_data: Any, rightFingerPositions: List[int]
         # ch指是不参与演奏的，所以直接使用休息位置
         P_R = ch_rest_position
 
-    # 给最终的手掌位置添加一点随机移动
-    random_vector = np.random.rand(3)
-    random_vector = random_vector / np.linalg.norm(random_vector)
-    H_R = H_R + random_vector * fingerMoveDistanceWhilePlay * 0.5
-
-    result.update({
-        'H_R': H_R.tolist(),
+    values = {
         'H_rotation_R': H_rotation_R.tolist(),
         'HP_R': HP_R.tolist(),
         'TP_R': TP_R.tolist(),
@@ -407,11 +502,11 @@ def new_finger_position_method(avatar_data: Any, rightFingerPositions: List[int]
         'M_R': M_R.tolist(),
         'R_R': R_R.tolist(),
         'P_R': P_R.tolist()
-    })
-    return result
+    }
+    return H_R, fingerMoveDistanceWhilePlay, values
 
 
-def caculateRightHandFingers(avatar_data: dict, rightFingerPositions: List[int], usedRightFingers: List[str], max_string_index: int = 5, isAfterPlayed: bool = False) -> Dict:
+def caculateRightHandFingers(avatar_data: dict, rightFingerPositions: List[int], usedRightFingers: List[str], max_string_index: int = 5, isAfterPlayed: bool = False, geometry_cache: Dict | None = None, rng: Any = None) -> Dict:
 
     finger_indexs = {
         "p": 0,
@@ -459,7 +554,7 @@ def caculateRightHandFingers(avatar_data: dict, rightFingerPositions: List[int],
         hand_position = -0.6 * average_offset + 3.6
 
     result = new_finger_position_method(
-        avatar_data, rightFingerPositions, isArpeggio, isAfterPlayed, hand_position, usedRightFingers, max_string_index)
+        avatar_data, rightFingerPositions, isArpeggio, isAfterPlayed, hand_position, usedRightFingers, max_string_index, geometry_cache, rng)
 
     return result
 
@@ -1,5 +1,10 @@
 from mido import MidiFile
-from typing import List, Any
+from typing import List, Any, Dict, Iterator, Tuple
+from functools import lru_cache
+from bisect import bisect_right
+import numpy as np
+import heapq
+import os
 import random
 
 MIDI_INSTRUMENTS = [
@@ -22,6 +27,130 @@ MIDI_INSTRUMENTS = [
 ]
 
 
+class MidiSession():
+    """
+    a parsed midi file, all functions reading the same file share one session instead of parsing it again. 一个解析好的midi文件，读取同一个文件的函数共用一个会话，不再重复解析
+    :param midiFilePath: path of midi file. midi文件路径
+    """
+
+    def __init__(self, midiFilePath: str) -> None:
+        self.midiFilePath = midiFilePath
+        self.midiFile = MidiFile(midiFilePath)
+
+    @property
+    def tracks(self) -> list:
+        return self.midiFile.tracks
+
+    @property
+    def ticks_per_beat(self) -> int:
+        return self.midiFile.ticks_per_beat
+
+    def getTempoChanges(self) -> List[Tuple[int, int, int]]:
+        """
+        :return: list of (track index, tempo, absolute tick). (轨道索引, 速度, 绝对tick)的列表
+        """
+        tempo_changes = []
+        for i, track in enumerate(self.tracks):
+            absolute_time = 0
+            for msg in track:
+                absolute_time += msg.time
+                if msg.type == 'set_tempo':
+                    tempo_changes.append((i, msg.tempo, absolute_time))
+        return tempo_changes
+
+    def selectTracks(self, useTracks: List[int]) -> list:
+        """
+        select tracks by index, track 0 is added if any index is invalid. 按索引选择轨道，有无效索引时会补上0轨
+        """
+        midTracks = []
+        try:
+            for track in useTracks:
+                midTracks.append(self.tracks[track])
+        except:
+            midTracks.append(self.tracks[0])
+        return midTracks
+
+    @staticmethod
+    def iterTrackEvents(midTrack, useChannel: int, octave_down_checkbox: bool, capo_number: int) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        yield the events of a track in order, each kind of events is in real_tick order. 按顺序生成一个轨道的事件，每一种事件内部都是按real_tick排序的
+        :return: an iterator of (kind, event), kind is message, notes or pitchwheel. (类型, 事件)的迭代器，类型是message, notes或者pitchwheel
+        """
+        note = []
+        real_tick: float = 0
+        pre_tick: float = 0
+        for message in midTrack:
+            ticks = message.time
+            real_tick += ticks
+
+            if not hasattr(message, 'channel'):
+                continue
+
+            if message.channel == useChannel or useChannel == -1:
+                yield "message", {'message': str(message), 'real_tick': real_tick}
+                if message.type == 'note_on':
+                    message_note = message.note if not octave_down_checkbox else message.note - 12
+                    message_note -= capo_number
+                    note.append(message_note)
+                else:
+                    # 结束音符的收集
+                    if len(note) == 0:
+                        continue
+                    # 将note里的元素按大小排序
+                    notes = sorted(note)
+                    yield "notes", {"notes": notes, "real_tick": pre_tick}
+                    note = []
+
+                if message.type == 'pitchwheel':
+                    yield "pitchwheel", {"pitchwheel": message.pitch, "real_tick": pre_tick}
+
+            pre_tick = real_tick
+
+    def iterEvents(self, kind: str, useTracks: List[int], useChannel: int = 0, octave_down_checkbox: bool = False, capo_number: int = 0) -> Iterator[Dict[str, Any]]:
+        """
+        lazily merge one kind of events of all tracks in real_tick order, events with the same real_tick keep the track order. 按real_tick顺序惰性合并所有轨道的同一种事件，real_tick相同的事件保持轨道顺序
+        :param kind: message, notes or pitchwheel. 事件类型
+        """
+        trackEvents = [(event for event_kind, event in self.iterTrackEvents(midTrack, useChannel, octave_down_checkbox, capo_number) if event_kind == kind)
+                       for midTrack in self.selectTracks(useTracks)]
+        return heapq.merge(*trackEvents, key=lambda event: event["real_tick"])
+
+    def collectEvents(self, useTracks: List[int], useChannel: int = 0, octave_down_checkbox: bool = False, capo_number: int = 0) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        decode every track once and merge each kind of events of all tracks like iterEvents. 每个轨道只解码一次，再像iterEvents一样合并所有轨道的每一种事件
+        :return: {kind: events} for message, notes and pitchwheel. message, notes和pitchwheel三种事件的{类型: 事件列表}
+        """
+        trackEvents: Dict[str, List[List[Dict[str, Any]]]] = {
+            kind: [] for kind in ("message", "notes", "pitchwheel")}
+        for midTrack in self.selectTracks(useTracks):
+            events: Dict[str, List[Dict[str, Any]]] = {
+                kind: [] for kind in trackEvents}
+            for kind, event in self.iterTrackEvents(midTrack, useChannel, octave_down_checkbox, capo_number):
+                events[kind].append(event)
+            for kind, kindEvents in events.items():
+                trackEvents[kind].append(kindEvents)
+        return {kind: list(heapq.merge(*streams, key=lambda event: event["real_tick"]))
+                for kind, streams in trackEvents.items()}
+
+    def iterNoteEvents(self, useTracks: List[int], useChannel: int = 0, octave_down_checkbox: bool = False, capo_number: int = 0) -> Iterator[Dict[str, Any]]:
+        """
+        :return: an iterator of {"notes": notes, "real_tick": real_tick} in real_tick order. 按real_tick排序的{"notes": 音符, "real_tick": real_tick}迭代器
+        """
+        return self.iterEvents("notes", useTracks, useChannel, octave_down_checkbox, capo_number)
+
+
+@lru_cache(maxsize=8)
+def _loadMidiSession(midiFilePath: str, mtime: float) -> MidiSession:
+    return MidiSession(midiFilePath)
+
+
+def getMidiSession(midiFilePath: str) -> MidiSession:
+    """
+    get the session of a midi file, the file is parsed again only if it has been modified. 获取midi文件的会话，只有文件被修改过才会重新解析
+    """
+    return _loadMidiSession(os.path.abspath(midiFilePath), os.path.getmtime(midiFilePath))
+
+
 def calculate_frame(tempo_changes, ticks_per_beat, FPS, real_tick) -> int:
     total_frames = 0
     for i in range(len(tempo_changes)):
@@ -48,24 +177,75 @@ def calculate_frame(tempo_changes, ticks_per_beat, FPS, real_tick) -> int:
     return total_frames
 
 
+class TempoMap():
+    """
+    convert ticks to frames with prefix sums, the result is the same as calculate_frame. 用前缀和把tick转换为帧数，结果与calculate_frame相同
+    :param tempo_changes: list of (track index, tempo, tick) from get_tempo_changes. get_tempo_changes得到的(轨道索引, 速度, tick)列表
+    :param ticks_per_beat: ticks per beat. 每拍tick数
+    :param FPS: frames per second. 每秒帧数
+    """
+
+    def __init__(self, tempo_changes: List[tuple], ticks_per_beat: int, FPS: int) -> None:
+        self.ticks_per_beat = ticks_per_beat
+        self.FPS = FPS
+        self.times = np.array([time for _, _, time in tempo_changes])
+        self.tempos = np.array([tempo for _, tempo, _ in tempo_changes])
+
+        # calculate_frame遇到第一个超过real_tick的速度变化就会停止，所以用tick的前缀最大值来查找停止的位置
+        self.maxTimes = []
+        # prefixFrames[i]是前i段完整区间的帧数，按calculate_frame里的顺序逐段累加
+        self.prefixFrames = [0]
+        for i, (_, current_tempo, current_time) in enumerate(tempo_changes):
+            self.maxTimes.append(
+                max(self.maxTimes[-1], current_time) if self.maxTimes else current_time)
+            if i + 1 < len(tempo_changes):
+                seconds = (tempo_changes[i + 1][2] - current_time) * \
+                    current_tempo / (ticks_per_beat * 1000000)
+                self.prefixFrames.append(
+                    self.prefixFrames[-1] + seconds * FPS)
+        self.prefixFramesArray = np.array(self.prefixFrames, dtype=float)
+        self.maxTimesArray = np.array(self.maxTimes)
+
+    def tick_to_frame(self, real_tick: float) -> float:
+        """
+        :param real_tick: tick. tick值
+        :return: frame. 帧数
+        """
+        count = bisect_right(self.maxTimes, real_tick)
+        if count == 0:
+            return 0
+        seconds = (real_tick - int(self.times[count - 1])) * \
+            int(self.tempos[count - 1]) / (self.ticks_per_beat * 1000000)
+        return self.prefixFrames[count - 1] + seconds * self.FPS
+
+    def ticks_to_frames(self, ticks: np.ndarray) -> np.ndarray:
+        """
+        convert all ticks at once. 一次性转换所有的tick
+        :param ticks: ticks. tick数组
+        :return: frames as float array. 浮点数的帧数数组
+        """
+        ticks = np.asarray(ticks, dtype=float)
+        counts = np.searchsorted(self.maxTimesArray, ticks, side="right")
+        if len(self.times) == 0:
+            return np.zeros(ticks.shape)
+        indexes = np.maximum(counts - 1, 0)
+        seconds = (ticks - self.times[indexes]) * \
+            self.tempos[indexes] / (self.ticks_per_beat * 1000000)
+        frames = self.prefixFramesArray[indexes] + seconds * self.FPS
+        return np.where(counts == 0, 0.0, frames)
+
+
 def get_tempo_changes(midiFilePath: str):
-    midFile = MidiFile(midiFilePath)
-    tick_per_beat: int = midFile.ticks_per_beat
-    tempo_changes = []
-    for i, track in enumerate(midFile.tracks):
-        absolute_time = 0
-        for msg in track:
-            absolute_time += msg.time
-            if msg.type == 'set_tempo':
-                tempo_changes.append((i, msg.tempo, absolute_time))
-    return tempo_changes, tick_per_beat
+    session = getMidiSession(midiFilePath)
+    return session.getTempoChanges(), session.ticks_per_beat
 
 
 def export_midi_info(midi_name: str) -> str:
     midiFilePath = 'asset/midi/' + midi_name+'.mid'
     result = ''
-    midFile = MidiFile(midiFilePath)
+    midFile = getMidiSession(midiFilePath).midiFile
 
+    os.makedirs('output', exist_ok=True)
     with open('output/current_midi_info.txt', 'w', encoding='utf-8') as f:
         for message in midFile.tracks[0]:
             f.write(str(message) + '\n')
@@ -88,56 +268,13 @@ def midiToGuitarNotes(midiFilePath: str, useTracks: List[int], useChannel: int =
     :param useChannel: channel number to use. 使用的通道编号，如果使用-1表示不限制
     :return: notes and beat in the midi file. 返回midi文件中指定轨道的音符和时间信息
     """
-    midTracks = []
-    try:
-        for track in useTracks:
-            midTracks.append(MidiFile(midiFilePath).tracks[track])
-    except:
-        midTracks.append(MidiFile(midiFilePath).tracks[0])
-
-    notes_map = []
-    pitch_wheel_map = []
-    messages = []
-
-    for midTrack in midTracks:
-        note = []
-        real_tick: float = 0
-        pre_tick: float = 0
-        for message in midTrack:
-            ticks = message.time
-            real_tick += ticks
-
-            if not hasattr(message, 'channel'):
-                continue
-
-            if message.channel == useChannel or useChannel == -1:
-                messages.append(
-                    {'message': str(message), 'real_tick': real_tick})
-                if message.type == 'note_on':
-                    message_note = message.note if not octave_down_checkbox else message.note - 12
-                    message_note -= capo_number
-                    note.append(message_note)
-                else:
-                    # 结束音符的收集
-                    if len(note) == 0:
-                        continue
-                    # 将note里的元素按大小排序
-                    notes = sorted(note)
-                    notes_map.append({"notes": notes, "real_tick": pre_tick})
-                    note = []
-
-                if message.type == 'pitchwheel':
-                    pitch_wheel_map.append(
-                        {"pitchwheel": message.pitch, "real_tick": pre_tick})
-
-            pre_tick = real_tick
+    session = getMidiSession(midiFilePath)
 
-    # notes_map，pitch_wheel_map,messages都按real_tick排序
-    notes_map = sorted(notes_map, key=lambda x: x['real_tick'])
-    pitch_wheel_map = sorted(pitch_wheel_map, key=lambda x: x['real_tick'])
-    messages = sorted(messages, key=lambda x: x['real_tick'])
+    # 每个轨道只解码一次，轨道内的事件已经按real_tick排好序，用堆合并各轨道，不再拼接后重新排序
+    events = session.collectEvents(
+        useTracks, useChannel, octave_down_checkbox, capo_number)
 
-    return notes_map, pitch_wheel_map, messages
+    return events["notes"], events["pitchwheel"], events["message"]
 
 
 def processedNotes(chordNotes: list[int], min: int, max: int) -> list[int]:
@@ -0,0 +1,205 @@
+"""
+checkpoints of the beam search, so a long search can be resumed after a crash or Ctrl-C. 束搜索的检查点，长时间的搜索在崩溃或者Ctrl-C之后可以接着运行
+检查点保存了记录池里所有记录器共享的路径树(由flattenRecorders展开)和已经处理的事件数，用列式格式写成紧凑的二进制文件
+SearchSnapshots用同样的格式保存整个搜索过程中的多个记录池，修改midi以后可以只重新搜索改动的部分
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from ..HandPoseRecorder import HandPoseRecordPool, PoseRecorder, flattenRecorders, unflattenRecorders
+from .columnar import ColumnarFile, saveColumnar
+
+# 检查点的格式版本，手型或者记录池的数据结构有变化时需要更新，旧版本的检查点会被忽略
+CHECKPOINT_VERSION = 1
+CHECKPOINT_EXTENSION = ".fdckpt"
+
+
+def fingerprintOf(*inputs: Any) -> str:
+    """
+    a hash of everything the search result depends on, a checkpoint is only used when the fingerprint matches. 搜索结果所依赖的全部输入的哈希，只有指纹相同时才使用检查点
+    """
+    return hashlib.sha1(json.dumps(inputs, default=str).encode("utf-8")).hexdigest()
+
+
+class SearchCheckpoint():
+    """
+    periodic checkpoints of a recorder pool. 记录池的定期检查点
+    :param filePath: path of the checkpoint file. 检查点文件路径
+    :param fingerprint: fingerprint of the search inputs, see fingerprintOf. 搜索输入的指纹
+    :param recorderClass: HandPoseRecorder or RightHandRecorder. 记录器的类
+    :param every: save after every this many events, 0 means only the finished search is saved. 每处理这么多个事件保存一次，0表示只保存搜索结束时的结果
+    """
+
+    def __init__(self, filePath: str, fingerprint: str, recorderClass: Type[PoseRecorder], every: int) -> None:
+        self.filePath = filePath
+        self.fingerprint = fingerprint
+        self.recorderClass = recorderClass
+        self.every = every
+
+    def update(self, handPoseRecordPool: HandPoseRecordPool, event_index: int, total_steps: int) -> None:
+        """
+        call it after every event of the search. 在搜索的每个事件之后调用
+        :param event_index: number of events processed so far. 已经处理的事件数
+        """
+        if event_index == total_steps or (self.every > 0 and event_index % self.every == 0):
+            self.save(handPoseRecordPool, event_index)
+
+    def save(self, handPoseRecordPool: HandPoseRecordPool, event_index: int) -> None:
+        flatNodes, tails = flattenRecorders(
+            handPoseRecordPool.curHandPoseRecordPool)
+        nodes = [{"handPose": handPose.toState(), "entropy": entropy, "real_tick": real_tick, "parent": parentIndex}
+                 for handPose, entropy, real_tick, parentIndex in flatNodes]
+        # 先写临时文件再替换，写到一半时中断也不会破坏上一个检查点
+        tempFilePath = f"{self.filePath}.{os.getpid()}.tmp"
+        saveColumnar(tempFilePath, {
+            "version": CHECKPOINT_VERSION,
+            "fingerprint": self.fingerprint,
+            "event_index": event_index,
+            "size": handPoseRecordPool.size,
+            "merge_states": handPoseRecordPool.merge_states,
+            "tails": tails,
+            "nodes": nodes,
+        })
+        os.replace(tempFilePath, self.filePath)
+
+    def load(self, handPoseRecordPool: HandPoseRecordPool) -> int:
+        """
+        restore the recorders saved by a previous run, checkpoints with a different version, fingerprint or pool setting are ignored. 恢复之前运行时保存的记录器，版本、指纹或者记录池设置不同的检查点会被忽略
+        :return: number of events already processed, the search continues from this event. 已经处理的事件数，搜索从这个事件接着运行
+        """
+        if not os.path.exists(self.filePath):
+            return 0
+        data = ColumnarFile(self.filePath).toRecords()
+        if data["version"] != CHECKPOINT_VERSION or data["fingerprint"] != self.fingerprint:
+            return 0
+        if data["size"] != handPoseRecordPool.size or data["merge_states"] != handPoseRecordPool.merge_states:
+            return 0
+
+        handPoseClass = self.recorderClass.handPoseClass
+        flatNodes = [(handPoseClass.fromState(node["handPose"]), node["entropy"], node["real_tick"], node["parent"])
+                     for node in data["nodes"]]
+        handPoseRecordPool.setRecorders(unflattenRecorders(
+            flatNodes, data["tails"], self.recorderClass))
+        return data["event_index"]
+
+
+class SearchSnapshots():
+    """
+    the pools of a whole search saved every few events, together with a hash of every event, so that the next run after a midi edit can start from the last snapshot before the first changed event. 整个搜索过程中每隔几个事件保存一次的记录池，以及每个事件的哈希，修改midi以后再次运行时可以从第一个改动的事件之前最近的快照开始
+    所有快照的路径树一起展开保存，共享的前缀只保存一次
+    :param recorderClass: HandPoseRecorder or RightHandRecorder. 记录器的类
+    :param settings: fingerprint of the search settings other than the events, snapshots with different settings are ignored. 除事件以外的搜索设置的指纹，设置不同的快照会被忽略
+    :param every: keep the pool after every this many events. 每处理这么多个事件保存一次记录池
+    """
+
+    def __init__(self, recorderClass: Type[PoseRecorder], settings: str, every: int = 32) -> None:
+        self.recorderClass = recorderClass
+        self.settings = settings
+        self.every = every
+        self.eventHashes: List[str] = []
+        # 已经处理的事件数 -> 当时记录池中的记录器
+        self.pools: Dict[int, List[Any]] = {}
+
+    def record(self, handPoseRecordPool: HandPoseRecordPool, event_index: int, total_steps: int) -> None:
+        """
+        call it before the search with event_index 0 and after every event. 搜索前以event_index为0调用一次，之后在每个事件之后调用
+        """
+        if event_index == total_steps or event_index % self.every == 0:
+            self.pools[event_index] = list(
+                handPoseRecordPool.curHandPoseRecordPool)
+
+    def flatten(self) -> Tuple[List[tuple], List[dict]]:
+        """
+        flatten the paths of all pools into one tree, so they can be saved or sent to another process. 把所有记录池的路径展开成一棵树，用于保存或者传给别的进程
+        :return: the nodes like flattenRecorders, and {"event_index", "tails"} of every pool. 与flattenRecorders相同的节点，以及每个记录池的{"event_index", "tails"}
+        """
+        eventIndexes = sorted(self.pools)
+        flatNodes, tails = flattenRecorders(
+            [recorder for event_index in eventIndexes for recorder in self.pools[event_index]])
+        pools = []
+        for event_index in eventIndexes:
+            count = len(self.pools[event_index])
+            pools.append({"event_index": event_index, "tails": tails[:count]})
+            tails = tails[count:]
+        return flatNodes, pools
+
+    def unflatten(self, flatNodes: List[tuple], pools: List[dict]) -> None:
+        """
+        restore the pools returned by flatten. 恢复flatten返回的记录池
+        """
+        recorders = unflattenRecorders(flatNodes, [
+            tail for pool in pools for tail in pool["tails"]], self.recorderClass)
+        for pool in pools:
+            count = len(pool["tails"])
+            self.pools[pool["event_index"]] = recorders[:count]
+            recorders = recorders[count:]
+
+    def save(self, filePath: str) -> None:
+        flatNodes, pools = self.flatten()
+        tempFilePath = f"{filePath}.{os.getpid()}.tmp"
+        saveColumnar(tempFilePath, {
+            "version": CHECKPOINT_VERSION,
+            "settings": self.settings,
+            "every": self.every,
+            "event_hashes": self.eventHashes,
+            "pools": pools,
+            "nodes": [{"handPose": handPose.toState(), "entropy": entropy, "real_tick": real_tick, "parent": parentIndex}
+                      for handPose, entropy, real_tick, parentIndex in flatNodes],
+        })
+        os.replace(tempFilePath, filePath)
+
+    @classmethod
+    def load(cls, filePath: str, recorderClass: Type[PoseRecorder], settings: str) -> Optional["SearchSnapshots"]:
+        """
+        :return: None if there is no file or it was saved with a different version or settings. 没有文件或者版本、设置不同时返回None
+        """
+        if not os.path.exists(filePath):
+            return None
+        data = ColumnarFile(filePath).toRecords()
+        if data["version"] != CHECKPOINT_VERSION or data["settings"] != settings:
+            return None
+
+        snapshots = cls(recorderClass, settings, data["every"])
+        snapshots.eventHashes = data["event_hashes"]
+        handPoseClass = recorderClass.handPoseClass
+        snapshots.unflatten([(handPoseClass.fromState(node["handPose"]), node["entropy"], node["real_tick"], node["parent"])
+                             for node in data["nodes"]], data["pools"])
+        return snapshots
+
+
+def getCheckpointPath(midiFilePath: str, track_number: List[int], hand: str, checkpoint_dir: str = "output/checkpoint") -> str:
+    """
+    checkpoints do not depend on the avatar or the output format, so they can be shared by runs with different settings. 检查点与角色和输出格式无关，不同设置的运行可以共用
+    :param hand: lefthand or righthand, with a suffix for other kinds of files. 左手或者右手，其它种类的文件再加上后缀
+    """
+    filename = os.path.splitext(os.path.basename(midiFilePath))[0]
+    track_number_string = "_".join([str(i) for i in track_number])
+    return f"{checkpoint_dir}/{filename}_{track_number_string}_{hand}{CHECKPOINT_EXTENSION}"
+
+
+def forkCheckpoint(inputPath: str, outputPath: str) -> None:
+    """
+    copy a checkpoint, so that different settings can be tried from it without overwriting the original one. 复制一个检查点，这样可以从它出发尝试不同的设置而不覆盖原来的检查点
+    """
+    dirname = os.path.dirname(outputPath)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    shutil.copyfile(inputPath, outputPath)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="show or fork a beam search checkpoint. 查看或者复制束搜索的检查点")
+    parser.add_argument("input")
+    parser.add_argument("output", nargs="?",
+                        help="fork the checkpoint to this path. 把检查点复制到这个路径")
+    args = parser.parse_args()
+    if args.output:
+        forkCheckpoint(args.input, args.output)
+    else:
+        data = ColumnarFile(args.input).toRecords()
+        print(f'已经处理了{data["event_index"]}个事件，记录池中有{len(data["tails"])}个记录器，共{len(data["nodes"])}个节点')
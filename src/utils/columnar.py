@@ -0,0 +1,306 @@
+"""
+a compact binary format for the json intermediates, each leaf field of the records is stored as a raw numpy column. 中间文件的紧凑二进制格式，记录里的每个叶子字段都保存为一个numpy原始列
+文件结构：8字节魔数，版本和描述长度(struct "<II")，json描述，然后是按64字节对齐的各列原始数据
+描述里记录了每一列的名字、类型、形状和偏移，读取时可以直接用np.memmap映射，不需要解析整个文件
+"""
+import argparse
+import json
+import os
+import struct
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+MAGIC = b"FDCOL\x00\x00\x01"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sII")
+ALIGNMENT = 64
+COLUMNAR_EXTENSION = ".fdcol"
+
+
+class _ColumnWriter():
+    """
+    infer the schema of records and split them into columns. 推断记录的结构并拆分成列
+    """
+
+    def __init__(self) -> None:
+        self.columns: Dict[str, np.ndarray] = {}
+
+    def encode(self, values: List[Any], path: str) -> Dict[str, Any]:
+        kinds = set(_kindOf(value) for value in values)
+        if len(kinds) > 1:
+            return self.encodeJson(values, path)
+        kind = kinds.pop() if kinds else "int"
+
+        if kind == "dict":
+            return self.encodeDict(values, path)
+        if kind == "list":
+            return self.encodeList(values, path)
+        if kind == "str":
+            return self.encodeStrings(values, path)
+        if kind == "bool":
+            self.columns[path] = np.array(values, dtype=np.bool_)
+            return {"type": "bool", "column": path}
+        if kind in ("int", "float", "number"):
+            return self.encodeNumbers(values, path)
+        return self.encodeJson(values, path)
+
+    def encodeNumbers(self, values: List[Any], path: str) -> Dict[str, Any]:
+        is_int = [type(value) is int for value in values]
+        if all(is_int):
+            if values and (min(values) < -2**63 or max(values) >= 2**63):
+                return self.encodeJson(values, path)
+            self.columns[path] = np.array(values, dtype=np.int64)
+            return {"type": "int", "column": path}
+        self.columns[path] = np.array(values, dtype=np.float64)
+        schema: Dict[str, Any] = {"type": "float", "column": path}
+        # 同一个字段里既有整数又有小数时，记下哪些是整数，这样转回json时不会把0写成0.0
+        if any(is_int):
+            self.columns[path + "#int"] = np.array(is_int, dtype=np.bool_)
+            schema["int_mask"] = path + "#int"
+        return schema
+
+    def encodeStrings(self, values: List[str], path: str) -> Dict[str, Any]:
+        encoded = [value.encode("utf-8") for value in values]
+        self.columns[path] = np.frombuffer(
+            b"".join(encoded), dtype=np.uint8).copy()
+        self.columns[path + "#offsets"] = _offsets([len(value)
+                                                   for value in encoded])
+        return {"type": "str", "column": path, "offsets": path + "#offsets"}
+
+    def encodeJson(self, values: List[Any], path: str) -> Dict[str, Any]:
+        # 类型不统一的字段退回到逐个json序列化，保证任何数据都能往返转换
+        schema = self.encodeStrings(
+            [json.dumps(value) for value in values], path)
+        schema["type"] = "json"
+        return schema
+
+    def encodeList(self, values: List[list], path: str) -> Dict[str, Any]:
+        self.columns[path + "#offsets"] = _offsets([len(value)
+                                                   for value in values])
+        items = [item for value in values for item in value]
+        return {"type": "list", "offsets": path + "#offsets", "items": self.encode(items, path + "[]")}
+
+    def encodeDict(self, values: List[dict], path: str) -> Dict[str, Any]:
+        # 每一行的键和键的顺序记为一种布局，只保存存在的值
+        layouts: List[Tuple[str, ...]] = []
+        layoutIndexes = {}
+        rowLayouts = []
+        for value in values:
+            keys = tuple(value.keys())
+            if keys not in layoutIndexes:
+                layoutIndexes[keys] = len(layouts)
+                layouts.append(keys)
+            rowLayouts.append(layoutIndexes[keys])
+
+        schema: Dict[str, Any] = {"type": "dict",
+                                  "layouts": [list(keys) for keys in layouts], "fields": {}}
+        if len(layouts) > 1:
+            self.columns[path + "#layout"] = np.array(rowLayouts,
+                                                      dtype=np.uint32)
+            schema["layout"] = path + "#layout"
+
+        allKeys = list(dict.fromkeys(
+            key for keys in layouts for key in keys))
+        for key in allKeys:
+            fieldPath = f"{path}.{_escapeKey(key)}" if path else _escapeKey(key)
+            schema["fields"][key] = self.encode(
+                [value[key] for value in values if key in value], fieldPath)
+        return schema
+
+
+def _escapeKey(key: str) -> str:
+    """
+    escape the characters used in column paths, so that different fields never share a column. 转义列路径里用到的字符，保证不同的字段不会共用一列
+    例如键"a.b"和a里面的键"b"转义前都是"a.b"
+    """
+    return "".join(f"%{ord(char):02X}" if char in "%.[]#" else char for char in key)
+
+
+def _kindOf(value: Any) -> str:
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "str"
+    if isinstance(value, list):
+        return "list"
+    if isinstance(value, dict) and all(isinstance(key, str) for key in value):
+        return "dict"
+    return "other"
+
+
+def _offsets(lengths: List[int]) -> np.ndarray:
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets
+
+
+def saveColumnar(filePath: str, records: List[Any]) -> None:
+    """
+    save a list of json-like records as a columnar file. 把json形式的记录列表保存为列式文件
+    :param filePath: output path. 输出路径
+    :param records: records, usually a list of dicts. 记录，通常是字典的列表
+    """
+    writer = _ColumnWriter()
+    schema = writer.encode([records], "")
+
+    # 先算出每一列的偏移，再写出描述和数据
+    columnInfos = []
+    offset = 0
+    for name, column in writer.columns.items():
+        column = np.ascontiguousarray(column)
+        writer.columns[name] = column
+        columnInfos.append({"name": name, "dtype": column.dtype.str,
+                           "shape": list(column.shape), "offset": offset})
+        offset += _align(column.nbytes)
+
+    descriptor = json.dumps(
+        {"schema": schema, "columns": columnInfos}).encode("utf-8")
+    dataStart = _align(HEADER.size + len(descriptor))
+
+    dirname = os.path.dirname(filePath)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    with open(filePath, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(descriptor)))
+        f.write(descriptor)
+        f.write(b"\x00" * (dataStart - HEADER.size - len(descriptor)))
+        for info in columnInfos:
+            column = writer.columns[info["name"]]
+            f.write(column.tobytes())
+            f.write(b"\x00" * (_align(column.nbytes) - column.nbytes))
+
+
+def _align(size: int) -> int:
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class ColumnarFile():
+    """
+    a columnar file opened with memory mapping, columns are only read when used. 用内存映射打开的列式文件，列只有在使用时才会被读取
+    :param filePath: path of the file. 文件路径
+    """
+
+    def __init__(self, filePath: str) -> None:
+        self.filePath = filePath
+        with open(filePath, "rb") as f:
+            magic, version, descriptorLength = HEADER.unpack(
+                f.read(HEADER.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise ValueError(f"{filePath} is not a columnar file")
+            descriptor = json.loads(f.read(descriptorLength).decode("utf-8"))
+
+        self.schema = descriptor["schema"]
+        dataStart = _align(HEADER.size + descriptorLength)
+        self.columnInfos = {info["name"]: info for info in descriptor["columns"]}
+        self._dataStart = dataStart
+        self._columns: Dict[str, np.ndarray] = {}
+
+    @property
+    def columnNames(self) -> List[str]:
+        return list(self.columnInfos.keys())
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        a read-only memory-mapped column, for example "[].frame". 一个只读的内存映射列，例如"[].frame"
+        """
+        if name not in self._columns:
+            info = self.columnInfos[name]
+            shape = tuple(info["shape"])
+            if int(np.prod(shape)) == 0:
+                self._columns[name] = np.zeros(shape, dtype=info["dtype"])
+            else:
+                self._columns[name] = np.memmap(self.filePath, dtype=info["dtype"], mode="r",
+                                                offset=self._dataStart + info["offset"], shape=shape)
+        return self._columns[name]
+
+    def toRecords(self) -> Any:
+        """
+        decode the whole file back to json-like records. 把整个文件解码回json形式的记录
+        """
+        return self._decode(self.schema, 1)[0]
+
+    def _decode(self, schema: Dict[str, Any], count: int) -> List[Any]:
+        kind = schema["type"]
+        if kind == "int" or kind == "bool":
+            return self.column(schema["column"]).tolist()
+        if kind == "float":
+            values = self.column(schema["column"]).tolist()
+            if "int_mask" in schema:
+                intMask = self.column(schema["int_mask"]).tolist()
+                values = [int(value) if is_int else value for value,
+                          is_int in zip(values, intMask)]
+            return values
+        if kind == "str" or kind == "json":
+            data = self.column(schema["column"]).tobytes()
+            offsets = self.column(schema["offsets"]).tolist()
+            values = [data[offsets[i]:offsets[i + 1]].decode("utf-8")
+                      for i in range(len(offsets) - 1)]
+            if kind == "json":
+                values = [json.loads(value) for value in values]
+            return values
+        if kind == "list":
+            offsets = self.column(schema["offsets"]).tolist()
+            items = self._decode(schema["items"], offsets[-1])
+            return [items[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        if kind == "dict":
+            layouts = schema["layouts"]
+            rowLayouts = self.column(schema["layout"]).tolist(
+            ) if "layout" in schema else [0] * count
+            layoutCounts = np.bincount(
+                rowLayouts, minlength=len(layouts)).tolist()
+            fieldValues = {}
+            for key, fieldSchema in schema["fields"].items():
+                fieldCount = sum(layoutCount for keys, layoutCount in zip(
+                    layouts, layoutCounts) if key in keys)
+                fieldValues[key] = iter(self._decode(fieldSchema, fieldCount))
+            return [{key: next(fieldValues[key]) for key in layouts[layout]} for layout in rowLayouts]
+        raise ValueError(f"unknown column type {kind}")
+
+
+def isColumnarPath(filePath: str) -> bool:
+    return filePath.endswith(COLUMNAR_EXTENSION)
+
+
+def loadRecords(filePath: str | Any) -> Any:
+    """
+    load records from a json or columnar file, chosen by the file extension. 按扩展名从json或者列式文件中读取记录
+    如果传入的已经是内存中的记录而不是路径，直接原样返回，这样各个阶段既可以读文件也可以直接接收上一阶段的数据
+    """
+    if not isinstance(filePath, str):
+        return filePath
+    if isColumnarPath(filePath):
+        return ColumnarFile(filePath).toRecords()
+    with open(filePath, "r") as f:
+        return json.load(f)
+
+
+def saveRecords(filePath: str, records: Any, indent: int | None = None) -> None:
+    """
+    save records as json or columnar file, chosen by the file extension. 按扩展名把记录保存为json或者列式文件
+    :param indent: indent of json file. json文件的缩进
+    """
+    if isColumnarPath(filePath):
+        saveColumnar(filePath, records)
+        return
+    with open(filePath, "w") as f:
+        json.dump(records, f, indent=indent)
+
+
+def convertFile(inputPath: str, outputPath: str, indent: int | None = 4) -> None:
+    """
+    convert between json and columnar files. 在json和列式文件之间转换
+    """
+    saveRecords(outputPath, loadRecords(inputPath), indent)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="convert between json and columnar files. 在json和列式文件之间转换")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--indent", type=int, default=4)
+    args = parser.parse_args()
+    convertFile(args.input, args.output, args.indent)
@@ -0,0 +1,114 @@
+from collections import OrderedDict
+from typing import List, Tuple
+import json
+import os
+from ..guitar.Guitar import Guitar
+from .utils import convertNotesToFingerPositions, FingerPositions
+
+# 缓存文件的格式版本，按法的数据结构有变化时需要更新，旧版本的缓存文件会被忽略
+CACHE_VERSION = 2
+
+
+class FingeringCache():
+    """
+    an LRU cache from notes to all possible fingerings. 一个从音符到所有可能按法的LRU缓存
+    真实的曲子里同一个和弦会重复出现很多次，所以每组音符的按法只需要计算一次
+    :param maxsize: max number of cached note sets. 最多缓存多少组音符
+    """
+
+    def __init__(self, maxsize: int = 4096) -> None:
+        self._cache: OrderedDict = OrderedDict()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def makeKey(notes: List[int], guitar: Guitar) -> Tuple:
+        """
+        key of notes, which includes the tuning and whether harmonics are used. 音符组的键值，包含定弦与是否使用泛音
+        """
+        tuning = tuple(guitarString.getBaseNote()
+                       for guitarString in guitar.guitarStrings)
+        return (tuple(sorted(notes)), tuning, guitar.use_harm_notes)
+
+    def getFingerPositions(self, notes: List[int], guitar: Guitar) -> List[FingerPositions]:
+        """
+        :param notes: processed notes. 处理过的音符
+        :param guitar: guitar. 吉他
+        :return: all possible fingerings, don't modify it because it is shared. 所有可能的按法，它是共享的，不要修改它
+        """
+        key = self.makeKey(notes, guitar)
+        fingerPositionsList = self._cache.get(key)
+        if fingerPositionsList is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return fingerPositionsList
+
+        self.misses += 1
+        fingerPositionsList = convertNotesToFingerPositions(notes, guitar)
+        self._cache[key] = fingerPositionsList
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return fingerPositionsList
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total > 0 else 0
+        return f'指法缓存命中{self.hits}次，未命中{self.misses}次，命中率{hit_rate:.1f}%，共缓存{len(self._cache)}组音符'
+
+    def save(self, jsonFilePath: str, guitar: Guitar) -> None:
+        """
+        save the entries with the same tuning as guitar. 保存与吉他定弦相同的缓存
+        """
+        _, tuning, use_harm_notes = self.makeKey([], guitar)
+        entries = [[list(notes), fingerPositionsList] for (notes, entry_tuning, entry_use_harm_notes), fingerPositionsList in self._cache.items()
+                   if entry_tuning == tuning and entry_use_harm_notes == use_harm_notes]
+
+        dirname = os.path.dirname(jsonFilePath)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        # 先写临时文件再替换，多个进程同时保存时也不会读到写了一半的文件
+        tempFilePath = f"{jsonFilePath}.{os.getpid()}.tmp"
+        with open(tempFilePath, 'w') as f:
+            json.dump({
+                "version": CACHE_VERSION,
+                "tuning": list(tuning),
+                "use_harm_notes": use_harm_notes,
+                "entries": entries
+            }, f)
+        os.replace(tempFilePath, jsonFilePath)
+
+    def load(self, jsonFilePath: str, guitar: Guitar) -> int:
+        """
+        load cache saved by a previous run, files with a different version or tuning are ignored. 读取之前运行时保存的缓存，版本或者定弦不同的文件会被忽略
+        :return: number of loaded note sets. 读取的音符组数量
+        """
+        if not os.path.exists(jsonFilePath):
+            return 0
+        with open(jsonFilePath, 'r') as f:
+            data = json.load(f)
+
+        _, tuning, use_harm_notes = self.makeKey([], guitar)
+        if data.get("version") != CACHE_VERSION or tuple(data["tuning"]) != tuning or data["use_harm_notes"] != use_harm_notes:
+            return 0
+
+        for notes, fingerPositionsList in data["entries"]:
+            # json里只有列表，需要还原成元组
+            self._cache[(tuple(notes), tuning, use_harm_notes)] = [
+                tuple(tuple(position) for position in fingerPositions) for fingerPositions in fingerPositionsList]
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return len(data["entries"])
+
+
+def getFingeringCachePath(guitar: Guitar, cache_dir: str = "output/cache") -> str:
+    """
+    each tuning uses its own cache file. 每种定弦使用自己的缓存文件
+    """
+    _, tuning, use_harm_notes = FingeringCache.makeKey([], guitar)
+    tuning_string = "_".join([str(note) for note in tuning])
+    harm_string = "harm" if use_harm_notes else "noharm"
+    return f"{cache_dir}/fingering_cache_{tuning_string}_{harm_string}.json"
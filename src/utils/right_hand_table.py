@@ -0,0 +1,91 @@
+from typing import Any, Dict, List, Tuple
+import json
+import os
+from ..hand.RightHand import generatePossibleRightHands
+
+# 缓存文件的格式版本，右手组合的数据结构有变化时需要更新，旧版本的缓存文件会被忽略
+TABLE_VERSION = 1
+
+
+class RightHandFingeringTable():
+    """
+    a table from touched strings to all valid right hand combinations. 一个从拨弦组合到所有合法右手拨法的表
+    每种弦数的吉他最多只有2^6种拨弦组合，每种组合的右手拨法只需要递归生成一次，之后每个事件都只是查表
+    """
+
+    def __init__(self) -> None:
+        self._table: Dict[Tuple, List[Dict[str, Any]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def makeKey(touchedStrings: List[int], allow_double_p: bool, max_string_index: int) -> Tuple:
+        return (tuple(touchedStrings), allow_double_p, max_string_index)
+
+    def getCombinations(self, touchedStrings: List[int], allow_double_p: bool, max_string_index: int) -> List[Dict[str, Any]]:
+        """
+        :param touchedStrings: strings to be played, from high to low. 要拨的弦，从高到低排序
+        :param allow_double_p: whether the thumb can play two strings. p指是否可以拨两根弦
+        :param max_string_index: max string index of the guitar. 吉他最大的弦序号
+        :return: all possible right hands, don't modify it because it is shared. 所有可能的右手拨法，它是共享的，不要修改它
+        """
+        key = self.makeKey(touchedStrings, allow_double_p, max_string_index)
+        combinations = self._table.get(key)
+        if combinations is not None:
+            self.hits += 1
+            return combinations
+
+        self.misses += 1
+        allFingers = ["p", "p", "i", "m",
+                      "a"] if allow_double_p else ["p", "i", "m", "a"]
+        combinations = generatePossibleRightHands(
+            list(touchedStrings), allFingers, list(range(max_string_index + 1)))
+        self._table[key] = combinations
+        return combinations
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total > 0 else 0
+        return f'右手拨法表命中{self.hits}次，未命中{self.misses}次，命中率{hit_rate:.1f}%，共有{len(self._table)}种拨弦组合'
+
+    def save(self, jsonFilePath: str) -> None:
+        dirname = os.path.dirname(jsonFilePath)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        # 每种拨法只保存[usedFingers, rightFingerPositions]，比保存字典小很多
+        entries = [[list(touchedStrings), allow_double_p, max_string_index,
+                    [[combination['usedFingers'], combination['rightFingerPositions']] for combination in combinations]]
+                   for (touchedStrings, allow_double_p, max_string_index), combinations in self._table.items()]
+        # 先写临时文件再替换，多个进程同时保存时也不会读到写了一半的文件
+        tempFilePath = f"{jsonFilePath}.{os.getpid()}.tmp"
+        with open(tempFilePath, 'w') as f:
+            json.dump({
+                "version": TABLE_VERSION,
+                "entries": entries
+            }, f)
+        os.replace(tempFilePath, jsonFilePath)
+
+    def load(self, jsonFilePath: str) -> int:
+        """
+        load the table saved by a previous run, files with a different version are ignored. 读取之前运行时保存的表，版本不同的文件会被忽略
+        :return: number of loaded string combinations. 读取的拨弦组合数量
+        """
+        if not os.path.exists(jsonFilePath):
+            return 0
+        with open(jsonFilePath, 'r') as f:
+            data = json.load(f)
+        if data.get("version") != TABLE_VERSION:
+            return 0
+
+        for touchedStrings, allow_double_p, max_string_index, combinations in data["entries"]:
+            key = self.makeKey(touchedStrings, allow_double_p, max_string_index)
+            self._table[key] = [{'usedFingers': usedFingers, 'rightFingerPositions': rightFingerPositions}
+                                for usedFingers, rightFingerPositions in combinations]
+        return len(data["entries"])
+
+
+def getRightHandTablePath(cache_dir: str = "output/cache") -> str:
+    return f"{cache_dir}/right_hand_table.json"
@@ -1,61 +1,39 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Sequence
 from ..guitar.Guitar import Guitar
 import numpy as np
 from numpy import linalg
 import itertools
 from mathutils import Vector, Quaternion
 
+# 一个按法由多个(弦索引, 品格, 手指)组成，空弦音的手指为-1
+FingerPositions = Tuple[Tuple[int, int, int], ...]
 
-def convertNotesToChord(notes: List[int], guitar: Guitar) -> Any:
+
+def convertNotesToChord(notes: List[int], guitar: Guitar) -> List[Tuple[Tuple[int, int], ...]]:
     """
     convert notes to a list of possible positions on the guitar. 将音符转换为吉他上的可能位置列表
     :param notes: notes. 多个音符
     :param guitar: guitar. 吉他
-    :return: a list of possible positions on the guitar. 一个吉他上的可能位置列表
+    :return: a list of possible chords, each chord is a tuple of (string index, fret). 一个吉他上的可能位置列表，每个和弦是(弦索引, 品格)的元组
     """
     use_harm_notes = guitar.use_harm_notes
-    all_harm_notes = guitar.harm_notes if use_harm_notes else []
     notePositions = []
     result = []
 
     for note in notes:
-        possiblePositions = []
-        # 从低到高开始计算在每根弦上的位置
-        for guitarString in guitar.guitarStrings:
-            guitarStringIndex = guitarString._stringIndex
-            harm_notes = list(
-                filter(lambda x: x["index"] == guitarStringIndex, all_harm_notes)) if use_harm_notes else []
-            harm_frets = [harm_note["fret"]
-                          for harm_note in harm_notes if harm_note["note"] == note] if use_harm_notes else []
-            normal_fret = guitarString.getFretByNote(note)
-            has_normal_fret = normal_fret is not False
-            if len(harm_frets) == 0 and not has_normal_fret:
-                continue
-            # 低音弦的超高把位是无法按的
-            if guitarStringIndex > 2 and normal_fret > 16 and not has_normal_fret:
-                continue
-            # 如果当前音符在当前弦上有位置，那么记录下来
-            if len(harm_frets) > 0:
-                for fret in harm_frets:
-                    possiblePositions.append({
-                        "index": guitarStringIndex,
-                        "fret": fret
-                    })
-            if has_normal_fret:
-                possiblePositions.append({
-                    "index": guitarStringIndex,
-                    "fret": normal_fret
-                })
+        # 位置直接从吉他预先建好的索引里读取，已经是从低到高按弦排列的
+        possiblePositions = [(string_index, fret) for string_index, fret, is_harmonic in guitar.getNotePositions(note)
+                             if use_harm_notes or not is_harmonic]
         notePositions.append(possiblePositions)
 
     # 对notePositions里所有可能的位置进行组合，确保生成的每个组合都不存在index重复的情况
     combinations = itertools.product(*notePositions)
     for combination in combinations:
         # 如果combination里的元素的index有重复，就跳过
-        if len(combination) != len(set([position["index"] for position in combination])):
+        if len(combination) != len(set([position[0] for position in combination])):
             continue
 
-        frets = list(filter(bool, [position["fret"]
+        frets = list(filter(bool, [position[1]
                      for position in combination]))
         if frets:
             # 如果combination里元素的fret的个数大于4，就跳过，因为四个手指按不下
@@ -75,20 +53,42 @@ def convertNotesToChord(notes: List[int], guitar: Guitar) -> Any:
     return result
 
 
-def convertChordTofingerPositions(chord: List[Any]) -> List[List[Dict[str, int]]]:
+def convertChordTofingerPositions(chord: Sequence[Tuple[int, int]]) -> List[FingerPositions]:
     """
     convert chord to a list of possible hands. 将和弦转换为可能的手型列表
     :param chord: chord. 和弦
-    :return: a list of possible hands. 一个可能的手型列表
+    :return: a list of possible hands, each hand is a tuple of (string index, fret, finger). 一个可能的手型列表，每个手型是(弦索引, 品格, 手指)的元组
     """
-    result = []
-    fingerList = [1, 2, 3, 4]
+    return list(iterChordFingerPositions(chord))
 
-    for combination in generate_combinations_iter(chord, fingerList):
-        if verifyValidCombination(combination) and combination not in result:
-            result.append(combination)
 
-    return result
+def iterChordFingerPositions(chord: Sequence[Tuple[int, int]]):
+    """
+    a iterator to generate all valid and unique hands of a chord. 生成一个和弦所有合法且不重复手型的迭代器
+    空弦音的手指记为-1，与LeftFinger里空弦音的手指索引一致
+    :param chord: chord, a tuple of (string index, fret). 和弦，(弦索引, 品格)的元组
+    """
+    seen = set()
+
+    for fingerPositions in generate_pruned_combinations_iter(chord):
+        # 元组可以哈希，用集合去重，不再对列表做线性查找
+        if fingerPositions not in seen:
+            seen.add(fingerPositions)
+            yield fingerPositions
+
+
+def convertNotesToFingerPositions(notes: List[int], guitar: Guitar) -> List[FingerPositions]:
+    """
+    convert notes to all possible fingerings of all possible chords. 将音符转换为所有可能和弦的所有可能按法
+    :param notes: processed notes. 处理过的音符
+    :param guitar: guitar. 吉他
+    :return: a list of possible hands. 一个可能的手型列表
+    """
+    fingerPositionsList = []
+    for chord in convertNotesToChord(notes, guitar):
+        fingerPositionsList += iterChordFingerPositions(chord)
+
+    return fingerPositionsList
 
 
 def generate_combinations_iter(noteList: List[Dict[str, int]], fingerList: List[int]):
@@ -113,6 +113,83 @@ def generate_combinations_iter(noteList: List[Dict[str, int]], fingerList: List[
             yield [note] + combination
 
 
+def generate_pruned_combinations_iter(notes: Sequence[Tuple[int, int]], fingerList: List[int] = [1, 2, 3, 4]):
+    """
+    a backtracking iterator which generates the same valid combinations in the same order as generate_combinations_iter + verifyValidCombination, but cuts invalid branches while assigning fingers. 
+    回溯生成与generate_combinations_iter + verifyValidCombination相同顺序、相同结果的合法组合，但是在分配手指的过程中就剪掉不合法的分支
+    :param notes: a list of (string index, fret). (弦索引, 品格)的列表
+    :param fingerList: a list of fingers. 手指列表
+    """
+    """
+    verifyValidCombination把按弦的音按手指稳定排序以后，只比较相邻的两个音：
+    1. 同一个手指的音按原顺序相邻，如果品格相同、不是食指而且跨了不止一根弦，就不合法。后面再加入的音只会排在它们后面，所以这种错误一旦出现就无法挽回，可以直接剪枝。
+    2. 相邻两组手指之间，前一组最后一个音的品格比后一组第一个音的品格大，就不合法。前一组最后一个音还可能被后面的音替换，所以只有在剩下的音都无法修正时才剪枝。
+    """
+    count = len(notes)
+    # 每个位置之后（不含该位置）还没有分配的按弦音里最小的品格，用来判断错误还能不能被修正
+    remaining_min_fret = [float("inf")] * (count + 1)
+    for i in range(count - 1, -1, -1):
+        fret = notes[i][1]
+        remaining_min_fret[i] = min(remaining_min_fret[i + 1],
+                                    fret) if fret != 0 else remaining_min_fret[i + 1]
+
+    # 每个手指按的第一个音和最后一个音，格式是(弦索引, 品格)
+    first_notes: Dict[int, Tuple[int, int]] = {}
+    last_notes: Dict[int, Tuple[int, int]] = {}
+    assigned: List[Tuple[int, int, int]] = []
+
+    def is_dead(next_index: int) -> bool:
+        used_fingers = sorted(first_notes)
+        for i in range(len(used_fingers) - 1):
+            finger = used_fingers[i]
+            next_finger = used_fingers[i + 1]
+            if last_notes[finger][1] <= first_notes[next_finger][1]:
+                continue
+            # 没有剩下的按弦音时，错误已经确定
+            if remaining_min_fret[next_index] == float("inf"):
+                return True
+            # 两个手指之间不能再插入其它手指，只能靠前一个手指再按一个足够低的品来修正
+            if next_finger == finger + 1 and remaining_min_fret[next_index] > first_notes[next_finger][1]:
+                return True
+        return False
+
+    def backtrack(index: int):
+        if index == count:
+            yield tuple(assigned)
+            return
+
+        string_index, fret = notes[index]
+        if fret == 0:
+            assigned.append((string_index, fret, -1))
+            yield from backtrack(index + 1)
+            assigned.pop()
+            return
+
+        for finger in fingerList:
+            last_note = last_notes.get(finger)
+            # 如果出现非食指的跨弦横按，这个分支不合法
+            if last_note is not None and last_note[1] == fret and finger != 1 and abs(last_note[0] - string_index) > 1:
+                continue
+
+            is_first_note = last_note is None
+            if is_first_note:
+                first_notes[finger] = (string_index, fret)
+            last_notes[finger] = (string_index, fret)
+            assigned.append((string_index, fret, finger))
+
+            if not is_dead(index + 1):
+                yield from backtrack(index + 1)
+
+            assigned.pop()
+            if is_first_note:
+                del first_notes[finger]
+                del last_notes[finger]
+            else:
+                last_notes[finger] = last_note
+
+    yield from backtrack(0)
+
+
 def verifyValidCombination(combination: List[Dict[str, int]]) -> bool:
     """
     verify if a combination is valid. 验证组合是否有效
@@ -204,21 +281,22 @@ def slerp(q1, q2, t_tan):
     if np.allclose(q1, q2):
         return q1
 
-    # 计算两个四元数旋转值的夹角
-    angel_max = np.arccos(np.dot(q1, q2)) / \
-        np.linalg.norm(q1)
-    tan_angel_max = np.tan(angel_max)
-    current_angel = tan_angel_max * t_tan
-    t = current_angel / angel_max
-
     # 计算点积
     dot = np.dot(q1, q2)
 
-    # 如果点积为负，取反一个四元数以选择较短的路径
+    # 如果点积为负，取反一个四元数以选择较短的路径，夹角要在取反之后计算
     if dot < 0.0:
         q2 = -q2
         dot = -dot
 
+    # 计算两个四元数旋转值的夹角
+    angel_max = np.arccos(dot) / \
+        np.linalg.norm(q1)
+    tan_angel_max = np.tan(angel_max)
+    current_angel = tan_angel_max * t_tan
+    # q2取反后与q1几乎相同时夹角为0，此时不需要换算
+    t = current_angel / angel_max if angel_max > 0 else t_tan
+
     # 如果四元数非常接近，使用线性插值避免数值不稳定
     if dot > 0.9995:
         result = q1 + t * (q2 - q1)
@@ -236,6 +314,74 @@ def slerp(q1, q2, t_tan):
     return s1 * q1 + s2 * q2
 
 
+def _row_dots(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # 用批量矩阵乘法逐行求点积，每一行的结果与np.dot逐位相同
+    return (a[:, None, :] @ b[:, :, None])[:, 0, 0]
+
+
+def _row_norms(a: np.ndarray) -> np.ndarray:
+    return np.sqrt(_row_dots(a, a))
+
+
+def slerp_many(q1: Any, q2: Any, t_tan: Any) -> np.ndarray:
+    """
+    批量的四元数球面线性插值，对q1和q2的每一行分别做与slerp相同的计算
+    :param q1: 第一组四元数，形状为(N, 4)
+    :param q2: 第二组四元数，形状为(N, 4)
+    :param t_tan: 每一行的插值参数，形状为(N,)，也可以是一个数
+    :return: 插值后的四元数，形状为(N, 4)
+    """
+    q1 = np.asarray(q1, dtype=float)
+    q2 = np.asarray(q2, dtype=float)
+    t_tan = np.broadcast_to(np.asarray(t_tan, dtype=float), (len(q1),))
+
+    # 标准化四元数
+    q1 = q1 / _row_norms(q1)[:, None]
+    q2 = q2 / _row_norms(q2)[:, None]
+
+    # 两个四元数相同的行直接返回q1
+    result = q1.copy()
+    rows = ~np.isclose(q1, q2).all(axis=1)
+    if not rows.any():
+        return result
+    q1 = q1[rows]
+    q2 = q2[rows]
+    t_tan = t_tan[rows]
+
+    # 点积为负的行取反一个四元数，以选择较短的路径，夹角要在取反之后计算
+    dot = _row_dots(q1, q2)
+    negative = dot < 0.0
+    q2 = np.where(negative[:, None], -q2, q2)
+    dot = np.where(negative, -dot, dot)
+
+    # 计算两个四元数旋转值的夹角，参数的换算与slerp相同
+    angel_max = np.arccos(dot) / _row_norms(q1)
+    positive = angel_max > 0
+    t = np.where(positive, np.tan(angel_max) * t_tan /
+                 np.where(positive, angel_max, 1.0), t_tan)
+
+    interpolated = np.empty_like(q1)
+    # 非常接近的四元数使用线性插值避免数值不稳定
+    near = dot > 0.9995
+    if near.any():
+        lerped = q1[near] + t[near, None] * (q2[near] - q1[near])
+        interpolated[near] = lerped / _row_norms(lerped)[:, None]
+
+    far = ~near
+    if far.any():
+        theta_0 = np.arccos(dot[far])
+        theta = theta_0 * t[far]
+        sin_theta = np.sin(theta)
+        sin_theta_0 = np.sin(theta_0)
+
+        s1 = np.cos(theta) - dot[far] * sin_theta / sin_theta_0
+        s2 = sin_theta / sin_theta_0
+        interpolated[far] = s1[:, None] * q1[far] + s2[:, None] * q2[far]
+
+    result[rows] = interpolated
+    return result
+
+
 def lerp_by_fret(fret: float, value_1: Any, value_12: Any) -> Any:
     """
     根据品格数计算位置，支持三元位置向量和四元数旋转
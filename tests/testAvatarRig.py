@@ -0,0 +1,62 @@
+import json
+import os
+import unittest
+import numpy as np
+from src.animate.animate import LeftHandPoses, animatedLeftHand
+from src.animate.avatar_rig import MAX_RIG_FRET, AvatarRig
+from src.utils.utils import lerp_by_fret
+
+AVATAR_FILE = os.path.join(os.path.dirname(__file__),
+                           "..", "asset", "controller_infos", "Furina_E.json")
+
+
+class TestAvatarRig(unittest.TestCase):
+    def test_fret_tables(self):
+        # 查表的结果要与直接用lerp_by_fret计算的结果逐位相同，四元数旋转也一样
+        with open(AVATAR_FILE, "r") as f:
+            avatar_data = json.load(f)
+        rig = AvatarRig(avatar_data)
+        rotations = avatar_data["ROTATIONS"]["H_rotation_L"]["Normal"]
+        fret_02, fret_13 = rig.tables("normal", "H_rotation_L")
+        self.assertTrue(fret_02.is_quaternion)
+        for fret in range(MAX_RIG_FRET + 1):
+            self.assertEqual(fret_02.at(fret).tolist(), np.asarray(lerp_by_fret(
+                fret, np.array(rotations["P0"]), np.array(rotations["P2"]))).tolist())
+
+        positions = avatar_data["NORMAL_LEFT_HAND_POSITIONS"]
+        self.assertEqual(rig.tables("normal", "H_L")[1].at(7).tolist(), lerp_by_fret(
+            7, np.array(positions["P1"]["H_L"]), np.array(positions["P3"]["H_L"])).tolist())
+
+        with self.assertRaises(KeyError):
+            rig.tables("barre", "not_a_controller")
+
+    def test_left_hand_poses(self):
+        # 批量计算的按弦姿势要与逐个调用animatedLeftHand的结果完全一致
+        with open(AVATAR_FILE, "r") as f:
+            avatar_data = json.load(f)
+        for points in avatar_data["BARRE_LEFT_HAND_POSITIONS"].values():
+            points["I_L"] = points["H_L"]
+        rig = AvatarRig(avatar_data)
+        normal = np.array([0.0, 0.0, 1.0])
+
+        def finger(fingerIndex, stringIndex, fret, press):
+            return {"fingerIndex": fingerIndex, "fingerInfo": {"stringIndex": stringIndex, "fret": fret, "press": press}}
+        handDicts = [
+            {"leftHand": [finger(-1, 5, 0, 0), finger(1, 2, 3, 1), finger(4, 4, 5, 1)],
+             "hand_position": 3},
+            {"leftHand": [finger(1, 3, 7, 1), finger(2, 1, 8, 0), finger(4, 1, 9, 1)],
+             "hand_position": 7, "pitchwheel": 2048},
+            {"leftHand": [finger(1, 4, 1, 2), finger(3, 2, 3, 1)],
+             "hand_position": 1, "use_barre": True},
+            {"leftHand": [finger(2, 3, 12, 1), finger(1, 3, 11, 1)],
+             "hand_position": 11},
+        ]
+        poses = LeftHandPoses(rig, handDicts, normal, 5, 0.1)
+        for item, fingerInfos in zip(handDicts, poses.fingerInfos()):
+            expected = animatedLeftHand(rig, item, normal, 5, item.get(
+                "pitchwheel", 0), rest_finger_distance=0.1)
+            self.assertEqual(json.dumps(fingerInfos), json.dumps(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import json
+import os
+import tempfile
+import unittest
+from src.utils.columnar import ColumnarFile, loadRecords, saveRecords
+
+
+class TestColumnar(unittest.TestCase):
+    def test_round_trip(self):
+        # 转成列式文件再读回来，json序列化的结果要完全一致
+        records = [
+            {"real_tick": 0.0, "frame": 0, "leftHand": [
+                {"fingerIndex": -1, "fingerInfo": {"stringIndex": 2, "fret": 0, "press": 0}}], "use_barre": False},
+            {"real_tick": 480.0, "frame": 15.5, "leftHand": [], "use_barre": True, "pitchwheel": 100},
+            {"frame": 20.0, "fingerInfos": {"H_L": [0.1, 0.2, 0.3]}, "strings": ["p", "i"], "other": None},
+        ]
+        with tempfile.TemporaryDirectory() as tempDir:
+            filePath = os.path.join(tempDir, "records.fdcol")
+            saveRecords(filePath, records)
+            self.assertEqual(json.dumps(loadRecords(filePath)),
+                             json.dumps(records))
+            # 单独读取一列时不需要解码整个文件
+            self.assertEqual(ColumnarFile(filePath).column(
+                "[].frame").tolist(), [0, 15.5, 20.0])
+
+    def test_keys_with_path_characters(self):
+        # 键里含有列路径用到的字符时，不同的字段也不能写到同一列里
+        records = [{"a.b": 1, "a": {"b": 2.5}, "c[]": [3], "c": ["x"], "d#int": True, "d": 4.5, "e%2E": 0}]
+        with tempfile.TemporaryDirectory() as tempDir:
+            filePath = os.path.join(tempDir, "records.fdcol")
+            saveRecords(filePath, records)
+            self.assertEqual(loadRecords(filePath), records)
+
+    def test_load_records_in_memory(self):
+        # 传入内存中的记录时原样返回，供流水线各阶段直接传递数据
+        records = [{"frame": 1.0, "strings": [0, 1]}]
+        self.assertIs(loadRecords(records), records)
+
+
+if __name__ == '__main__':
+    unittest.main()
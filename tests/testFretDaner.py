@@ -0,0 +1,268 @@
+import contextlib
+import copy
+import io
+import json
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+from FretDaner import createInitLeftHandPool, getBatchJobName, getBatchJobOutputFiles, isBatchJobUpToDate, makeBatchJobStamp, normalizeBatchJob, generateLeftHandRecoder, solve_left_hand_exact, update_pool_incrementally, update_recorder_pool, update_recorder_pool_segmented
+from src.animate.animate import ElectronicRightHand2Animation, animated_guitar_string, updateAnimation
+from src.guitar.Guitar import Guitar
+from src.guitar.GuitarString import createGuitarStrings
+from src.HandPoseRecorder import HandPoseRecorder, OnlineDecoder
+from src.midi.midiToNote import TempoMap, get_tempo_changes, midiToGuitarNotes
+from src.utils.checkpoint import SearchCheckpoint, SearchSnapshots
+
+
+class TestExactSolver(unittest.TestCase):
+    def test_solve_left_hand_exact(self):
+        # 精确求解的熵要等于不限大小的记录池穷举所有路径得到的最小熵，而只保留1条路径的束搜索会错过它
+        guitar = Guitar(createGuitarStrings(["e", "b", "G", "D", "A", "E1"]))
+        notes_map = [{"notes": notes, "real_tick": i * 480}
+                     for i, notes in enumerate([[72], [45, 60], [77], [43, 55]])]
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            fullPool = createInitLeftHandPool(guitar, 10**9)
+            update_recorder_pool(len(notes_map), guitar,
+                                 fullPool, notes_map, 0, 0)
+            greedyPool = createInitLeftHandPool(guitar, 1)
+            update_recorder_pool(len(notes_map), guitar,
+                                 greedyPool, notes_map, 0, 0)
+            exactPool, info = solve_left_hand_exact(guitar, notes_map)
+            _, truncatedInfo = solve_left_hand_exact(
+                guitar, notes_map, max_states=5)
+
+        best = fullPool.curHandPoseRecordPool[0].currentEntropy
+        self.assertEqual(exactPool.curHandPoseRecordPool[0].currentEntropy, best)
+        self.assertLess(best, greedyPool.curHandPoseRecordPool[0].currentEntropy)
+        self.assertTrue(info["exact"])
+        self.assertFalse(truncatedInfo["exact"])
+
+
+class TestSegmented(unittest.TestCase):
+    def test_segmented_equals_sequential(self):
+        # 在有切分点的曲子上，分段搜索接上的结果要与顺序搜索相同
+        midi = "asset/midi/Aguado_12valses_Op1_No2.mid"
+        _, ticks_per_beat = get_tempo_changes(midi)
+        guitar = Guitar(createGuitarStrings(["e", "b", "G", "D", "A", "E1"]))
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            notes_map = midiToGuitarNotes(midi, [0], -1)[0][:160]
+            sequentialPool = createInitLeftHandPool(guitar, 100)
+            update_recorder_pool(len(notes_map), guitar,
+                                 sequentialPool, notes_map, 0, 0)
+            segmentedPool = createInitLeftHandPool(guitar, 100)
+            info = update_recorder_pool_segmented(
+                guitar, segmentedPool, notes_map, 2 * ticks_per_beat, 2)
+
+        self.assertEqual(info["segments"], 2)
+        self.assertEqual(info["joined"], 1)
+        self.assertLess(info["research_events"], len(notes_map) - info["breaks"][0])
+        self.assertAlmostEqual(segmentedPool.curHandPoseRecordPool[0].currentEntropy,
+                               sequentialPool.curHandPoseRecordPool[0].currentEntropy)
+
+
+class TestOnlineDecoder(unittest.TestCase):
+    def test_online_equals_offline(self):
+        # 在线提交的记录要与搜索完再读取最优解得到的记录完全相同
+        midi = "asset/midi/lemon.mid"
+        tempo_changes, ticks_per_beat = get_tempo_changes(midi)
+        tempoMap = TempoMap(tempo_changes, ticks_per_beat, 30)
+        guitar = Guitar(createGuitarStrings(["e", "b", "G", "D", "A", "E1"]))
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            notes_map = midiToGuitarNotes(midi, [1], -1)[0][:80]
+            offlinePool = createInitLeftHandPool(guitar, 100)
+            update_recorder_pool(len(notes_map), guitar,
+                                 offlinePool, notes_map, 0, 0)
+            onlinePool = createInitLeftHandPool(guitar, 100)
+            decoder = OnlineDecoder(HandPoseRecorder, tempoMap)
+            update_recorder_pool(len(notes_map), guitar,
+                                 onlinePool, notes_map, 0, 0, decoder=decoder)
+            committedBeforeFinish = decoder.committedLength
+            laggedPool = createInitLeftHandPool(guitar, 100)
+            laggedDecoder = OnlineDecoder(HandPoseRecorder, tempoMap, max_lag=4)
+            update_recorder_pool(len(notes_map), guitar,
+                                 laggedPool, notes_map, 0, 0, decoder=laggedDecoder)
+
+        offline = offlinePool.curHandPoseRecordPool[0].toRecords(
+            tempo_changes, ticks_per_beat, 30)
+        self.assertGreater(committedBeforeFinish, 1)
+        self.assertEqual(decoder.finish(
+            onlinePool.curHandPoseRecordPool[0]), offline)
+        # 强制提交后未提交的路径不会超过max_lag
+        laggedRecords = laggedDecoder.finish(
+            laggedPool.curHandPoseRecordPool[0])
+        self.assertLessEqual(laggedDecoder.maxLag, 4)
+        self.assertEqual(len(laggedRecords), len(offline))
+
+    def test_forced_commit_is_not_exact(self):
+        # 强制提交丢弃了记录器以后，精确求解的结果不再保证是最优解
+        midi = "asset/midi/lemon.mid"
+        tempo_changes, ticks_per_beat = get_tempo_changes(midi)
+        tempoMap = TempoMap(tempo_changes, ticks_per_beat, 30)
+        guitar = Guitar(createGuitarStrings(["e", "b", "G", "D", "A", "E1"]))
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            notes_map = midiToGuitarNotes(midi, [1], -1)[0][:40]
+            _, info = solve_left_hand_exact(
+                guitar, notes_map, decoder=OnlineDecoder(HandPoseRecorder, tempoMap))
+            laggedDecoder = OnlineDecoder(HandPoseRecorder, tempoMap, max_lag=2)
+            _, laggedInfo = solve_left_hand_exact(
+                guitar, notes_map, decoder=laggedDecoder)
+
+        self.assertTrue(info["exact"])
+        self.assertGreater(laggedDecoder.forcedCommits, 0)
+        self.assertFalse(laggedInfo["exact"])
+
+
+class TestBatch(unittest.TestCase):
+    def test_jobs_do_not_share_files(self):
+        # 同一首曲子只有定弦或者角色不同的任务，日志和输出文件都不能相同
+        job = normalizeBatchJob(
+            {"midi": "asset/midi/lemon.mid", "tracks": [1], "avatar": "julia"})
+        others = [normalizeBatchJob({**job, "tuning": ["d", "b", "G", "D", "A", "D1"]}),
+                  normalizeBatchJob({**job, "avatar": "julia_E"}),
+                  normalizeBatchJob({**job, "seed": 1})]
+        for other in others:
+            self.assertNotEqual(getBatchJobName(job), getBatchJobName(other))
+            self.assertTrue(set(getBatchJobOutputFiles(job).values()).isdisjoint(
+                getBatchJobOutputFiles(other).values()))
+
+    def test_up_to_date(self):
+        # 输出文件被改动或者删除以后，任务就不再是最新的
+        midiFilePath = os.path.abspath("asset/midi/lemon.mid")
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tempDir:
+            os.chdir(tempDir)
+            try:
+                job = normalizeBatchJob(
+                    {"midi": midiFilePath, "tracks": [1], "avatar": "julia"})
+                output_files = list(getBatchJobOutputFiles(job).values())
+                for output_file in output_files:
+                    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+                    with open(output_file, "w") as f:
+                        f.write("[]")
+                with open("job.done.json", "w") as f:
+                    json.dump(makeBatchJobStamp(job), f)
+                self.assertTrue(isBatchJobUpToDate(job, "job.done.json"))
+                self.assertFalse(isBatchJobUpToDate(
+                    normalizeBatchJob({**job, "capo": 2}), "job.done.json"))
+
+                with open(output_files[0], "w") as f:
+                    f.write("[{}]")
+                self.assertFalse(isBatchJobUpToDate(job, "job.done.json"))
+                os.remove(output_files[0])
+                self.assertFalse(isBatchJobUpToDate(job, "job.done.json"))
+            finally:
+                os.chdir(cwd)
+
+
+class TestCheckpoint(unittest.TestCase):
+    def test_resume(self):
+        # 中断后从检查点接着运行，结果要与不中断的运行完全相同
+        guitar = Guitar(createGuitarStrings(["e", "b", "G", "D", "A", "E1"]))
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()), tempfile.TemporaryDirectory() as tempDir:
+            notes_map = midiToGuitarNotes("asset/midi/lemon.mid", [1], -1)[0][:40]
+            fullPool = createInitLeftHandPool(guitar, 100)
+            update_recorder_pool(len(notes_map), guitar,
+                                 fullPool, notes_map, 0, 0)
+
+            checkpointPath = os.path.join(tempDir, "lefthand.fdckpt")
+            checkpoint = SearchCheckpoint(
+                checkpointPath, "lemon", HandPoseRecorder, 10)
+            # 只运行前25个事件，模拟运行到一半被中断
+            update_recorder_pool(25, guitar, createInitLeftHandPool(
+                guitar, 100), notes_map, 0, 0, checkpoint=checkpoint)
+            resumedPool = createInitLeftHandPool(guitar, 100)
+            start_step = checkpoint.load(resumedPool)
+            update_recorder_pool(len(notes_map), guitar, resumedPool, notes_map,
+                                 0, 0, checkpoint=checkpoint, start_step=start_step)
+            otherSong = SearchCheckpoint(
+                checkpointPath, "other", HandPoseRecorder, 10)
+
+            self.assertEqual(start_step, 25)
+            self.assertEqual(otherSong.load(
+                createInitLeftHandPool(guitar, 100)), 0)
+            self.assertEqual([recorder.currentEntropy for recorder in resumedPool.curHandPoseRecordPool],
+                             [recorder.currentEntropy for recorder in fullPool.curHandPoseRecordPool])
+            self.assertEqual(resumedPool.curHandPoseRecordPool[0].toRecords([(0, 500000, 0)], 480, 30),
+                             fullPool.curHandPoseRecordPool[0].toRecords([(0, 500000, 0)], 480, 30))
+
+
+class TestIncremental(unittest.TestCase):
+    def test_incremental_search(self):
+        # 改动一个音符后增量搜索的结果要与从头搜索相同，而且会接上上一次的结果
+        guitar = Guitar(createGuitarStrings(["e", "b", "G", "D", "A", "E1"]))
+
+        def search(notes_map, previous=None):
+            pool = createInitLeftHandPool(guitar, 100)
+            snapshots = SearchSnapshots(HandPoseRecorder, "lemon", 16)
+            info = update_pool_incrementally(notes_map, pool, lambda guitarNote: generateLeftHandRecoder(
+                guitarNote, guitar, pool, 0, 0), snapshots, previous)
+            return pool.curHandPoseRecordPool[0].toRecords([(0, 500000, 0)], 480, 30), snapshots, info
+
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()), tempfile.TemporaryDirectory() as tempDir:
+            notes_map = midiToGuitarNotes("asset/midi/lemon.mid", [1], -1)[0][:80]
+            oldRecords, snapshots, _ = search(notes_map)
+            snapshots.save(os.path.join(tempDir, "snapshots.fdckpt"))
+            previous = SearchSnapshots.load(os.path.join(
+                tempDir, "snapshots.fdckpt"), HandPoseRecorder, "lemon")
+
+            edited = copy.deepcopy(notes_map)
+            edited[30]["notes"] = [note + 2 for note in edited[30]["notes"]]
+            fullRecords, _, _ = search(edited)
+            incrementalRecords, _, info = search(edited, previous)
+
+        self.assertEqual(incrementalRecords, fullRecords)
+        self.assertEqual(info["start"], 16)
+        self.assertIsNotNone(info["rejoin"])
+
+        # 只重新生成改动附近的动画，结果与完整生成的相同
+        oldOffsets = []
+        oldAnimation = animated_guitar_string(oldRecords, None, 30, oldOffsets)
+        offsets = []
+        fullOffsets = []
+        animation, start, end = updateAnimation(lambda records, record_offsets: animated_guitar_string(
+            records, None, 30, record_offsets), oldRecords, fullRecords, oldAnimation, oldOffsets, offsets)
+        self.assertEqual(animation, animated_guitar_string(
+            fullRecords, None, 30, fullOffsets))
+        self.assertEqual(offsets, fullOffsets)
+        self.assertLess(end - start, len(fullRecords))
+
+    def test_stateful_animation(self):
+        # 电吉他右手的pick位置会从一个记录带到下一个记录，拼接的结果也要与完整生成的相同
+        def pick(avatar, stringIndex, isArpeggio, should_stay_at_lower_position, guitar_max_string_index=5):
+            return {"T_R": [stringIndex, isArpeggio, should_stay_at_lower_position]}
+
+        def animate(records, record_offsets):
+            return ElectronicRightHand2Animation("test_E", records, None, 30, record_offsets=record_offsets)
+
+        rng = random.Random(0)
+
+        def randomRecord(frame):
+            return {"frame": frame, "strings": sorted(rng.sample(range(6), rng.randint(1, 5)))}
+
+        with mock.patch("src.animate.animate.calculateRightPick", pick):
+            oldRecords = [randomRecord(i * 10) for i in range(40)]
+            oldOffsets = []
+            oldAnimation = animate(oldRecords, oldOffsets)
+            for _ in range(50):
+                newRecords = copy.deepcopy(oldRecords)
+                index = rng.randrange(len(newRecords))
+                # 修改、插入或者删除一个记录
+                operation = rng.randrange(3)
+                if operation == 0:
+                    newRecords[index] = randomRecord(newRecords[index]["frame"])
+                elif operation == 1:
+                    newRecords.insert(index, randomRecord(newRecords[index]["frame"] - 5))
+                else:
+                    del newRecords[index]
+                offsets = []
+                fullOffsets = []
+                animation, _, _ = updateAnimation(
+                    animate, oldRecords, newRecords, oldAnimation, oldOffsets, offsets, stateful=True)
+                self.assertEqual(animation, animate(newRecords, fullOffsets))
+                self.assertEqual(offsets, fullOffsets)
+
+
+if __name__ == '__main__':
+    unittest.main()
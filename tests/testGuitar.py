@@ -0,0 +1,23 @@
+import unittest
+from src.guitar.Guitar import Guitar
+from src.guitar.GuitarString import createGuitarStrings
+
+
+class TestGuitar(unittest.TestCase):
+    def test_getNotePositions(self):
+        guitar = Guitar(createGuitarStrings(
+            ["e", "b", "G", "D", "A", "E1"]), True)
+        # 索引里的每个位置都要能用弦的音高还原回这个音符
+        for note, positions in guitar.notePositions.items():
+            for string_index, fret, is_harmonic in positions:
+                if not is_harmonic:
+                    self.assertEqual(
+                        guitar.guitarStrings[string_index].getBaseNote() + fret, note)
+        # 索引是只读的
+        with self.assertRaises(TypeError):
+            guitar.notePositions[0] = ()  # type: ignore
+        self.assertEqual(guitar.getNotePositions(0), ())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import random
+import unittest
+from src.HandPoseRecorder import HandPoseRecordPool, HandPoseRecorder, RightHandRecorder, flattenRecorders, unflattenRecorders
+from src.hand.RightHand import RightHand
+
+
+class TestHandPoseRecordPool(unittest.TestCase):
+    def test_ranking(self):
+        # 池子的最终结果应该等于所有候选按熵值稳定排序后取前size个
+        random.seed(1)
+        pool = HandPoseRecordPool(10)
+        candidates = []
+        for i in range(200):
+            recorder = HandPoseRecorder()
+            # 故意制造大量相同的熵值
+            recorder.currentEntropy = float(random.randint(0, 30))
+            candidates.append(recorder)
+            index = pool.check_insert_index(recorder.currentEntropy)
+            if index != -1:
+                pool.insert_new_hand_pose_recorder(recorder, index)
+
+        expected = sorted(candidates, key=lambda x: x.currentEntropy)[:10]
+        self.assertEqual(len(pool.curHandPoseRecordPool), 10)
+        for recorder, expected_recorder in zip(pool.curHandPoseRecordPool, expected):
+            self.assertIs(recorder, expected_recorder)
+
+    def test_merge_states(self):
+        # 合并状态时，结果应该等于所有候选按熵值稳定排序后每种手型状态取第一个，再取前size个
+        random.seed(2)
+        pool = HandPoseRecordPool(5, merge_states=True)
+        candidates = []
+        for i in range(200):
+            recorder = RightHandRecorder()
+            recorder.addHandPose(RightHand(random.choice([["p"], ["i"], ["p", "m"]]), [
+                                 5, random.randint(0, 3), 1, 0], []), float(random.randint(0, 30)), 0)
+            candidates.append(recorder)
+            index = pool.check_insert_index(recorder.currentEntropy)
+            if index != -1:
+                pool.insert_new_hand_pose_recorder(recorder, index)
+
+        expected = {}
+        for recorder in sorted(candidates, key=lambda x: x.currentEntropy):
+            expected.setdefault(recorder.currentHandPose().stateKey(), recorder)
+        self.assertEqual(pool.curHandPoseRecordPool,
+                         list(expected.values())[:5])
+        self.assertEqual(pool.curEntropys, [
+                         recorder.currentEntropy for recorder in pool.curHandPoseRecordPool])
+
+        pool.setRecorders(candidates)
+        self.assertEqual(pool.curHandPoseRecordPool,
+                         list(expected.values())[:5])
+
+
+class TestFlattenRecorders(unittest.TestCase):
+    def test_round_trip(self):
+        # 共享前缀的记录器展开再重建以后，路径和共享关系都不变
+        root = HandPoseRecorder()
+        root.addHandPose("init", 0, 0)
+        recorders = [root]
+        for i in range(3000):
+            recorders.append(recorders[-1].extend(f"hand{i}", 1.5, i + 1))
+        branch = recorders[1000].extend("branch", 2.0, 1001)
+        flatNodes, tails = flattenRecorders([recorders[-1], branch])
+        self.assertEqual(len(flatNodes), 3002)
+
+        longest, rebuiltBranch = unflattenRecorders(
+            flatNodes, tails, HandPoseRecorder)
+        self.assertEqual(longest.handPoseList, recorders[-1].handPoseList)
+        self.assertEqual(longest.entropys, recorders[-1].entropys)
+        self.assertEqual(rebuiltBranch.currentEntropy, branch.currentEntropy)
+        self.assertIs(rebuiltBranch.nodes()[1000], longest.nodes()[1000])
+
+
+if __name__ == "__main__":
+    unittest.main()
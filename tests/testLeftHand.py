@@ -0,0 +1,59 @@
+import copy
+import random
+import unittest
+from src.guitar.Guitar import Guitar
+from src.guitar.GuitarString import createGuitarStrings
+from src.hand.LeftFinger import LeftFinger
+from src.hand.LeftHand import LeftHand, caculateDiffMatrix
+from src.utils.utils import convertNotesToFingerPositions
+
+
+class TestLeftHand(unittest.TestCase):
+    def test_caculateDiffMatrix(self):
+        # 矩阵计算的熵要与逐个调用caculateDiff的结果逐位相同
+        random.seed(2)
+        guitar = Guitar(createGuitarStrings(
+            ["e", "b", "G", "D", "A", "E1"]), True)
+        hand = LeftHand([LeftFinger(index, guitar.guitarStrings[2], index)
+                        for index in range(1, 5)])
+        hands = [hand]
+        candidates = []
+        while len(candidates) < 60:
+            notes = sorted(set(random.randint(40, 80)
+                           for _ in range(random.randint(1, 3))))
+            for fingerPositions in convertNotesToFingerPositions(notes, guitar):
+                oldhand = random.choice(hands)
+                all_fingers, _, use_barre = oldhand.generateNextHands(
+                    guitar, fingerPositions)
+                if all_fingers is not None:
+                    candidates.append((all_fingers, LeftHand.calculateNextHandPosition(
+                        fingerPositions) or oldhand.handPosition))
+                    hands.append(LeftHand(all_fingers, use_barre))
+
+        candidates = candidates[:60]
+        matrix = caculateDiffMatrix(hands, [fingers for fingers, _ in candidates], [
+                                    position for _, position in candidates], guitar)
+        for row, oldhand in enumerate(hands):
+            for column, (fingers, position) in enumerate(candidates):
+                self.assertEqual(matrix[row, column], oldhand.caculateDiff(
+                    fingers, position, guitar))
+
+    def test_candidateStateKey(self):
+        # 不生成手型算出的状态键要与生成手型以后的stateKey相同
+        guitar = Guitar(createGuitarStrings(
+            ["e", "b", "G", "D", "A", "E1"]), True)
+        hand = LeftHand([LeftFinger(index, guitar.guitarStrings[2], index + 4)
+                        for index in range(1, 5)])
+        for notes in ([45, 60], [40, 59, 64], [52], [48, 55, 64]):
+            for fingerPositions in convertNotesToFingerPositions(notes, guitar):
+                all_fingers, _, use_barre = hand.generateNextHands(
+                    guitar, fingerPositions)
+                if all_fingers is None:
+                    continue
+                stateKey = LeftHand.candidateStateKey(all_fingers, use_barre)
+                self.assertEqual(stateKey, LeftHand(
+                    [copy.copy(finger) for finger in all_fingers], use_barre).stateKey())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import random
+import unittest
+import numpy as np
+from src.midi.midiToNote import MidiSession, TempoMap, calculate_frame, getMidiSession
+
+MIDI_FILE = os.path.join(os.path.dirname(__file__),
+                         "..", "asset", "midi", "No_Thank_You.mid")
+
+
+class TestMidiSession(unittest.TestCase):
+    def test_iterNoteEvents(self):
+        # 堆合并的结果要与把各轨道拼接以后再稳定排序的结果一致
+        session = MidiSession(MIDI_FILE)
+        tracks = list(range(len(session.tracks)))
+        expected = []
+        for track in tracks:
+            expected += [event for kind, event in MidiSession.iterTrackEvents(
+                session.tracks[track], -1, False, 0) if kind == "notes"]
+        expected.sort(key=lambda event: event["real_tick"])
+        self.assertEqual(list(session.iterNoteEvents(tracks, -1)), expected)
+
+    def test_collectEvents(self):
+        # 每个轨道只解码一次得到的各种事件，要与逐种合并的结果相同
+        session = MidiSession(MIDI_FILE)
+        tracks = list(range(len(session.tracks)))
+        events = session.collectEvents(tracks, -1)
+        for kind in ("message", "notes", "pitchwheel"):
+            self.assertEqual(events[kind], list(
+                session.iterEvents(kind, tracks, -1)))
+
+    def test_getMidiSession(self):
+        # 同一个文件只解析一次
+        self.assertIs(getMidiSession(MIDI_FILE), getMidiSession(MIDI_FILE))
+
+
+class TestTempoMap(unittest.TestCase):
+    def test_ticks_to_frames(self):
+        # 前缀和与二分查找的结果要与calculate_frame逐位相同，包括没有按tick排序的多轨速度变化
+        random.seed(4)
+        for _ in range(50):
+            tempo_changes = [(random.randint(0, 3), random.randint(200000, 1500000), random.randint(0, 5000))
+                             for _ in range(random.randint(0, 20))]
+            tempoMap = TempoMap(tempo_changes, 480, 30)
+            ticks = [random.randint(-10, 6000) + random.choice([0.0, 0.5])
+                     for _ in range(50)]
+            frames = tempoMap.ticks_to_frames(np.array(ticks))
+            for tick, frame in zip(ticks, frames):
+                expected = calculate_frame(tempo_changes, 480, 30, tick)
+                self.assertEqual(tempoMap.tick_to_frame(tick), expected)
+                self.assertEqual(frame, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
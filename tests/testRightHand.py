@@ -0,0 +1,33 @@
+import random
+import unittest
+from src.hand.RightHand import RightHand, caculateRightHandDiffMatrix, generatePossibleRightHands
+
+
+class TestRightHand(unittest.TestCase):
+    def test_caculateRightHandDiffMatrix(self):
+        # 矩阵计算的熵要与逐个调用caculateDiff的结果逐位相同，包括p指双拨的手型
+        random.seed(3)
+        combinations = generatePossibleRightHands(
+            [4, 3, 0], ["p", "p", "i", "m", "a"], list(range(6)))
+        combinations += generatePossibleRightHands(
+            [2, 1], ["p", "i", "m", "a"], list(range(6)))
+        combinations = random.sample(combinations, 40)
+        combinations.append({'usedFingers': [], 'rightFingerPositions': [5, 4, 3, 2]})
+
+        hands = [RightHand([], [5, 2, 1, 0], [])]
+        for combination in random.sample(combinations, 20):
+            hands.append(RightHand(combination['usedFingers'], combination['rightFingerPositions'],
+                                   random.choice(hands).usedFingers))
+
+        matrix = caculateRightHandDiffMatrix(hands, [combination['usedFingers'] for combination in combinations], [
+                                             combination['rightFingerPositions'] for combination in combinations])
+        for row, oldhand in enumerate(hands):
+            for column, combination in enumerate(combinations):
+                newhand = RightHand(
+                    combination['usedFingers'], combination['rightFingerPositions'], oldhand.usedFingers)
+                self.assertEqual(matrix[row, column],
+                                 oldhand.caculateDiff(newhand))
+
+
+if __name__ == '__main__':
+    unittest.main()
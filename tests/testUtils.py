@@ -1,5 +1,11 @@
+import os
+import random
+import tempfile
 import unittest
-from src.utils.utils import verifyValidCombination
+import numpy as np
+from src.hand.RightHand import generatePossibleRightHands
+from src.utils.right_hand_table import RightHandFingeringTable
+from src.utils.utils import verifyValidCombination, generate_combinations_iter, generate_pruned_combinations_iter, slerp, slerp_many
 
 
 class TestUtils(unittest.TestCase):
@@ -24,6 +30,63 @@ class TestUtils(unittest.TestCase):
         ]
         self.assertEqual(verifyValidCombination(result), False)
 
+    def test_generate_pruned_combinations_iter(self):
+        # 剪枝生成器的结果和顺序都要与先穷举再验证的结果完全一致
+        random.seed(0)
+        for _ in range(500):
+            strings = random.sample(range(6), random.randint(0, 6))
+            chord = [{'index': string, 'fret': random.choice([0, 1, 2, 3, 5, 7, 12])}
+                     for string in strings]
+            expected = [tuple((note['index'], note['fret'], note.get('finger', -1)) for note in combination)
+                        for combination in generate_combinations_iter(chord, [1, 2, 3, 4]) if verifyValidCombination(combination)]
+            result = list(generate_pruned_combinations_iter(
+                [(note['index'], note['fret']) for note in chord]))
+            self.assertEqual(result, expected)
+
+    def test_slerp_many(self):
+        # 批量插值的每一行都要与slerp的结果相同，包括相同、非常接近和几乎相反的四元数
+        rng = np.random.default_rng(0)
+        q1 = rng.normal(size=(200, 4))
+        q2 = rng.normal(size=(200, 4))
+        q2[:20] = q1[:20]
+        q2[20:40] = q1[20:40] + rng.normal(scale=1e-3, size=(20, 4))
+        q2[40:60] = -q1[40:60] + rng.normal(scale=1e-3, size=(20, 4))
+        t = rng.random(200)
+        with np.errstate(all="ignore"):
+            expected = np.array([slerp(q1[i], q2[i], t[i])
+                                for i in range(200)])
+            result = slerp_many(q1, q2, t)
+        np.testing.assert_array_equal(result, expected)
+
+        # 较短的路径：q2取反表示同一个旋转，插值的结果也要表示同一个旋转
+        with np.errstate(all="ignore"):
+            flipped = slerp_many(q1, -q2, t)
+        np.testing.assert_allclose(
+            np.abs(np.sum(flipped * result, axis=1)), 1, atol=1e-9)
+        # 非常接近取反的四元数表示几乎相同的旋转，结果也要接近q1
+        unit1 = q1[40:60] / np.linalg.norm(q1[40:60], axis=1)[:, None]
+        self.assertTrue(
+            (np.abs(np.sum(result[40:60] * unit1, axis=1)) > 0.999).all())
+
+    def test_right_hand_table(self):
+        # 查表得到的右手拨法要与递归生成的结果顺序完全一致，保存再读取以后也一样
+        table = RightHandFingeringTable()
+        expected = generatePossibleRightHands(
+            [4, 3, 1], ["p", "p", "i", "m", "a"], list(range(6)))
+        self.assertEqual(table.getCombinations([4, 3, 1], True, 5), expected)
+        self.assertIs(table.getCombinations(
+            [4, 3, 1], True, 5), table.getCombinations([4, 3, 1], True, 5))
+        self.assertEqual(table.getCombinations([2], False, 5), generatePossibleRightHands(
+            [2], ["p", "i", "m", "a"], list(range(6))))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            table_file = os.path.join(tmpdir, "right_hand_table.json")
+            table.save(table_file)
+            loaded = RightHandFingeringTable()
+            self.assertEqual(loaded.load(table_file), 2)
+        self.assertEqual(loaded.getCombinations([4, 3, 1], True, 5), expected)
+        self.assertEqual(loaded.misses, 0)
+
 
 if __name__ == "__main__":
     unittest.main()